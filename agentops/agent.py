@@ -1,9 +1,58 @@
 from typing import Union
 
+from .helpers import current_agent_id
 from .log_config import logger
 from uuid import uuid4
 from agentops import Client
-from inspect import isclass, isfunction
+from functools import wraps
+from inspect import (
+    getattr_static,
+    isclass,
+    iscoroutinefunction,
+    isfunction,
+    isgeneratorfunction,
+)
+
+
+def _bind_agent_id(func, get_agent_id):
+    """Wrap `func` so events recorded while it runs are attributed to the agent `get_agent_id` returns."""
+    if iscoroutinefunction(func):
+
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            token = current_agent_id.set(get_agent_id(args))
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                current_agent_id.reset(token)
+
+        return async_wrapper
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        token = current_agent_id.set(get_agent_id(args))
+        try:
+            return func(*args, **kwargs)
+        finally:
+            current_agent_id.reset(token)
+
+    return wrapper
+
+
+def _instance_agent_id(args):
+    return getattr(args[0], "agent_ops_agent_id", None) if args else None
+
+
+def _bind_methods(cls) -> None:
+    """Attribute to the instance's agent everything recorded in the methods of `cls`, inherited ones included."""
+    for name in dir(cls):
+        if name.startswith("__") and name != "__call__":
+            continue
+        method = getattr_static(cls, name)
+        # Generators run after the call returns, outside the context it would set
+        if not isfunction(method) or isgeneratorfunction(method):
+            continue
+        setattr(cls, name, _bind_agent_id(method, _instance_agent_id))
 
 
 def track_agent(name: Union[str, None] = None):
@@ -13,11 +62,16 @@ def track_agent(name: Union[str, None] = None):
 
         if isclass(obj):
             original_init = obj.__init__
+            _bind_methods(obj)
 
             def new_init(self, *args, **kwargs):
                 try:
-                    original_init(self, *args, **kwargs)
                     self.agent_ops_agent_id = str(uuid4())
+                    token = current_agent_id.set(self.agent_ops_agent_id)
+                    try:
+                        original_init(self, *args, **kwargs)
+                    finally:
+                        current_agent_id.reset(token)
 
                     session = kwargs.get("session", None)
                     if session is not None:
@@ -38,10 +92,10 @@ def track_agent(name: Union[str, None] = None):
             obj.__init__ = new_init
 
         elif isfunction(obj):
-            obj.agent_ops_agent_id = str(uuid4())
-            Client().create_agent(
-                name=obj.agent_ops_agent_name, agent_id=obj.agent_ops_agent_id
-            )
+            agent_id = str(uuid4())
+            obj.agent_ops_agent_id = agent_id
+            Client().create_agent(name=obj.agent_ops_agent_name, agent_id=agent_id)
+            obj = _bind_agent_id(obj, lambda _: agent_id)
 
         else:
             raise Exception("Invalid input, 'obj' must be a class or a function")
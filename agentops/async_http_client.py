@@ -0,0 +1,263 @@
+"""
+AgentOps asyncio HTTP transport.
+
+Classes:
+    AsyncHttpBackend: Interface for sending a single HTTP POST from a coroutine.
+    StreamsBackend: AsyncHttpBackend built on stdlib asyncio streams.
+    AsyncHttpClient: Awaitable counterpart of HttpClient.
+"""
+
+import asyncio
+import os
+import ssl
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.utils import get_environ_proxies, select_proxy
+
+from .http_client import (
+    DEFAULT_COMPRESSION_THRESHOLD,
+    HttpClient,
+    HttpStatus,
+    Response,
+)
+from .log_config import logger
+from .metrics import metrics
+
+DEFAULT_TIMEOUT = 20.0
+
+
+class NotSentError(OSError):
+    """
+    Raised by an AsyncHttpBackend when the request never reached the server, e.g. the connection
+    was refused, so sending it again can't duplicate it.
+    """
+
+
+class AsyncHttpBackend:
+    """
+    Sends one HTTP POST without blocking the event loop. Subclass and pass to
+    `AsyncHttpClient.set_backend` to use another library, e.g. aiohttp or httpx. Raise
+    NotSentError for failures before the request was sent; only those are retried in place.
+    """
+
+    async def post(
+        self, url: str, data: bytes, headers: Dict[str, str], timeout: float
+    ) -> Tuple[int, bytes, Dict[str, str]]:
+        """
+        Returns:
+            Tuple[int, bytes, Dict[str, str]]: The response status code, body and headers,
+                with lower-case header names.
+        """
+        raise NotImplementedError
+
+
+def _default_ssl_context() -> ssl.SSLContext:
+    """Verify servers against the same CA bundle `requests` would use."""
+    bundle = os.environ.get("REQUESTS_CA_BUNDLE") or os.environ.get("CURL_CA_BUNDLE")
+    if bundle and os.path.isdir(bundle):
+        return ssl.create_default_context(capath=bundle)
+    return ssl.create_default_context(cafile=bundle or requests.certs.where())
+
+
+def _post_with_requests(
+    url: str, data: bytes, headers: Dict[str, str], timeout: float
+) -> Tuple[int, bytes, Dict[str, str]]:
+    try:
+        res = HttpClient._get_session(url).post(
+            url, data=data, headers=headers, timeout=timeout
+        )
+    except requests.exceptions.RequestException as e:
+        if HttpClient._never_connected(e):
+            raise NotSentError(str(e))
+        if isinstance(e, requests.exceptions.Timeout):
+            raise asyncio.TimeoutError()
+        raise
+    return (
+        res.status_code,
+        res.content,
+        {name.lower(): value for name, value in res.headers.items()},
+    )
+
+
+class StreamsBackend(AsyncHttpBackend):
+    """
+    Minimal HTTP/1.1 client on `asyncio.open_connection`, one connection per request.
+
+    Like `requests`, servers are verified against REQUESTS_CA_BUNDLE or CURL_CA_BUNDLE if set.
+    Requests that HTTP_PROXY / HTTPS_PROXY route through a proxy, and NO_PROXY doesn't exempt,
+    are sent with `requests` on a worker thread instead, so they go the same way as
+    synchronous uploads.
+    """
+
+    def __init__(self, ssl_context: Optional[ssl.SSLContext] = None):
+        self._ssl_context = ssl_context
+
+    async def post(
+        self, url: str, data: bytes, headers: Dict[str, str], timeout: float
+    ) -> Tuple[int, bytes, Dict[str, str]]:
+        if select_proxy(url, get_environ_proxies(url)):
+            return await asyncio.get_running_loop().run_in_executor(
+                None, _post_with_requests, url, data, headers, timeout
+            )
+        return await asyncio.wait_for(self._post(url, data, headers), timeout)
+
+    async def _post(
+        self, url: str, data: bytes, headers: Dict[str, str]
+    ) -> Tuple[int, bytes, Dict[str, str]]:
+        parts = urlsplit(url)
+        is_https = parts.scheme == "https"
+        port = parts.port or (443 if is_https else 80)
+        ssl_context = None
+        if is_https:
+            if self._ssl_context is None:
+                self._ssl_context = _default_ssl_context()
+            ssl_context = self._ssl_context
+
+        try:
+            reader, writer = await asyncio.open_connection(
+                parts.hostname, port, ssl=ssl_context
+            )
+        except OSError as e:
+            raise NotSentError(str(e))
+        try:
+            target = parts.path or "/"
+            if parts.query:
+                target += "?" + parts.query
+
+            lines = [f"POST {target} HTTP/1.1", f"Host: {parts.netloc}"]
+            request_headers = dict(headers)
+            request_headers["Content-Length"] = str(len(data))
+            request_headers["Connection"] = "close"
+            lines.extend(f"{name}: {value}" for name, value in request_headers.items())
+            writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + data)
+            await writer.drain()
+
+            return await self._read_response(reader)
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (OSError, ssl.SSLError):
+                pass
+
+    @staticmethod
+    async def _read_response(
+        reader: asyncio.StreamReader,
+    ) -> Tuple[int, bytes, Dict[str, str]]:
+        status_line = await reader.readline()
+        code = int(status_line.split()[1])
+
+        response_headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            response_headers[name.strip().lower()] = value.strip()
+
+        if response_headers.get("transfer-encoding", "").lower() == "chunked":
+            body = b""
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    break
+                body += await reader.readexactly(size)
+                await reader.readline()
+            return code, body, response_headers
+
+        if "content-length" in response_headers:
+            body = await reader.readexactly(int(response_headers["content-length"]))
+            return code, body, response_headers
+
+        return code, await reader.read(), response_headers
+
+
+class AsyncHttpClient:
+    """
+    Awaitable counterpart of HttpClient: same headers, compression, retries and error handling, but
+    the request is sent by an AsyncHttpBackend so callers never block their event loop.
+    """
+
+    backend: AsyncHttpBackend = StreamsBackend()
+
+    @classmethod
+    def set_backend(cls, backend: AsyncHttpBackend) -> None:
+        cls.backend = backend
+
+    @staticmethod
+    async def _send(url: str, data: bytes, headers: dict) -> Response:
+        result = Response()
+        try:
+            code, content, response_headers = await AsyncHttpClient.backend.post(
+                url, data, headers, DEFAULT_TIMEOUT
+            )
+            result.parse_raw(code, content, response_headers)
+        except asyncio.TimeoutError:
+            result.code = 408
+            result.status = HttpStatus.TIMEOUT
+            logger.warning("Could not post data - connection timed out")
+        except NotSentError as e:
+            result.sent = False
+            result.body = {"error": str(e)}
+        except (OSError, ValueError, IndexError, asyncio.IncompleteReadError) as e:
+            result.body = {"error": str(e)}
+
+        return result
+
+    @staticmethod
+    async def _request(
+        url: str, data: bytes, headers: dict, force: bool = False
+    ) -> Response:
+        """`_send` with HttpClient's retries and circuit breakers."""
+        breaker = HttpClient._breaker(url)
+        if not breaker.allow() and not force:
+            return HttpClient._refused(url)
+
+        attempt, delay = 1, 0.0
+        while True:
+            result = await AsyncHttpClient._send(url, data, headers)
+            delay = HttpClient._retry_delay(breaker, result, attempt, delay)
+            if delay is None:
+                return result
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    @staticmethod
+    async def post(
+        url: str,
+        payload: bytes,
+        api_key: Optional[str] = None,
+        parent_key: Optional[str] = None,
+        jwt: Optional[str] = None,
+        header=None,
+        codec: Optional[str] = None,
+        compression_threshold: int = DEFAULT_COMPRESSION_THRESHOLD,
+        force: bool = False,
+    ) -> Response:
+        headers = HttpClient._build_headers(api_key, parent_key, jwt, header)
+        if codec is None or len(payload) < compression_threshold:
+            data, encoding = payload, None
+        else:
+            # Compressing a large batch takes long enough to stall the event loop
+            data, encoding = await asyncio.get_running_loop().run_in_executor(
+                None, HttpClient._compress, url, payload, codec, compression_threshold
+            )
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+
+        result = await AsyncHttpClient._request(url, data, headers, force)
+
+        if encoding is not None and HttpClient._rejects_encoding(result, encoding):
+            logger.debug("%s rejected %s request body - disabling", url, encoding)
+            HttpClient._rejected_codecs.add((HttpClient._origin(url), encoding))
+            del headers["Content-Encoding"]
+            data = payload
+            result = await AsyncHttpClient._request(url, data, headers, force)
+
+        metrics.increment("http.bytes_raw", len(payload))
+        metrics.increment("http.bytes_wire", len(data))
+        HttpClient._log_failure(result, api_key)
+
+        return result
@@ -22,12 +22,12 @@ from .enums import EndState
 from .exceptions import NoSessionException, MultiSessionException, ConfigurationError
 from .helpers import (
     get_ISO_time,
-    check_call_stack_for_agent_id,
+    get_current_agent_id,
     get_partner_frameworks,
     conditional_singleton,
 )
 from .session import Session
-from .host_env import get_host_env
+from .host_env import preload_host_env
 from .log_config import logger
 from .meta_client import MetaClient
 from .config import ClientConfiguration
@@ -114,6 +114,9 @@ class Client(metaclass=MetaClient):
             logger.warning("Failed to setup client Configuration")
             return
 
+        # Ready by the time the first session starts
+        preload_host_env(self._env_data_opt_out)
+
         self._handle_unclean_exits()
 
         instrument_llm_calls, auto_start_session = self._check_for_partner_frameworks(
@@ -233,7 +236,7 @@ class Client(metaclass=MetaClient):
         event = ActionEvent(
             params=arg_values,
             init_timestamp=init_time,
-            agent_id=check_call_stack_for_agent_id(),
+            agent_id=get_current_agent_id(),
             action_type=event_name,
         )
 
@@ -289,7 +292,7 @@ class Client(metaclass=MetaClient):
         event = ActionEvent(
             params=arg_values,
             init_timestamp=init_time,
-            agent_id=check_call_stack_for_agent_id(),
+            agent_id=get_current_agent_id(),
             action_type=event_name,
         )
 
@@ -359,13 +362,10 @@ class Client(metaclass=MetaClient):
         session = Session(
             session_id=session_id,
             tags=tags or self._tags_for_future_session,
-            host_env=get_host_env(self._env_data_opt_out),
             config=config or self.config,
+            env_data_opt_out=self._env_data_opt_out,
         )
 
-        if not session:
-            return logger.warning("Cannot start session - server rejected session")
-
         logger.info(
             colored(
                 f"\x1b[34mSession Replay: https://app.agentops.ai/drilldown?session_id={session.session_id}\x1b[0m",
@@ -5,10 +5,13 @@ Classes:
     ClientConfiguration: Stores the configuration settings for AgentOps clients.
 """
 
-from typing import Optional
+from typing import Optional, Union
 from os import environ
 
+from .enums import OverflowPolicy
 from .exceptions import ConfigurationError
+from .http_client import DEFAULT_COMPRESSION_THRESHOLD
+from .spool import DEFAULT_SPOOL_MAX_SIZE, default_spool_dir
 
 
 class ClientConfiguration:
@@ -24,6 +27,32 @@ class ClientConfiguration:
             be read from the AGENTOPS_API_ENDPOINT environment variable. Defaults to 'https://api.agentops.ai'.
         max_wait_time (int, optional): The maximum time to wait in milliseconds before flushing the queue. Defaults to 5000.
         max_queue_size (int, optional): The maximum size of the event queue. Defaults to 100.
+        max_batch_bytes (int, optional): The maximum size in bytes of a single event upload before compression.
+            Larger flushes are split into several uploads. Defaults to 4 MiB.
+        coalesce_uploads (bool, optional): Send the events of all sessions that are due together in one
+            multi-session upload, if the server supports it. Defaults to False.
+        compression (str, optional): Codec used to compress event uploads, e.g. "gzip", once the server has
+            said it can decode it. Set to None to disable compression. Falls back to uncompressed uploads if the
+            server rejects the codec. Defaults to "gzip".
+        compression_threshold (int, optional): Event uploads smaller than this many bytes are sent
+            uncompressed. Defaults to 1024.
+        max_buffer_size (int, optional): The maximum number of events a session holds in memory while
+            they wait to be sent. Defaults to 1000.
+        overflow_policy (OverflowPolicy, str, optional): What to do with new events when the buffer is full:
+            "block", "drop_oldest", "drop_newest" or "spill" (to disk, up to spool_max_size). Defaults to "drop_oldest".
+        overflow_block_timeout (float, optional): With the "block" policy, the maximum number of seconds
+            record() waits for room before dropping the event. Defaults to 1.
+        spool_dir (str, optional): Directory used for events written to disk. If none is provided, it will
+            be read from the AGENTOPS_SPOOL_DIR environment variable. It must belong to the current user,
+            and is created readable by them only. Defaults to an "agentops-<uid>" folder in the system
+            temp directory.
+        spool_enabled (bool, optional): Write event uploads that fail to the spool directory and replay them in the
+            background once the endpoint recovers, including on the next process start. If none is provided, it will
+            be read from the AGENTOPS_SPOOL_ENABLED environment variable. Defaults to False.
+        spool_max_size (int, optional): The maximum size in bytes of the spool. The oldest uploads are discarded
+            beyond it. Defaults to 64 MiB.
+        tag_update_interval (int, optional): The time in milliseconds over which tag changes are collected
+            into a single background session update. Defaults to 1000.
     """
 
     def __init__(
@@ -34,6 +63,17 @@ class ClientConfiguration:
         max_wait_time: Optional[int] = None,
         max_queue_size: Optional[int] = None,
         skip_auto_end_session: Optional[bool] = False,
+        max_batch_bytes: Optional[int] = None,
+        coalesce_uploads: Optional[bool] = False,
+        compression: Optional[str] = "gzip",
+        compression_threshold: Optional[int] = None,
+        max_buffer_size: Optional[int] = None,
+        overflow_policy: Optional[Union[OverflowPolicy, str]] = None,
+        overflow_block_timeout: Optional[float] = None,
+        spool_dir: Optional[str] = None,
+        spool_enabled: Optional[bool] = None,
+        spool_max_size: Optional[int] = None,
+        tag_update_interval: Optional[int] = None,
     ):
 
         if not api_key:
@@ -49,12 +89,49 @@ class ClientConfiguration:
         if not endpoint:
             endpoint = environ.get("AGENTOPS_API_ENDPOINT", "https://api.agentops.ai")
 
+        if not spool_dir:
+            spool_dir = environ.get("AGENTOPS_SPOOL_DIR", default_spool_dir())
+
+        if spool_enabled is None:
+            spool_enabled = (
+                environ.get("AGENTOPS_SPOOL_ENABLED", "False").lower() == "true"
+            )
+
+        try:
+            overflow_policy = OverflowPolicy(
+                overflow_policy or OverflowPolicy.DROP_OLDEST
+            )
+        except ValueError:
+            raise ConfigurationError(
+                f"Invalid overflow_policy {overflow_policy!r}. Options: "
+                + ", ".join(policy.value for policy in OverflowPolicy)
+            )
+
         self._api_key: str = api_key
         self._endpoint = endpoint
         self._max_wait_time = max_wait_time or 5000
         self._max_queue_size = max_queue_size or 100
+        self._max_batch_bytes = max_batch_bytes or 4 * 1024 * 1024
+        self._coalesce_uploads: bool = bool(coalesce_uploads)
+        self._tag_update_interval = (
+            tag_update_interval if tag_update_interval is not None else 1000
+        )
         self._parent_key: Optional[str] = parent_key
         self._skip_auto_end_session: Optional[bool] = skip_auto_end_session
+        self._compression: Optional[str] = compression
+        self._compression_threshold = (
+            compression_threshold
+            if compression_threshold is not None
+            else DEFAULT_COMPRESSION_THRESHOLD
+        )
+        self._max_buffer_size = max(max_buffer_size or 1000, self._max_queue_size)
+        self._overflow_policy: OverflowPolicy = overflow_policy
+        self._overflow_block_timeout = (
+            overflow_block_timeout if overflow_block_timeout is not None else 1.0
+        )
+        self._spool_dir: str = spool_dir
+        self._spool_enabled: bool = spool_enabled
+        self._spool_max_size = spool_max_size or DEFAULT_SPOOL_MAX_SIZE
 
     @property
     def api_key(self) -> str:
@@ -136,6 +213,66 @@ class ClientConfiguration:
         """
         self._max_queue_size = value
 
+    @property
+    def max_batch_bytes(self) -> int:
+        """
+        Get the maximum size in bytes of a single event upload.
+
+        Returns:
+            int: The maximum size of an event upload.
+        """
+        return self._max_batch_bytes
+
+    @max_batch_bytes.setter
+    def max_batch_bytes(self, value: int):
+        """
+        Set the maximum size in bytes of a single event upload.
+
+        Args:
+            value (int): The new maximum size of an event upload.
+        """
+        self._max_batch_bytes = value
+
+    @property
+    def coalesce_uploads(self) -> bool:
+        """
+        Get whether sessions share multi-session event uploads.
+
+        Returns:
+            bool: True if uploads are coalesced across sessions.
+        """
+        return self._coalesce_uploads
+
+    @coalesce_uploads.setter
+    def coalesce_uploads(self, value: bool):
+        """
+        Set whether sessions share multi-session event uploads.
+
+        Args:
+            value (bool): True to coalesce uploads across sessions.
+        """
+        self._coalesce_uploads = value
+
+    @property
+    def tag_update_interval(self) -> int:
+        """
+        Get the time over which tag changes are collected into one session update.
+
+        Returns:
+            int: The interval in milliseconds.
+        """
+        return self._tag_update_interval
+
+    @tag_update_interval.setter
+    def tag_update_interval(self, value: int):
+        """
+        Set the time over which tag changes are collected into one session update.
+
+        Args:
+            value (int): The new interval in milliseconds.
+        """
+        self._tag_update_interval = value
+
     @property
     def parent_key(self):
         return self._parent_key
@@ -147,3 +284,163 @@ class ClientConfiguration:
     @parent_key.setter
     def parent_key(self, value: str):
         self._parent_key = value
+
+    @property
+    def compression(self) -> Optional[str]:
+        """
+        Get the codec used to compress event uploads.
+
+        Returns:
+            str, optional: The codec name, or None if compression is disabled.
+        """
+        return self._compression
+
+    @compression.setter
+    def compression(self, value: Optional[str]):
+        """
+        Set the codec used to compress event uploads.
+
+        Args:
+            value (str, optional): The codec name, or None to disable compression.
+        """
+        self._compression = value
+
+    @property
+    def compression_threshold(self) -> int:
+        """
+        Get the size in bytes below which event uploads are sent uncompressed.
+
+        Returns:
+            int: The compression threshold.
+        """
+        return self._compression_threshold
+
+    @compression_threshold.setter
+    def compression_threshold(self, value: int):
+        """
+        Set the size in bytes below which event uploads are sent uncompressed.
+
+        Args:
+            value (int): The new compression threshold.
+        """
+        self._compression_threshold = value
+
+    @property
+    def max_buffer_size(self) -> int:
+        """
+        Get the maximum number of events a session holds in memory.
+
+        Returns:
+            int: The maximum buffer size.
+        """
+        return self._max_buffer_size
+
+    @max_buffer_size.setter
+    def max_buffer_size(self, value: int):
+        """
+        Set the maximum number of events a session holds in memory.
+
+        Args:
+            value (int): The new maximum buffer size.
+        """
+        self._max_buffer_size = value
+
+    @property
+    def overflow_policy(self) -> OverflowPolicy:
+        """
+        Get what happens to new events when the buffer is full.
+
+        Returns:
+            OverflowPolicy: The overflow policy.
+        """
+        return self._overflow_policy
+
+    @overflow_policy.setter
+    def overflow_policy(self, value: Union[OverflowPolicy, str]):
+        """
+        Set what happens to new events when the buffer is full.
+
+        Args:
+            value (OverflowPolicy, str): The new overflow policy.
+        """
+        self._overflow_policy = OverflowPolicy(value)
+
+    @property
+    def overflow_block_timeout(self) -> float:
+        """
+        Get how long record() waits for room with the "block" policy.
+
+        Returns:
+            float: The timeout in seconds.
+        """
+        return self._overflow_block_timeout
+
+    @overflow_block_timeout.setter
+    def overflow_block_timeout(self, value: float):
+        """
+        Set how long record() waits for room with the "block" policy.
+
+        Args:
+            value (float): The new timeout in seconds.
+        """
+        self._overflow_block_timeout = value
+
+    @property
+    def spool_dir(self) -> str:
+        """
+        Get the directory used for events written to disk.
+
+        Returns:
+            str: The spool directory.
+        """
+        return self._spool_dir
+
+    @spool_dir.setter
+    def spool_dir(self, value: str):
+        """
+        Set the directory used for events written to disk.
+
+        Args:
+            value (str): The new spool directory.
+        """
+        self._spool_dir = value
+
+    @property
+    def spool_enabled(self) -> bool:
+        """
+        Get whether failed event uploads are written to disk and replayed.
+
+        Returns:
+            bool: True if the spool is enabled.
+        """
+        return self._spool_enabled
+
+    @spool_enabled.setter
+    def spool_enabled(self, value: bool):
+        """
+        Set whether failed event uploads are written to disk and replayed.
+
+        Args:
+            value (bool): True to enable the spool.
+        """
+        self._spool_enabled = value
+
+    @property
+    def spool_max_size(self) -> int:
+        """
+        Get the maximum size in bytes of the spool.
+
+        Returns:
+            int: The maximum spool size.
+        """
+        return self._spool_max_size
+
+    @spool_max_size.setter
+    def spool_max_size(self, value: int):
+        """
+        Set the maximum size in bytes of the spool.
+
+        Args:
+            value (int): The new maximum spool size.
+        """
+        self._spool_max_size = value
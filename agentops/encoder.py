@@ -0,0 +1,82 @@
+"""
+AgentOps background event encoding.
+
+Classes:
+    EncodedEvent: A recorded event and, once encoded, its JSON bytes.
+    EventEncoder: Process-wide thread that encodes recorded events as soon as they are buffered.
+"""
+
+import queue
+import threading
+from typing import Optional
+
+from .helpers import safe_serialize_bytes
+from .log_config import logger
+
+
+class EncodedEvent:
+    """
+    A recorded event that is turned into JSON bytes exactly once, by whichever thread gets to
+    it first: normally the EventEncoder, otherwise the thread that flushes it. The event itself
+    is released as soon as it has been encoded.
+    """
+
+    __slots__ = ("_event", "_data")
+
+    def __init__(self, event: Optional[dict] = None, data: Optional[bytes] = None):
+        self._event = event
+        self._data = data
+
+    def encode(self) -> bytes:
+        """The event's JSON bytes, encoding it on the calling thread if that hasn't happened yet."""
+        data = self._data
+        if data is not None:
+            return data
+
+        event = self._event
+        if event is None:
+            # Encoded by another thread in the meantime; `_data` is set before `_event` is cleared
+            return self._data
+
+        data = safe_serialize_bytes(event)
+        self._data = data
+        self._event = None
+        return data
+
+
+class EventEncoder:
+    """
+    Encodes recorded events in a background thread, so neither the thread that records an event
+    nor the one that flushes it has to walk the event's payload.
+    """
+
+    def __init__(self):
+        self._queue: "queue.SimpleQueue[EncodedEvent]" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._thread_lock = threading.Lock()
+
+    def submit(self, event: EncodedEvent) -> None:
+        """Encode `event` in the background as soon as possible."""
+        if self._thread is None or not self._thread.is_alive():
+            self._start_thread()
+        self._queue.put(event)
+
+    def _start_thread(self) -> None:
+        with self._thread_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="agentops-encoder")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            event = self._queue.get()
+            try:
+                event.encode()
+            except Exception as e:
+                # Left unencoded; the flush reports it
+                logger.debug("Failed to encode event in the background: %s", e)
+
+
+encoder = EventEncoder()
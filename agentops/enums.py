@@ -13,3 +13,10 @@ class EndState(Enum):
     SUCCESS = "Success"
     FAIL = "Fail"
     INDETERMINATE = "Indeterminate"
+
+
+class OverflowPolicy(Enum):
+    BLOCK = "block"
+    DROP_OLDEST = "drop_oldest"
+    DROP_NEWEST = "drop_newest"
+    SPILL = "spill"
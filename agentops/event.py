@@ -7,7 +7,7 @@ Data Class:
 
 from dataclasses import dataclass, field
 from typing import Any, Dict, List, Optional, Sequence, Union
-from .helpers import get_ISO_time, check_call_stack_for_agent_id
+from .helpers import get_ISO_time, get_current_agent_id
 from .enums import EventType
 from uuid import UUID, uuid4
 import traceback
@@ -41,7 +41,7 @@ class Event:
     returns: Optional[Union[str, List[str]]] = None
     init_timestamp: str = field(default_factory=get_ISO_time)
     end_timestamp: Optional[str] = None
-    agent_id: Optional[UUID] = field(default_factory=check_call_stack_for_agent_id)
+    agent_id: Optional[UUID] = field(default_factory=get_current_agent_id)
     id: UUID = field(default_factory=uuid4)
 
 
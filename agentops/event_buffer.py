@@ -0,0 +1,164 @@
+"""
+AgentOps event buffer.
+
+Classes:
+    EventBuffer: Bounded buffer of recorded events waiting to be flushed.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from typing import Deque, List, Optional
+
+from .encoder import EncodedEvent
+from .enums import OverflowPolicy
+from .log_config import logger
+from .metrics import metrics
+from .spool import make_private_dir
+
+
+class EventBuffer:
+    """
+    Bounded, thread-safe buffer of recorded events waiting to be flushed.
+
+    When `capacity` events are buffered, `policy` decides what happens to a new one:
+        BLOCK: wait up to `block_timeout` seconds for a flush to make room, then drop it.
+        DROP_OLDEST: evict the oldest buffered event.
+        DROP_NEWEST: drop the new event.
+        SPILL: append the new event to `spill_path` on disk; it is read back on the next drain.
+            Spilling requires EncodedEvents, and spilled events come back already encoded. Once the
+            file holds `spill_max_size` bytes, new events are dropped.
+
+    Dropped and spilled events are counted in `dropped` / `spilled` and in the
+    `events.dropped` / `events.spilled` metrics.
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+        block_timeout: float = 1.0,
+        spill_path: Optional[str] = None,
+        spill_max_size: Optional[int] = None,
+    ):
+        self.capacity = capacity
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.spill_path = spill_path
+        self.spill_max_size = spill_max_size
+        self.dropped = 0
+        self.spilled = 0
+        self.oldest_time: Optional[float] = None
+        self._condition = threading.Condition()
+        self._events: Deque = deque()
+        self._spilled_pending = 0
+        self._spilled_bytes = 0
+        self._spill_full = False
+
+    def __len__(self) -> int:
+        with self._condition:
+            return len(self._events) + self._spilled_pending
+
+    def put(self, event) -> int:
+        """
+        Add `event` to the buffer, applying the overflow policy if it is full.
+
+        Returns:
+            int: The number of events buffered afterwards.
+        """
+        with self._condition:
+            if len(self._events) >= self.capacity and not self._make_room(event):
+                return len(self._events) + self._spilled_pending
+
+            self._events.append(event)
+            if self.oldest_time is None:
+                self.oldest_time = time.monotonic()
+            return len(self._events) + self._spilled_pending
+
+    def drain(self) -> List:
+        """Remove and return every buffered event, oldest first."""
+        with self._condition:
+            events = list(self._events)
+            self._events = deque()
+            if self._spilled_pending:
+                events.extend(self._read_spill())
+            self.oldest_time = None
+            self._condition.notify_all()
+            return events
+
+    def _make_room(self, event) -> bool:
+        """Apply the overflow policy. Returns True if `event` may now be appended."""
+        if self.policy == OverflowPolicy.BLOCK:
+            if self._condition.wait_for(
+                lambda: len(self._events) < self.capacity, self.block_timeout
+            ):
+                return True
+            self._drop()
+            return False
+
+        if self.policy == OverflowPolicy.DROP_OLDEST:
+            self._events.popleft()
+            self._drop()
+            return True
+
+        if self.policy == OverflowPolicy.SPILL and self._spill(event):
+            return False
+
+        self._drop()
+        return False
+
+    def _drop(self) -> None:
+        self.dropped += 1
+        metrics.increment("events.dropped")
+
+    def _spill(self, event) -> bool:
+        if self.spill_path is None:
+            return False
+
+        try:
+            data = event.encode() + b"\n"
+            if (
+                self.spill_max_size is not None
+                and self._spilled_bytes + len(data) > self.spill_max_size
+            ):
+                if not self._spill_full:
+                    self._spill_full = True
+                    logger.warning(
+                        "Spilled events reached %d bytes - dropping new events until the "
+                        "next flush",
+                        self.spill_max_size,
+                    )
+                return False
+            make_private_dir(os.path.dirname(self.spill_path))
+            fd = os.open(self.spill_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+        except Exception as e:
+            logger.warning("Could not spill event to disk - %s", e)
+            return False
+
+        self._spilled_bytes += len(data)
+        self._spilled_pending += 1
+        self.spilled += 1
+        metrics.increment("events.spilled")
+        return True
+
+    def _read_spill(self) -> List:
+        self._spilled_pending = 0
+        self._spilled_bytes = 0
+        self._spill_full = False
+        try:
+            with open(self.spill_path, "rb") as spill_file:
+                events = [
+                    EncodedEvent(data=line.rstrip(b"\n"))
+                    for line in spill_file
+                    if line.strip()
+                ]
+            os.remove(self.spill_path)
+            return events
+        except OSError as e:
+            logger.warning("Could not read spilled events - %s", e)
+            return []
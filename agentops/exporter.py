@@ -0,0 +1,267 @@
+"""
+AgentOps event exporter.
+
+Classes:
+    Exporter: Process-wide pool of threads that flushes the event queues of every live Session.
+    Starter: Process-wide pool of threads that creates new Sessions on the server.
+"""
+
+import heapq
+import itertools
+import queue
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
+
+from .log_config import logger
+
+if TYPE_CHECKING:
+    from .session import Session
+
+DEFAULT_EXPORTER_WORKERS = 2
+DEFAULT_STARTER_WORKERS = 8
+
+
+class Exporter:
+    """
+    Flushes the event queues of every registered Session from a small, fixed pool of threads.
+
+    Sessions are kept in a heap ordered by their flush deadline, so the number of threads stays
+    constant no matter how many sessions are alive. Workers sleep on a condition variable until
+    the earliest deadline and are woken early whenever a session asks to be flushed now, e.g.
+    because its queue is full. A session is only ever flushed by one worker at a time. Sessions
+    are created on the server by the Starter, not here, so cold starts never hold up uploads.
+
+    Sessions that can share a multi-session upload (see `Session._coalesce_key`) are flushed
+    together: when one of them is due, every other such session with buffered events rides
+    along in the same upload instead of waiting for its own deadline.
+
+    Args:
+        workers (int, optional): Number of worker threads. Defaults to 2.
+    """
+
+    def __init__(self, workers: int = DEFAULT_EXPORTER_WORKERS):
+        self.workers = workers
+        self._condition = threading.Condition()
+        self._schedule: List[Tuple[float, int, "Session"]] = []
+        self._sequence = itertools.count()
+        self._sessions: Dict[int, "Session"] = {}
+        self._deadlines: Dict[int, float] = {}
+        self._in_flight: Set[int] = set()
+        self._started: Dict[int, int] = {}
+        self._completed: Dict[int, int] = {}
+        self._threads: List[threading.Thread] = []
+
+    def register(self, session: "Session") -> None:
+        """Start accepting flush requests for `session`."""
+        with self._condition:
+            self._sessions[id(session)] = session
+            self._started.setdefault(id(session), 0)
+            self._completed.setdefault(id(session), 0)
+            self._start_threads()
+
+    def unregister(self, session: "Session", wait: bool = True) -> bool:
+        """
+        Stop flushing `session`. By default waits for a flush already in progress to finish.
+
+        Returns:
+            bool: False if a flush is still in progress, which only happens when `wait` is False.
+        """
+        with self._condition:
+            self._sessions.pop(id(session), None)
+            self._deadlines.pop(id(session), None)
+            self._started.pop(id(session), None)
+            self._completed.pop(id(session), None)
+            if wait:
+                while id(session) in self._in_flight:
+                    self._condition.wait()
+            return id(session) not in self._in_flight
+
+    def wait_idle(self, session: "Session") -> None:
+        """Block until no flush of `session` is in progress."""
+        with self._condition:
+            while id(session) in self._in_flight:
+                self._condition.wait()
+
+    def schedule(self, session: "Session", deadline: float) -> None:
+        """
+        Flush `session` no later than `deadline` (a `time.monotonic()` timestamp). An earlier
+        deadline that is already scheduled is kept.
+        """
+        with self._condition:
+            if id(session) not in self._sessions:
+                return
+
+            current = self._deadlines.get(id(session))
+            if current is not None and current <= deadline:
+                return
+
+            self._deadlines[id(session)] = deadline
+            heapq.heappush(self._schedule, (deadline, next(self._sequence), session))
+
+            # Only the earliest deadline can shorten how long workers sleep
+            if self._schedule[0][2] is session:
+                self._condition.notify()
+
+    def request_flush(self, session: "Session") -> None:
+        """Flush `session` as soon as a worker is free."""
+        self.schedule(session, time.monotonic())
+
+    def flush(self, session: "Session", timeout: Optional[float] = None) -> bool:
+        """
+        Flush `session` and wait until everything it had buffered has been sent.
+
+        Returns:
+            bool: False if `timeout` seconds passed first.
+        """
+        with self._condition:
+            if id(session) not in self._sessions:
+                return True
+            # A flush already in progress may have missed the latest events; wait for the next one
+            target = self._started[id(session)] + 1
+
+        self.request_flush(session)
+
+        end = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self._completed.get(id(session), target) < target:
+                remaining = None if end is None else end - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+            return True
+
+    def _start_threads(self) -> None:
+        self._threads = [thread for thread in self._threads if thread.is_alive()]
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._run, name="agentops-exporter")
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _is_current(self, deadline: float, session: "Session") -> bool:
+        return (
+            id(session) in self._sessions
+            and self._deadlines.get(id(session)) == deadline
+        )
+
+    def _next_due(self) -> Tuple["Session", List["Session"]]:
+        with self._condition:
+            while True:
+                # Superseded entries and entries for unregistered sessions are dropped lazily
+                while self._schedule and not self._is_current(
+                    self._schedule[0][0], self._schedule[0][2]
+                ):
+                    heapq.heappop(self._schedule)
+
+                if self._schedule:
+                    timeout = self._schedule[0][0] - time.monotonic()
+                    if timeout <= 0:
+                        _, _, session = heapq.heappop(self._schedule)
+                        if id(session) in self._in_flight:
+                            # Parked: re-queued by the worker flushing it once it finishes
+                            continue
+                        self._claim(session)
+                        return session, self._companions(session)
+                else:
+                    timeout = None
+
+                self._condition.wait(timeout)
+
+    def _claim(self, session: "Session") -> None:
+        self._deadlines.pop(id(session), None)
+        self._in_flight.add(id(session))
+        self._started[id(session)] += 1
+
+    def _companions(self, leader: "Session") -> List["Session"]:
+        """Claim every other idle session with buffered events that can share `leader`'s upload."""
+        key = leader._coalesce_key()
+        if key is None:
+            return []
+
+        companions = []
+        for session_id, session in self._sessions.items():
+            if session is leader or session_id in self._in_flight:
+                continue
+            if session._coalesce_key() != key or len(session._buffer) == 0:
+                continue
+            self._claim(session)
+            companions.append(session)
+        return companions
+
+    def _run(self) -> None:
+        while True:
+            session, companions = self._next_due()
+            try:
+                session._flush_queue(companions)
+            except Exception as e:
+                logger.warning("Failed to flush session events: %s", e)
+            finally:
+                with self._condition:
+                    for flushed in [session, *companions]:
+                        self._in_flight.discard(id(flushed))
+                        if id(flushed) in self._completed:
+                            self._completed[id(flushed)] += 1
+                        deadline = self._deadlines.get(id(flushed))
+                        if deadline is not None:
+                            heapq.heappush(
+                                self._schedule,
+                                (deadline, next(self._sequence), flushed),
+                            )
+                    self._condition.notify_all()
+
+            # Events recorded while the flush was running need a deadline of their own
+            for flushed in [session, *companions]:
+                deadline = flushed._flush_deadline()
+                if deadline is not None:
+                    self.schedule(flushed, deadline)
+
+
+exporter = Exporter()
+
+
+class Starter:
+    """
+    Creates new Sessions on the server from a bounded pool of threads of its own, so starting a
+    session never blocks the caller, many sessions starting at once are created in parallel, and
+    none of it waits behind, or holds up, the Exporter's uploads. A session that is needed before
+    its turn comes, e.g. because it is ended, is created by the thread that needs it instead.
+
+    Args:
+        workers (int, optional): Most sessions created at the same time. Defaults to 8.
+    """
+
+    def __init__(self, workers: int = DEFAULT_STARTER_WORKERS):
+        self.workers = workers
+        self._queue: "queue.SimpleQueue[Session]" = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        # Workers waiting for a session to start
+        self._idle = 0
+
+    def start(self, session: "Session") -> None:
+        """Create `session` on the server as soon as a worker is free."""
+        self._queue.put(session)
+        with self._lock:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            # Threads are only added while every one there is has a session to start
+            if self._queue.qsize() > self._idle and len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run, name="agentops-starter")
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                self._idle += 1
+            session = self._queue.get()
+            with self._lock:
+                self._idle -= 1
+            try:
+                session._start()
+            except Exception as e:
+                logger.warning("Failed to start session: %s", e)
+
+
+starter = Starter()
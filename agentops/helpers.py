@@ -1,17 +1,20 @@
 from pprint import pformat
 from functools import wraps
+from contextvars import ContextVar
 import time
 from datetime import datetime
 import json
-import inspect
-from typing import Union
+import sys
+from inspect import CO_OPTIMIZED
+from types import CodeType
+from typing import Dict, Optional, Tuple, Union
 
 from .log_config import logger
+from . import serialization
 from uuid import UUID
 import os
 from importlib.metadata import version
 
-
 PARTNER_FRAMEWORKS = {
     # framework : instrument_llm_calls, auto_start_session
     "autogen": (False, True),
@@ -20,6 +23,16 @@ PARTNER_FRAMEWORKS = {
 
 ao_instances = {}
 
+# The agent whose @track_agent method is running in the current thread or asyncio task
+current_agent_id: ContextVar[Union[str, None]] = ContextVar(
+    "agentops_agent_id", default=None
+)
+
+# Looking for an agent in the callers' locals is slow; only done when asked for
+agent_stack_scan_enabled = (
+    os.environ.get("AGENTOPS_AGENT_STACK_SCAN", "False").lower() == "true"
+)
+
 
 def singleton(class_):
 
@@ -71,85 +84,89 @@ def is_jsonable(x):
 
 
 def filter_unjsonable(d: dict) -> dict:
-    def filter_dict(obj):
-        if isinstance(obj, dict):
-            # TODO: clean up this mess lol
-            return {
-                k: (
-                    filter_dict(v)
-                    if isinstance(v, (dict, list)) or is_jsonable(v)
-                    else str(v) if isinstance(v, UUID) else ""
-                )
-                for k, v in obj.items()
-            }
-        elif isinstance(obj, list):
-            return [
-                (
-                    filter_dict(x)
-                    if isinstance(x, (dict, list)) or is_jsonable(x)
-                    else str(x) if isinstance(x, UUID) else ""
-                )
-                for x in obj
-            ]
-        else:
-            return obj if is_jsonable(obj) or isinstance(obj, UUID) else ""
-
-    return filter_dict(d)
-
-
-def safe_serialize(obj):
-    def default(o):
-        if isinstance(o, UUID):
-            return str(o)
-        elif hasattr(o, "model_dump_json"):
-            return o.model_dump_json()
-        elif hasattr(o, "to_json"):
-            return o.to_json()
-        elif hasattr(o, "json"):
-            return o.json()
-        elif hasattr(o, "to_dict"):
-            return o.to_dict()
-        elif hasattr(o, "dict"):
-            return o.dict()
-        else:
-            return f"<<non-serializable: {type(o).__qualname__}>>"
-
-    def remove_unwanted_items(value):
-        """Recursively remove self key and None/... values from dictionaries so they aren't serialized"""
-        if isinstance(value, dict):
-            return {
-                k: remove_unwanted_items(v)
-                for k, v in value.items()
-                if v is not None and v is not ... and k != "self"
-            }
-        elif isinstance(value, list):
-            return [remove_unwanted_items(item) for item in value]
-        else:
-            return value
+    """Replace values JSON can't represent: UUIDs with their string form, anything else with ""."""
+    return serialization.sanitize(d)
+
+
+def safe_serialize(obj) -> str:
+    return safe_serialize_bytes(obj).decode("utf-8")
+
+
+def safe_serialize_bytes(obj) -> bytes:
+    """Like `safe_serialize`, but returns the UTF-8 encoded JSON without decoding it again."""
+    return serialization.dumps(serialization.prune(obj))
+
+
+def get_current_agent_id() -> Union[UUID, None]:
+    """The id of the agent that originated the current call, for attributing events to it."""
+    agent_id = current_agent_id.get()
+    if agent_id is None and agent_stack_scan_enabled:
+        return check_call_stack_for_agent_id()
+    return agent_id
 
-    cleaned_obj = remove_unwanted_items(obj)
-    return json.dumps(cleaned_obj, default=default)
+
+# How many callers to look through for an agent before giving up
+_MAX_STACK_DEPTH = 50
+
+# Frames of the SDK's own code never hold the caller's agent
+_PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__)) + os.sep
+
+# Per code object, the names of its locals that held an agent before, which are looked at first, or
+# None for code whose frames can never hold one: the SDK's own and functions without locals. Which
+# value a local holds changes from call to call, so the other locals are still looked at too
+_agent_locals: Dict[CodeType, Optional[Tuple[str, ...]]] = {}
+_UNSEEN = object()
+
+
+def _new_agent_locals(code: CodeType) -> Optional[Tuple[str, ...]]:
+    if code.co_filename.startswith(_PACKAGE_DIR):
+        return None
+    if code.co_flags & CO_OPTIMIZED and not (
+        code.co_nlocals or code.co_cellvars or code.co_freevars
+    ):
+        return None
+    return ()
 
 
 def check_call_stack_for_agent_id() -> Union[UUID, None]:
-    for frame_info in inspect.stack():
+    frame = sys._getframe(1)
+    for _ in range(_MAX_STACK_DEPTH):
+        if frame is None:
+            break
+        code = frame.f_code
+        # We stop looking up the stack at module level because after that we see global variables
+        if code.co_name == "<module>":
+            break
+        known = _agent_locals.get(code, _UNSEEN)
+        if known is _UNSEEN:
+            known = _agent_locals[code] = _new_agent_locals(code)
+        if known is None:
+            frame = frame.f_back
+            continue
+
         # Look through the call stack for the class that called the LLM
-        local_vars = frame_info.frame.f_locals
+        local_vars = frame.f_locals
+        for name in known:
+            agent_id = getattr(local_vars.get(name), "agent_ops_agent_id", None)
+            if agent_id:
+                return _found_agent(local_vars[name], agent_id)
         for var in local_vars.values():
-            # We stop looking up the stack at main because after that we see global variables
-            if var == "__main__":
-                return None
-            if hasattr(var, "agent_ops_agent_id") and getattr(
-                var, "agent_ops_agent_id"
-            ):
-                logger.debug(
-                    "LLM call from agent named: %s",
-                    getattr(var, "agent_ops_agent_name"),
-                )
-                return getattr(var, "agent_ops_agent_id")
+            agent_id = getattr(var, "agent_ops_agent_id", None)
+            if agent_id:
+                name = next(name for name, v in local_vars.items() if v is var)
+                _agent_locals[code] = (name, *known)
+                return _found_agent(var, agent_id)
+        frame = frame.f_back
     return None
 
 
+def _found_agent(agent, agent_id: UUID) -> UUID:
+    logger.debug(
+        "LLM call from agent named: %s", getattr(agent, "agent_ops_agent_name", None)
+    )
+    return agent_id
+
+
 def get_agentops_version():
     try:
         pkg_version = version("agentops")
@@ -3,16 +3,50 @@ import psutil
 import socket
 from .helpers import get_agentops_version
 from .log_config import logger
+import hashlib
 import importlib.metadata
+import inspect
+import json
 import os
 import sys
+import threading
+from typing import Callable, Dict, List, Optional
 
+# Host details that don't change while the process runs, collected once and shared by every session
+_static_details: Dict[str, dict] = {}
+_static_details_lock = threading.Lock()
+_preloader: Optional[threading.Thread] = None
+_fingerprints: Dict[bool, str] = {}
 
-def get_sdk_details():
+# Import name -> installed distribution, and the versions looked up in it so far
+_distribution_index: Optional[Dict[str, importlib.metadata.Distribution]] = None
+_package_versions: Dict[str, Optional[str]] = {}
+
+
+def _get_static(name: str, collect: Callable[[], dict]) -> dict:
+    # Held while collecting, so a caller that races the preloader waits for it instead of redoing the work
+    with _static_details_lock:
+        details = _static_details.get(name)
+        if details is None:
+            details = _static_details[name] = collect()
+        return details
+
+
+def get_sdk_version_details():
     try:
         return {
             "AgentOps SDK Version": get_agentops_version(),
             "Python Version": platform.python_version(),
+        }
+    except:
+        return {}
+
+
+def get_sdk_details():
+    try:
+        return {
+            **_get_static("SDK", get_sdk_version_details),
+            # Whatever is imported by now, e.g. LLM SDKs imported after agentops.init()
             "System Packages": get_sys_packages(),
         }
     except:
@@ -33,15 +67,69 @@ def get_agentops_details():
         return {}
 
 
+def _top_level_names(dist: importlib.metadata.Distribution) -> List[str]:
+    declared = dist.read_text("top_level.txt")
+    if declared:
+        return declared.split()
+
+    # Not declared by every build backend; infer from the installed files instead
+    names = set()
+    for file in dist.files or ():
+        name = (
+            file.parts[0] if len(file.parts) > 1 else inspect.getmodulename(file.name)
+        )
+        if name and "." not in name:
+            names.add(name)
+    return list(names)
+
+
+def _index_distributions() -> Dict[str, importlib.metadata.Distribution]:
+    """Map top-level import names to the distribution providing them, in one pass over site-packages."""
+    index = {}
+    for dist in importlib.metadata.distributions():
+        try:
+            for name in _top_level_names(dist):
+                # Earlier entries on sys.path win, as they do for imports
+                index.setdefault(name, dist)
+        except Exception as e:
+            logger.debug("Skipping unreadable distribution metadata: %s", e)
+    return index
+
+
+def _get_distribution_index() -> Dict[str, importlib.metadata.Distribution]:
+    """The distribution index, built once per process."""
+    global _distribution_index
+    with _static_details_lock:
+        if _distribution_index is None:
+            _distribution_index = _index_distributions()
+        return _distribution_index
+
+
+def _package_version(
+    module: str, dist: importlib.metadata.Distribution
+) -> Optional[str]:
+    version = _package_versions.get(module)
+    if version is None and module not in _package_versions:
+        try:
+            # Parses the distribution's METADATA, so only done for packages that are loaded
+            version = dist.version
+        except Exception as e:
+            logger.debug("Failed to read the version of %s: %s", module, e)
+        _package_versions[module] = version
+    return version
+
+
 def get_sys_packages():
+    """The versions of the loaded top-level packages. Cheap once the distribution index is built."""
+    index = _get_distribution_index()
     sys_packages = {}
-    for module in sys.modules:
-        try:
-            version = importlib.metadata.version(module)
-            sys_packages[module] = version
-        except importlib.metadata.PackageNotFoundError:
-            # Skip built-in modules and those without package metadata
+    for module in list(sys.modules):
+        # Submodules, private modules and builtins belong to no distribution of their own
+        if "." in module or module.startswith("_") or module not in index:
             continue
+        version = _package_version(module, index[module])
+        if version is not None:
+            sys_packages[module] = version
 
     return sys_packages
 
@@ -75,10 +163,9 @@ def get_virtual_env():
         return {}
 
 
-def get_os_details():
+def get_os_release_details():
     try:
         return {
-            "Hostname": socket.gethostname(),
             "OS": platform.system(),
             "OS Version": platform.version(),
             "OS Release": platform.release(),
@@ -87,12 +174,32 @@ def get_os_details():
         return {}
 
 
-def get_cpu_details():
+def get_os_details():
+    try:
+        return {
+            # Unique per container, so not part of the fingerprint
+            "Hostname": socket.gethostname(),
+            **_get_static("OS", get_os_release_details),
+        }
+    except:
+        return {}
+
+
+def get_cpu_count_details():
     try:
         return {
             "Physical cores": psutil.cpu_count(logical=False),
             "Total cores": psutil.cpu_count(logical=True),
             # "Max Frequency": f"{psutil.cpu_freq().max:.2f}Mhz", # Fails right now
+        }
+    except:
+        return {}
+
+
+def get_cpu_details():
+    try:
+        return {
+            **_get_static("CPU", get_cpu_count_details),
             "CPU Usage": f"{psutil.cpu_percent()}%",
         }
     except:
@@ -112,6 +219,45 @@ def get_ram_details():
         return {}
 
 
+def get_disk_total_details():
+    """The size of every accessible partition, without its usage."""
+    disk_info = {}
+    for partition in psutil.disk_partitions():
+        try:
+            usage = psutil.disk_usage(partition.mountpoint)
+            disk_info[partition.device] = {
+                "Mountpoint": partition.mountpoint,
+                "Total": f"{usage.total / (1024**3):.2f} GB",
+            }
+        except OSError as inaccessible:
+            logger.debug(
+                "Mountpoint %s inaccessible: %s", partition.mountpoint, inaccessible
+            )
+
+    return disk_info
+
+
+def get_disk_usage_details():
+    """Current usage of the partitions found by the cached get_disk_total_details."""
+    disk_info = {}
+    for device, details in _get_static("Disk", get_disk_total_details).items():
+        try:
+            usage = psutil.disk_usage(details["Mountpoint"])
+        except OSError as inaccessible:
+            logger.debug(
+                "Mountpoint %s inaccessible: %s", details["Mountpoint"], inaccessible
+            )
+            continue
+        disk_info[device] = {
+            **details,
+            "Used": f"{usage.used / (1024**3):.2f} GB",
+            "Free": f"{usage.free / (1024**3):.2f} GB",
+            "Percentage": f"{usage.percent}%",
+        }
+
+    return disk_info
+
+
 def get_disk_details():
     partitions = psutil.disk_partitions()
     disk_info = {}
@@ -134,7 +280,56 @@ def get_disk_details():
     return disk_info
 
 
+def _static_collectors(opt_out: bool):
+    collectors = {"SDK": get_sdk_version_details, "OS": get_os_release_details}
+    if not opt_out:
+        collectors.update(
+            {
+                "CPU": get_cpu_count_details,
+                "Disk": get_disk_total_details,
+                "Installed Packages": get_installed_packages,
+            }
+        )
+    return collectors
+
+
+def _collect_static_details(opt_out: bool) -> None:
+    for name, collect in _static_collectors(opt_out).items():
+        try:
+            _get_static(name, collect)
+        except Exception as e:
+            # Retried, and reported, by the get_host_env call that needs it
+            logger.debug("Failed to collect host details %s: %s", name, e)
+    try:
+        _get_distribution_index()
+    except Exception as e:
+        logger.debug("Failed to index installed distributions: %s", e)
+
+
+def preload_host_env(opt_out: bool = False) -> None:
+    """
+    Start collecting the host details that don't change while the process runs on a background
+    thread, so the first get_host_env call doesn't have to.
+    """
+    global _preloader
+    with _static_details_lock:
+        if _preloader is not None:
+            return
+        _preloader = threading.Thread(
+            target=_collect_static_details,
+            args=(opt_out,),
+            name="agentops-host-env",
+            daemon=True,
+        )
+    _preloader.start()
+
+
 def get_host_env(opt_out: bool = False):
+    """
+    Describe the host for a new session. Installed packages, disk sizes and other static details
+    are collected once per process; loaded packages, CPU, RAM and disk usage and the working
+    directory are read on every call.
+    """
     if opt_out:
         return {
             "SDK": get_sdk_details(),
@@ -148,8 +343,46 @@ def get_host_env(opt_out: bool = False):
             "OS": get_os_details(),
             "CPU": get_cpu_details(),
             "RAM": get_ram_details(),
-            "Disk": get_disk_details(),
-            "Installed Packages": get_installed_packages(),
+            "Disk": get_disk_usage_details(),
+            "Installed Packages": _get_static(
+                "Installed Packages", get_installed_packages
+            ),
             "Project Working Directory": get_current_directory(),
             "Virtual Environment": get_virtual_env(),
         }
+
+
+def get_host_env_fingerprint(opt_out: bool = False) -> str:
+    """
+    A stable hash of the details in get_host_env(opt_out) that come with the image: OS release,
+    core counts, disk sizes and installed packages. Identical for every process started from the
+    same image, whatever host or container it runs in.
+    """
+    fingerprint = _fingerprints.get(opt_out)
+    if fingerprint is None:
+        static_details = {
+            name: _get_static(name, collect)
+            for name, collect in _static_collectors(opt_out).items()
+        }
+        canonical = json.dumps(static_details, sort_keys=True, default=str)
+        fingerprint = _fingerprints[opt_out] = hashlib.sha256(
+            canonical.encode("utf-8")
+        ).hexdigest()
+    return fingerprint
+
+
+def _strip(details: dict, static: dict) -> dict:
+    stripped = {}
+    for key, value in details.items():
+        if key not in static:
+            stripped[key] = value
+        elif value != static[key]:
+            # Static and per-call values side by side, e.g. core counts and CPU usage
+            both_dicts = isinstance(value, dict) and isinstance(static[key], dict)
+            stripped[key] = _strip(value, static[key]) if both_dicts else value
+    return stripped
+
+
+def strip_static_details(host_env: dict) -> dict:
+    """Remove the parts of a get_host_env result that its fingerprint stands for."""
+    return _strip(host_env, _static_details)
@@ -1,12 +1,30 @@
 from enum import Enum
-from typing import Optional
+from typing import Dict, Optional, Set, Tuple
+from urllib.parse import urlsplit
+import gzip
+import json
+import threading
+import time
 from .log_config import logger
+from .metrics import metrics
+from .retry import (
+    DEFAULT_FAILURE_THRESHOLD,
+    DEFAULT_RESET_TIMEOUT,
+    CircuitBreaker,
+    CircuitState,
+    TRANSIENT_STATUS_CODES,
+    RetryPolicy,
+    parse_retry_after,
+)
 import requests
-from requests.adapters import Retry, HTTPAdapter
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, MaxRetryError
 
 JSON_HEADER = {"Content-Type": "application/json; charset=UTF-8", "Accept": "*/*"}
 
-retry_config = Retry(total=5, backoff_factor=0.1)
+DEFAULT_POOL_MAXSIZE = 10
+DEFAULT_POOL_IDLE_TIMEOUT = 60.0
+DEFAULT_COMPRESSION_THRESHOLD = 1024
 
 
 class HttpStatus(Enum):
@@ -15,6 +33,7 @@ class HttpStatus(Enum):
     INVALID_API_KEY = 401
     TIMEOUT = 408
     PAYLOAD_TOO_LARGE = 413
+    UNSUPPORTED_MEDIA_TYPE = 415
     TOO_MANY_REQUESTS = 429
     FAILED = 500
     UNKNOWN = -1
@@ -28,14 +47,49 @@ class Response:
         self.status: HttpStatus = status
         self.code: int = status.value
         self.body = body if body else {}
+        self.retry_after: Optional[float] = None
+        # False if the request provably never reached the server, e.g. the connection was refused
+        self.sent = True
 
     def parse(self, res: requests.models.Response):
-        res_body = res.json()
         self.code = res.status_code
         self.status = self.get_status(self.code)
-        self.body = res_body
+        self.retry_after = parse_retry_after(res.headers.get("Retry-After"))
+        try:
+            self.body = res.json()
+        except ValueError:
+            # Not every endpoint answers with JSON, e.g. a bare "ok"
+            self.body = {}
+        return self
+
+    def parse_raw(
+        self, code: int, content: bytes, headers: Optional[Dict[str, str]] = None
+    ):
+        """
+        Like `parse`, for transports that hand back a status code, raw body and headers
+        with lower-case names.
+        """
+        self.code = code
+        self.status = self.get_status(code)
+        self.retry_after = parse_retry_after((headers or {}).get("retry-after"))
+        try:
+            body = json.loads(content) if content else {}
+            self.body = body if isinstance(body, dict) else {}
+        except ValueError:
+            self.body = {}
         return self
 
+    @property
+    def is_retryable(self) -> bool:
+        """Whether sending the same request again later could succeed."""
+        return self.status in (
+            HttpStatus.UNKNOWN,
+            HttpStatus.INVALID_API_KEY,
+            HttpStatus.TIMEOUT,
+            HttpStatus.TOO_MANY_REQUESTS,
+            HttpStatus.FAILED,
+        )
+
     @staticmethod
     def get_status(code: int) -> HttpStatus:
         if 200 <= code < 300:
@@ -44,6 +98,8 @@ class Response:
             return HttpStatus.TOO_MANY_REQUESTS
         elif code == 413:
             return HttpStatus.PAYLOAD_TOO_LARGE
+        elif code == 415:
+            return HttpStatus.UNSUPPORTED_MEDIA_TYPE
         elif code == 408:
             return HttpStatus.TIMEOUT
         elif code == 401:
@@ -55,37 +111,250 @@ class Response:
         return HttpStatus.UNKNOWN
 
 
+class Codec:
+    """
+    Interface for request body compression. Subclass and pass to `register_codec` to add
+    a codec; `name` is sent as the Content-Encoding header.
+    """
+
+    name: str = "identity"
+
+    def encode(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+
+class GzipCodec(Codec):
+    name = "gzip"
+
+    def __init__(self, compresslevel: int = 6):
+        self.compresslevel = compresslevel
+
+    def encode(self, data: bytes) -> bytes:
+        return gzip.compress(data, compresslevel=self.compresslevel)
+
+
+_codecs: Dict[str, Codec] = {"gzip": GzipCodec()}
+
+
+def register_codec(codec: Codec) -> None:
+    """Make `codec` available to HttpClient.post under `codec.name`."""
+    _codecs[codec.name] = codec
+
+
+def get_codec(name: str) -> Optional[Codec]:
+    return _codecs.get(name)
+
+
+class _PooledTransport:
+    """A keep-alive `requests.Session` bound to a single scheme://host origin."""
+
+    def __init__(self, origin: str, pool_maxsize: int):
+        self.session = requests.Session()
+        self.session.mount(
+            origin,
+            HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=pool_maxsize,
+            ),
+        )
+        self.last_used = time.monotonic()
+
+    def close(self) -> None:
+        self.session.close()
+
+
 class HttpClient:
+    """
+    Process-wide HTTP transport shared by every Session.
+
+    Connections are pooled per origin and kept alive between requests. Pools that have been
+    idle for longer than `pool_idle_timeout` seconds are closed and rebuilt on next use.
+
+    Requests the server didn't process are retried according to `retry_policy`, and every endpoint has a
+    CircuitBreaker that fails requests fast while the endpoint keeps failing.
+    """
+
+    pool_maxsize: int = DEFAULT_POOL_MAXSIZE
+    pool_idle_timeout: float = DEFAULT_POOL_IDLE_TIMEOUT
+    keep_alive: bool = True
+
+    _transports: Dict[str, _PooledTransport] = {}
+    _transports_lock = threading.Lock()
+
+    # (origin, codec name) pairs the server refused, so we stop offering them
+    _rejected_codecs: Set[Tuple[str, str]] = set()
+
+    retry_policy: RetryPolicy = RetryPolicy()
+    breaker_failure_threshold: int = DEFAULT_FAILURE_THRESHOLD
+    breaker_reset_timeout: float = DEFAULT_RESET_TIMEOUT
+
+    _breakers: Dict[str, CircuitBreaker] = {}
+    _breakers_lock = threading.Lock()
+
+    @classmethod
+    def configure_pool(
+        cls,
+        pool_maxsize: Optional[int] = None,
+        pool_idle_timeout: Optional[float] = None,
+        keep_alive: Optional[bool] = None,
+    ) -> None:
+        """
+        Configure the shared connection pools. Existing pools are closed so the new settings
+        apply to the next request.
+
+        Args:
+            pool_maxsize (int, optional): Maximum number of connections kept per origin.
+            pool_idle_timeout (float, optional): Seconds a pool may sit unused before it is evicted.
+            keep_alive (bool, optional): Whether connections are reused between requests.
+        """
+        with cls._transports_lock:
+            if pool_maxsize is not None:
+                cls.pool_maxsize = pool_maxsize
+            if pool_idle_timeout is not None:
+                cls.pool_idle_timeout = pool_idle_timeout
+            if keep_alive is not None:
+                cls.keep_alive = keep_alive
+            cls._close_transports()
+
+    @classmethod
+    def configure_retry(
+        cls,
+        retry_policy: Optional[RetryPolicy] = None,
+        failure_threshold: Optional[int] = None,
+        reset_timeout: Optional[float] = None,
+    ) -> None:
+        """
+        Configure retries and circuit breaking. Every circuit is closed again.
+
+        Args:
+            retry_policy (RetryPolicy, optional): When failed requests are sent again.
+            failure_threshold (int, optional): Consecutive failed requests that open an endpoint's circuit.
+            reset_timeout (float, optional): Seconds an open circuit refuses requests before a probe.
+        """
+        with cls._breakers_lock:
+            if retry_policy is not None:
+                cls.retry_policy = retry_policy
+            if failure_threshold is not None:
+                cls.breaker_failure_threshold = failure_threshold
+            if reset_timeout is not None:
+                cls.breaker_reset_timeout = reset_timeout
+            cls._breakers = {}
+
+    @classmethod
+    def is_available(cls, url: str) -> bool:
+        """Whether requests to `url` would currently be sent rather than refused by its circuit breaker."""
+        return cls.available_at(url) <= time.monotonic()
+
+    @classmethod
+    def available_at(cls, url: str) -> float:
+        """The `time.monotonic()` timestamp from which requests to `url` are sent again."""
+        return cls._breaker(url).available_at()
+
+    @classmethod
+    def close(cls) -> None:
+        """Close every pooled connection."""
+        with cls._transports_lock:
+            cls._close_transports()
+
+    @classmethod
+    def _close_transports(cls) -> None:
+        for transport in cls._transports.values():
+            transport.close()
+        cls._transports = {}
 
     @staticmethod
-    def post(
-        url: str,
-        payload: bytes,
+    def _origin(url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    @classmethod
+    def _breaker(cls, url: str) -> CircuitBreaker:
+        endpoint = url.split("?", 1)[0]
+        with cls._breakers_lock:
+            breaker = cls._breakers.get(endpoint)
+            if breaker is None:
+                breaker = CircuitBreaker(
+                    endpoint,
+                    failure_threshold=cls.breaker_failure_threshold,
+                    reset_timeout=cls.breaker_reset_timeout,
+                )
+                cls._breakers[endpoint] = breaker
+            return breaker
+
+    @classmethod
+    def _get_session(cls, url: str) -> requests.Session:
+        origin = cls._origin(url)
+        now = time.monotonic()
+
+        with cls._transports_lock:
+            # Evict pools nobody has used for a while so their sockets are released
+            for key, transport in list(cls._transports.items()):
+                if now - transport.last_used > cls.pool_idle_timeout:
+                    transport.close()
+                    del cls._transports[key]
+
+            transport = cls._transports.get(origin)
+            if transport is None:
+                transport = _PooledTransport(origin, cls.pool_maxsize)
+                cls._transports[origin] = transport
+            transport.last_used = now
+            return transport.session
+
+    @classmethod
+    def _build_headers(
+        cls,
         api_key: Optional[str] = None,
         parent_key: Optional[str] = None,
         jwt: Optional[str] = None,
-        header=None,
-    ) -> Response:
-        result = Response()
-        try:
-            # Create request session with retries configured
-            request_session = requests.Session()
-            request_session.mount(url, HTTPAdapter(max_retries=retry_config))
+        header: Optional[dict] = None,
+    ) -> dict:
+        headers = dict(JSON_HEADER)
+        if not cls.keep_alive:
+            headers["Connection"] = "close"
 
-            if api_key is not None:
-                JSON_HEADER["X-Agentops-Api-Key"] = api_key
+        if api_key is not None:
+            headers["X-Agentops-Api-Key"] = api_key
 
-            if parent_key is not None:
-                JSON_HEADER["X-Agentops-Parent-Key"] = parent_key
+        if parent_key is not None:
+            headers["X-Agentops-Parent-Key"] = parent_key
 
-            if jwt is not None:
-                JSON_HEADER["Authorization"] = f"Bearer {jwt}"
+        if jwt is not None:
+            headers["Authorization"] = f"Bearer {jwt}"
 
-            res = request_session.post(
-                url, data=payload, headers=JSON_HEADER, timeout=20
-            )
+        if header:
+            headers.update(header)
+
+        return headers
+
+    @classmethod
+    def _compress(
+        cls, url: str, payload: bytes, codec: Optional[str], threshold: int
+    ) -> Tuple[bytes, Optional[str]]:
+        if codec is None or len(payload) < threshold:
+            return payload, None
+
+        if (cls._origin(url), codec) in cls._rejected_codecs:
+            return payload, None
+
+        encoder = get_codec(codec)
+        if encoder is None:
+            logger.debug("Unknown compression codec %s - sending uncompressed", codec)
+            return payload, None
+
+        return encoder.encode(payload), encoder.name
+
+    @staticmethod
+    def _send(url: str, data: bytes, headers: dict) -> Response:
+        result = Response()
+        try:
+            request_session = HttpClient._get_session(url)
+            res = request_session.post(url, data=data, headers=headers, timeout=20)
 
             result.parse(res)
+        except requests.exceptions.ConnectTimeout as e:
+            result.sent = False
+            result.body = {"error": str(e)}
+            logger.warning("Could not post data - connection timed out")
         except requests.exceptions.Timeout:
             result.code = 408
             result.status = HttpStatus.TIMEOUT
@@ -99,8 +368,126 @@ class HttpClient:
                 result.status = Response.get_status(e.response.status_code)
                 result.body = {"error": str(e)}
         except requests.exceptions.RequestException as e:
+            result.sent = not HttpClient._never_connected(e)
             result.body = {"error": str(e)}
 
+        return result
+
+    @staticmethod
+    def _never_connected(e: requests.exceptions.RequestException) -> bool:
+        """Whether `e` failed before a connection was made, e.g. refused or not resolved."""
+        if not isinstance(e, requests.exceptions.ConnectionError) or not e.args:
+            return False
+        reason = e.args[0]
+        if isinstance(reason, MaxRetryError):
+            reason = reason.reason
+        # Includes NewConnectionError
+        return isinstance(reason, ConnectTimeoutError)
+
+    @staticmethod
+    def _request(url: str, data: bytes, headers: dict, force: bool = False) -> Response:
+        """`_send` with retries, guarded by the endpoint's circuit breaker unless `force` is set."""
+        breaker = HttpClient._breaker(url)
+        if not breaker.allow() and not force:
+            return HttpClient._refused(url)
+
+        attempt, delay = 1, 0.0
+        while True:
+            result = HttpClient._send(url, data, headers)
+            delay = HttpClient._retry_delay(breaker, result, attempt, delay)
+            if delay is None:
+                return result
+            time.sleep(delay)
+            attempt += 1
+
+    @staticmethod
+    def _refused(url: str) -> Response:
+        metrics.increment("http.requests_refused")
+        logger.debug("Not sending request to %s - circuit is open", url)
+        return Response(body={"error": "circuit open"})
+
+    @staticmethod
+    def _retry_delay(
+        breaker: CircuitBreaker, result: Response, attempt: int, delay: float
+    ) -> Optional[float]:
+        """Record the outcome of an attempt. Returns how long to wait before the next one, or None to stop."""
+        if result.code not in TRANSIENT_STATUS_CODES:
+            # Anything but a transient failure means the endpoint is up
+            breaker.record_success()
+            return None
+
+        policy = HttpClient.retry_policy
+        next_delay = None
+        # A half-open probe isn't retried, nor is anything once other requests opened the circuit.
+        # Nor is a request the server may have processed, which would then be processed twice
+        if breaker.state == CircuitState.CLOSED and policy.should_retry(
+            result.code, result.retry_after, result.sent
+        ):
+            next_delay = policy.next_delay(attempt, delay, result.retry_after)
+        if next_delay is None:
+            # A request counts as one failure, however many attempts it took
+            breaker.record_failure(result.retry_after)
+            if result.retry_after is not None and result.retry_after > 0:
+                breaker.hold(result.retry_after)
+            return None
+
+        metrics.increment("http.retries")
+        return next_delay
+
+    @staticmethod
+    def post(
+        url: str,
+        payload: bytes,
+        api_key: Optional[str] = None,
+        parent_key: Optional[str] = None,
+        jwt: Optional[str] = None,
+        header=None,
+        codec: Optional[str] = None,
+        compression_threshold: int = DEFAULT_COMPRESSION_THRESHOLD,
+        force: bool = False,
+    ) -> Response:
+        """
+        Post `payload` to `url`. With `force`, the request is sent even while the endpoint's circuit
+        is open, e.g. as a last attempt before the events would be lost.
+        """
+        headers = HttpClient._build_headers(api_key, parent_key, jwt, header)
+        data, encoding = HttpClient._compress(
+            url, payload, codec, compression_threshold
+        )
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+
+        result = HttpClient._request(url, data, headers, force)
+
+        if encoding is not None and HttpClient._rejects_encoding(result, encoding):
+            # The server doesn't understand this encoding; remember that and resend as-is
+            logger.debug("%s rejected %s request body - disabling", url, encoding)
+            HttpClient._rejected_codecs.add((HttpClient._origin(url), encoding))
+            del headers["Content-Encoding"]
+            data = payload
+            result = HttpClient._request(url, data, headers, force)
+
+        metrics.increment("http.bytes_raw", len(payload))
+        metrics.increment("http.bytes_wire", len(data))
+        HttpClient._log_failure(result, api_key)
+
+        return result
+
+    @staticmethod
+    def _rejects_encoding(result: Response, encoding: str) -> bool:
+        """
+        Whether `result` says the server can't decode `encoding` request bodies: a 415, or a 400
+        whose error names the encoding. Any other 400 is about the request itself.
+        """
+        if result.status == HttpStatus.UNSUPPORTED_MEDIA_TYPE:
+            return True
+        if result.status != HttpStatus.INVALID_REQUEST:
+            return False
+        error = json.dumps(result.body).lower()
+        return encoding in error or "content-encoding" in error
+
+    @staticmethod
+    def _log_failure(result: Response, api_key: Optional[str]) -> None:
         if result.code == 401:
             logger.warning(
                 "Could not post data - API server rejected your API key: %s", api_key
@@ -109,5 +496,3 @@ class HttpClient:
             logger.warning("Could not post data - %s", result.body)
         if result.code == 500:
             logger.warning("Could not post data - internal server error")
-
-        return result
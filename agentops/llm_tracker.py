@@ -10,7 +10,7 @@ from packaging.version import Version, parse
 
 from .session import Session
 from .event import ActionEvent, ErrorEvent, LLMEvent
-from .helpers import check_call_stack_for_agent_id, get_ISO_time
+from .helpers import get_current_agent_id, get_ISO_time
 from .log_config import logger
 
 original_func = {}
@@ -56,7 +56,7 @@ class LlmTracker:
 
             try:
                 accumulated_delta = self.llm_event.returns["choices"][0]["delta"]
-                self.llm_event.agent_id = check_call_stack_for_agent_id()
+                self.llm_event.agent_id = get_current_agent_id()
                 self.llm_event.model = chunk["model"]
                 self.llm_event.prompt = kwargs["messages"]
                 choice = chunk["choices"][
@@ -118,7 +118,7 @@ class LlmTracker:
         # v0.0.0 responses are dicts
         try:
             self.llm_event.returns = response
-            self.llm_event.agent_id = check_call_stack_for_agent_id()
+            self.llm_event.agent_id = get_current_agent_id()
             self.llm_event.prompt = kwargs["messages"]
             self.llm_event.prompt_tokens = response["usage"]["prompt_tokens"]
             self.llm_event.completion = {
@@ -165,7 +165,7 @@ class LlmTracker:
 
             try:
                 accumulated_delta = self.llm_event.returns.choices[0].delta
-                self.llm_event.agent_id = check_call_stack_for_agent_id()
+                self.llm_event.agent_id = get_current_agent_id()
                 self.llm_event.model = chunk.model
                 self.llm_event.prompt = kwargs["messages"]
 
@@ -244,7 +244,7 @@ class LlmTracker:
         # v1.0.0+ responses are objects
         try:
             self.llm_event.returns = response.model_dump()
-            self.llm_event.agent_id = check_call_stack_for_agent_id()
+            self.llm_event.agent_id = get_current_agent_id()
             self.llm_event.prompt = kwargs["messages"]
             self.llm_event.prompt_tokens = response.usage.prompt_tokens
             self.llm_event.completion = response.choices[0].message.model_dump()
@@ -296,7 +296,7 @@ class LlmTracker:
             # We take the first chunk and accumulate the deltas from all subsequent chunks to build one full chat completion
             if isinstance(chunk, StreamedChatResponse_StreamStart):
                 self.llm_event.returns = chunk
-                self.llm_event.agent_id = check_call_stack_for_agent_id()
+                self.llm_event.agent_id = get_current_agent_id()
                 self.llm_event.model = kwargs.get("model", "command-r-plus")
                 self.llm_event.prompt = kwargs["message"]
                 self.llm_event.completion = ""
@@ -406,7 +406,7 @@ class LlmTracker:
 
         try:
             self.llm_event.returns = response.dict()
-            self.llm_event.agent_id = check_call_stack_for_agent_id()
+            self.llm_event.agent_id = get_current_agent_id()
             self.llm_event.prompt = []
             if response.chat_history:
                 role_map = {"USER": "user", "CHATBOT": "assistant", "SYSTEM": "system"}
@@ -459,7 +459,7 @@ class LlmTracker:
                 self.llm_event.returns = chunk
                 self.llm_event.returns["message"] = self.llm_event.completion
                 self.llm_event.prompt = kwargs["messages"]
-                self.llm_event.agent_id = check_call_stack_for_agent_id()
+                self.llm_event.agent_id = get_current_agent_id()
                 self.client.record(self.llm_event)
 
             if self.llm_event.completion is None:
@@ -480,7 +480,7 @@ class LlmTracker:
 
         self.llm_event.model = f'ollama/{response["model"]}'
         self.llm_event.returns = response
-        self.llm_event.agent_id = check_call_stack_for_agent_id()
+        self.llm_event.agent_id = get_current_agent_id()
         self.llm_event.prompt = kwargs["messages"]
         self.llm_event.completion = response["message"]
 
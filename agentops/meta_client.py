@@ -3,7 +3,7 @@ import traceback
 
 from .host_env import get_host_env
 from .http_client import HttpClient
-from .helpers import safe_serialize, get_agentops_version
+from .helpers import safe_serialize_bytes, get_agentops_version
 
 from os import environ
 
@@ -40,7 +40,7 @@ class MetaClient(type):
 
             HttpClient.post(
                 "https://api.agentops.ai/v2/developer_errors",
-                safe_serialize(developer_error).encode("utf-8"),
+                safe_serialize_bytes(developer_error),
                 api_key=api_key,
             )
 
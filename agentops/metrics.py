@@ -0,0 +1,41 @@
+"""
+AgentOps SDK self-instrumentation.
+
+Classes:
+    Metrics: Thread-safe named counters describing what the SDK itself is doing.
+"""
+
+import threading
+from collections import defaultdict
+from typing import Dict
+
+
+class Metrics:
+    """
+    Thread-safe named counters, e.g. bytes sent over the wire or events dropped.
+
+    A single process-wide instance is exposed as `agentops.metrics.metrics`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = defaultdict(int)
+
+    def increment(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += value
+
+    def get(self, name: str) -> int:
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+
+
+metrics = Metrics()
@@ -0,0 +1,226 @@
+"""
+AgentOps request retry and circuit breaking.
+
+Classes:
+    RetryPolicy: Decides whether and when a failed request is sent again.
+    CircuitState: States of a CircuitBreaker.
+    CircuitBreaker: Fails requests to an endpoint fast while it keeps failing.
+"""
+
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from enum import Enum
+from typing import Optional
+
+from .log_config import logger
+from .metrics import metrics
+
+# Failures that say nothing about the request itself and count against an endpoint's circuit.
+# -1 is a request that never got a response, e.g. a refused connection
+TRANSIENT_STATUS_CODES = frozenset({-1, 408, 429, 500, 502, 503, 504})
+
+# Responses that say the request wasn't processed, if they also say when to come back
+RETRY_AFTER_STATUS_CODES = frozenset({429, 503})
+
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30.0
+
+# How long a caller waits before checking again while a half-open probe is in flight
+_PROBE_RECHECK_INTERVAL = 1.0
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait according to a Retry-After header, given in seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class RetryPolicy:
+    """
+    Retries requests that provably weren't processed: ones that never reached the server, e.g. a
+    refused connection, and 429 or 503 responses with a Retry-After header. Anything else, such as
+    a read timeout or a 500, may have been processed already, so it isn't sent again in place.
+
+    Delays use decorrelated jitter: each is drawn uniformly between `base_delay` and three times
+    the previous delay, capped at `max_delay`, so clients that failed together don't come back
+    together. A Retry-After header takes precedence over the jittered delay; if it asks for more
+    than `max_retry_after` seconds the request is not retried.
+
+    Args:
+        max_attempts (int, optional): Attempts per request, including the first. Defaults to 5.
+        base_delay (float, optional): Smallest delay between attempts in seconds. Defaults to 0.1.
+        max_delay (float, optional): Largest jittered delay between attempts in seconds. Defaults to 5.
+        max_retry_after (float, optional): Largest Retry-After in seconds that is waited out
+            in place. Defaults to 30.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 5,
+        base_delay: float = 0.1,
+        max_delay: float = 5.0,
+        max_retry_after: float = 30.0,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+
+    def should_retry(
+        self, code: int, retry_after: Optional[float] = None, sent: bool = True
+    ) -> bool:
+        """
+        Args:
+            code (int): The status code of the failed attempt, -1 if there was no response.
+            retry_after (float, optional): The delay the server asked for, if any.
+            sent (bool, optional): False if the request provably never reached the server.
+        """
+        if not sent:
+            return True
+        return code in RETRY_AFTER_STATUS_CODES and retry_after is not None
+
+    def next_delay(
+        self, attempt: int, previous_delay: float, retry_after: Optional[float] = None
+    ) -> Optional[float]:
+        """
+        Args:
+            attempt (int): The number of attempts made so far.
+            previous_delay (float): The delay before the last attempt, 0 after the first one.
+            retry_after (float, optional): The delay the server asked for, if any.
+
+        Returns:
+            float: Seconds to wait before the next attempt, or None to give up.
+        """
+        if attempt >= self.max_attempts:
+            return None
+        if retry_after is not None:
+            return retry_after if retry_after <= self.max_retry_after else None
+        upper = max(self.base_delay, previous_delay * 3)
+        return min(self.max_delay, random.uniform(self.base_delay, upper))
+
+
+class CircuitState(Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+_TRANSITION_METRICS = {
+    CircuitState.CLOSED: "circuit.closed",
+    CircuitState.OPEN: "circuit.opened",
+    CircuitState.HALF_OPEN: "circuit.half_opened",
+}
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for a single endpoint.
+
+    After `failure_threshold` consecutive failed requests the circuit opens and requests are
+    refused for `reset_timeout` seconds, or for as long as the server asked with Retry-After.
+    It then goes half-open and lets a single probe through: success closes the circuit, failure
+    opens it again. Transitions are counted in the `circuit.opened`, `circuit.half_opened` and
+    `circuit.closed` metrics.
+
+    Args:
+        endpoint (str): The URL the breaker guards, used in log messages.
+        failure_threshold (int, optional): Consecutive failures that open the circuit. Defaults to 5.
+        reset_timeout (float, optional): Seconds the circuit stays open. Defaults to 30.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+        reset_timeout: float = DEFAULT_RESET_TIMEOUT,
+    ):
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CircuitState.CLOSED
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._open_until = 0.0
+        self._probing = False
+
+    def allow(self) -> bool:
+        """Whether a request may be sent now. Claims the probe slot when half-open."""
+        with self._lock:
+            if self.state == CircuitState.CLOSED:
+                return True
+            if self.state == CircuitState.OPEN:
+                if time.monotonic() < self._open_until:
+                    return False
+                self._transition(CircuitState.HALF_OPEN)
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def is_open(self) -> bool:
+        with self._lock:
+            return self.state == CircuitState.OPEN
+
+    def available_at(self) -> float:
+        """The `time.monotonic()` timestamp from which `allow()` may let a request through."""
+        with self._lock:
+            if self.state == CircuitState.OPEN:
+                return self._open_until
+            if self.state == CircuitState.HALF_OPEN and self._probing:
+                return time.monotonic() + _PROBE_RECHECK_INTERVAL
+            return 0.0
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+            self._transition(CircuitState.CLOSED)
+
+    def record_failure(self, retry_after: Optional[float] = None) -> None:
+        """
+        Count a failed request, once its retries are exhausted. A `retry_after` longer than the
+        reset timeout keeps the circuit open for that long once it opens.
+        """
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if (
+                self.state == CircuitState.HALF_OPEN
+                or self._failures >= self.failure_threshold
+            ):
+                self._open_until = time.monotonic() + max(
+                    self.reset_timeout, retry_after or 0.0
+                )
+                self._transition(CircuitState.OPEN)
+
+    def hold(self, seconds: float) -> None:
+        """Open the circuit for `seconds`, e.g. because the server asked us to stay away."""
+        with self._lock:
+            self._probing = False
+            self._open_until = max(self._open_until, time.monotonic() + seconds)
+            self._transition(CircuitState.OPEN)
+
+    def _transition(self, state: CircuitState) -> None:
+        if state == self.state:
+            return
+        self.state = state
+        metrics.increment(_TRANSITION_METRICS[state])
+        if state == CircuitState.OPEN:
+            logger.warning(
+                "%s keeps failing - pausing requests for %.0f seconds",
+                self.endpoint,
+                self._open_until - time.monotonic(),
+            )
+        else:
+            logger.debug("Circuit for %s is now %s", self.endpoint, state.value)
@@ -0,0 +1,260 @@
+"""
+AgentOps JSON encoding.
+
+Classes:
+    JsonBackend: Interface for the JSON encoder used to serialize events and sessions.
+    StdlibBackend: JsonBackend built on the standard library `json` module.
+    OrjsonBackend: JsonBackend built on orjson.
+    MsgspecBackend: JsonBackend built on msgspec.
+
+Functions:
+    dumps: Encode an object to JSON bytes with the active backend.
+    sanitize: Replace everything JSON can't represent, in a single pass.
+    prune: Drop empty values and "self" keys before serializing.
+    snapshot: Copy the dicts, lists and tuples nested in an object.
+    get_json_backend / set_json_backend: Inspect or replace the active backend.
+"""
+
+import json
+from operator import methodcaller
+from os import environ
+from typing import Any, Callable, Dict, Optional, Union
+from uuid import UUID
+
+from .log_config import logger
+
+_SCALAR, _DICT, _LIST, _TUPLE, _UUID, _OTHER = range(6)
+
+# What each type seen so far is to JSON, so every walk dispatches with one dict lookup per node
+_kinds: Dict[type, int] = {
+    str: _SCALAR,
+    int: _SCALAR,
+    float: _SCALAR,
+    bool: _SCALAR,
+    type(None): _SCALAR,
+    dict: _DICT,
+    list: _LIST,
+    tuple: _TUPLE,
+    UUID: _UUID,
+}
+
+# Probed in this order for objects JSON can't represent natively
+_CONVERSION_METHODS = ("model_dump_json", "to_json", "json", "to_dict", "dict")
+
+# How to convert instances of each type seen so far, so the probing runs once per type
+_strategies: Dict[type, Callable[[Any], Any]] = {}
+
+
+def _kind(cls: type) -> int:
+    kind = _kinds.get(cls)
+    if kind is None:
+        if issubclass(cls, (str, int, float)):
+            kind = _SCALAR
+        elif issubclass(cls, dict):
+            kind = _DICT
+        elif issubclass(cls, list):
+            kind = _LIST
+        elif issubclass(cls, tuple):
+            kind = _TUPLE
+        elif issubclass(cls, UUID):
+            kind = _UUID
+        else:
+            kind = _OTHER
+        _kinds[cls] = kind
+    return kind
+
+
+def _resolve_strategy(cls: type) -> Callable[[Any], Any]:
+    if _kind(cls) == _UUID:
+        return str
+    for method in _CONVERSION_METHODS:
+        if hasattr(cls, method):
+            return methodcaller(method)
+
+    placeholder = f"<<non-serializable: {cls.__qualname__}>>"
+    return lambda _: placeholder
+
+
+def convert(obj: Any) -> Any:
+    """Convert an object JSON can't represent into something it can, e.g. a UUID into a str."""
+    strategy = _strategies.get(type(obj))
+    if strategy is None:
+        strategy = _strategies[type(obj)] = _resolve_strategy(type(obj))
+    return strategy(obj)
+
+
+def _is_jsonable(obj: Any) -> bool:
+    """Whether the stdlib json module could encode `obj` without a `default` hook."""
+    kind = _kind(type(obj))
+    if kind == _SCALAR:
+        return True
+    if kind == _DICT:
+        return all(_kind(type(key)) == _SCALAR for key in obj) and all(
+            _is_jsonable(value) for value in obj.values()
+        )
+    if kind == _LIST or kind == _TUPLE:
+        return all(_is_jsonable(item) for item in obj)
+    return False
+
+
+def sanitize(obj: Any) -> Any:
+    """
+    Copy `obj` with everything JSON can't represent replaced: UUIDs become strings, and any
+    other value, or tuple containing one, becomes "". Visits every node once.
+    """
+    kind = _kind(type(obj))
+    if kind == _SCALAR:
+        return obj
+    if kind == _DICT:
+        return {key: sanitize(value) for key, value in obj.items()}
+    if kind == _LIST:
+        return [sanitize(item) for item in obj]
+    if kind == _TUPLE:
+        return obj if _is_jsonable(obj) else ""
+    if kind == _UUID:
+        return str(obj)
+    return ""
+
+
+def prune(obj: Any) -> Any:
+    """Recursively remove "self" keys and None/... values from dicts so they aren't serialized."""
+    kind = _kind(type(obj))
+    if kind == _DICT:
+        return {
+            key: prune(value)
+            for key, value in obj.items()
+            if value is not None and value is not ... and key != "self"
+        }
+    if kind == _LIST:
+        return [prune(item) for item in obj]
+    return obj
+
+
+def snapshot(obj: Any) -> Any:
+    """
+    Copy the dicts, lists and tuples nested in `obj`, so changing them later doesn't change the
+    copy. Other objects are shared with `obj`.
+    """
+    kind = _kind(type(obj))
+    if kind == _DICT:
+        return {key: snapshot(value) for key, value in obj.items()}
+    if kind == _LIST:
+        return [snapshot(item) for item in obj]
+    if kind == _TUPLE:
+        return tuple(snapshot(item) for item in obj)
+    return obj
+
+
+class JsonBackend:
+    """
+    Interface for a JSON encoder. Objects the encoder can't represent natively are passed to
+    `convert`. Subclass and pass to `set_json_backend` to use another library.
+    """
+
+    name: str = ""
+
+    def dumps(self, obj: Any) -> bytes:
+        raise NotImplementedError
+
+
+class StdlibBackend(JsonBackend):
+    name = "json"
+
+    def dumps(self, obj: Any) -> bytes:
+        return json.dumps(obj, default=convert).encode("utf-8")
+
+
+class OrjsonBackend(JsonBackend):
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+
+        self._orjson = orjson
+        self._option = orjson.OPT_NON_STR_KEYS
+        self._fallback = StdlibBackend()
+
+    def dumps(self, obj: Any) -> bytes:
+        try:
+            return self._orjson.dumps(obj, default=convert, option=self._option)
+        except self._orjson.JSONEncodeError:
+            # e.g. integers beyond 64 bits, which the stdlib encodes fine
+            return self._fallback.dumps(obj)
+
+
+class MsgspecBackend(JsonBackend):
+    name = "msgspec"
+
+    def __init__(self):
+        import msgspec
+
+        self._errors = (msgspec.EncodeError, TypeError, OverflowError)
+        self._encoder = msgspec.json.Encoder(enc_hook=convert)
+        self._fallback = StdlibBackend()
+
+    def dumps(self, obj: Any) -> bytes:
+        try:
+            return self._encoder.encode(obj)
+        except self._errors:
+            return self._fallback.dumps(obj)
+
+
+_backends: Dict[str, Callable[[], JsonBackend]] = {
+    OrjsonBackend.name: OrjsonBackend,
+    MsgspecBackend.name: MsgspecBackend,
+    StdlibBackend.name: StdlibBackend,
+}
+
+
+def _load_backend(name: str) -> Optional[JsonBackend]:
+    factory = _backends.get(name)
+    if factory is None:
+        return None
+    try:
+        return factory()
+    except ImportError:
+        return None
+
+
+def _default_backend() -> JsonBackend:
+    requested = environ.get("AGENTOPS_JSON_BACKEND")
+    if requested:
+        backend = _load_backend(requested.lower())
+        if backend is not None:
+            return backend
+        logger.warning("JSON backend %s is not available - ignoring", requested)
+
+    # The fastest one installed
+    for name in (OrjsonBackend.name, MsgspecBackend.name):
+        backend = _load_backend(name)
+        if backend is not None:
+            return backend
+    return StdlibBackend()
+
+
+_backend: JsonBackend = _default_backend()
+
+
+def get_json_backend() -> JsonBackend:
+    return _backend
+
+
+def set_json_backend(backend: Union[str, JsonBackend]) -> None:
+    """
+    Replace the JSON encoder, e.g. `set_json_backend("json")` to force the standard library.
+
+    Args:
+        backend (str, JsonBackend): "orjson", "msgspec", "json" or a JsonBackend instance.
+    """
+    global _backend
+    if isinstance(backend, str):
+        loaded = _load_backend(backend)
+        if loaded is None:
+            raise ValueError(f"JSON backend {backend!r} is not available")
+        backend = loaded
+    _backend = backend
+
+
+def dumps(obj: Any) -> bytes:
+    """Encode `obj` as JSON bytes with the active backend."""
+    return _backend.dumps(obj)
@@ -1,26 +1,121 @@
-import copy
+import asyncio
+import base64
 import functools
 import json
+import os
 import threading
 import time
 
 from .event import ErrorEvent, Event
+from .encoder import EncodedEvent, encoder
+from .event_buffer import EventBuffer
 from .log_config import logger
 from .config import ClientConfiguration
-from .helpers import get_ISO_time, filter_unjsonable, safe_serialize
-from typing import Optional, List, Union
+from .helpers import get_ISO_time, filter_unjsonable, safe_serialize_bytes
+from .host_env import get_host_env, get_host_env_fingerprint, strip_static_details
+from . import serialization
+from typing import Dict, FrozenSet, Optional, List, Sequence, Set, Tuple, Union
 from uuid import UUID, uuid4
 
-from .http_client import HttpClient
+from .exporter import exporter, starter
+from .async_http_client import AsyncHttpClient
+from .http_client import HttpClient, HttpStatus, Response
+from .metrics import metrics
+from .spool import SPILL_SUFFIX, SpoolRecord, get_spool, recover_spills
+
+_EVENTS_PREFIX = b'{"events": ['
+_EVENTS_SEPARATOR = b", "
+_EVENTS_SUFFIX = b"]}"
+_SESSIONS_PREFIX = b'{"sessions": ['
+
+# Set in create_session responses by servers that accept multi-session event uploads
+_COALESCED_EVENTS_FEATURE = "multi_session_events"
+
+# Endpoints that advertised multi-session uploads but turned out not to serve them
+_coalesced_unsupported: Set[str] = set()
+
+# Set in create_session responses to the codecs the server can decode in event uploads
+_REQUEST_ENCODINGS_FEATURE = "request_encodings"
+
+# Set in create_session responses by servers that store host environments by fingerprint
+_HOST_ENV_FINGERPRINT_FEATURE = "host_env_fingerprints"
+
+# Set in create_session responses when the server hasn't seen the session's fingerprint yet
+_HOST_ENV_REQUIRED = "host_env_required"
+
+# Endpoints that only need the static host details once per fingerprint
+_fingerprinting_endpoints: Set[str] = set()
+
+# Endpoints without the batched create_agents route; agents are registered one request each
+_agent_batches_unsupported: Set[str] = set()
+
+# Spool directories already checked for spill files left behind by an earlier process
+_recovered_spill_dirs: Set[str] = set()
+
+# Refresh a JWT this many seconds before it expires, or after 90% of its lifetime if that is sooner
+_JWT_REFRESH_MARGIN = 60.0
+
+# Seconds to wait after a failed JWT refresh before trying again
+_JWT_REFRESH_RETRY = 30.0
+
+# Session fields that can change after create_session; updates carry only the ones that did
+_UPDATABLE_FIELDS = frozenset(
+    {"tags", "video", "end_state", "end_state_reason", "end_timestamp"}
+)
+
+
+def _jwt_expiry(jwt: Optional[str]) -> Optional[float]:
+    """The `exp` claim of a JWT as a Unix timestamp, or None if it has none. The signature is not checked."""
+    if not jwt:
+        return None
+    try:
+        payload = jwt.split(".")[1]
+        claims = json.loads(
+            base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4))
+        )
+        return float(claims["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+def _request_encodings(body: dict) -> FrozenSet[str]:
+    """The codecs a create_session response says the server decodes in event uploads."""
+    encodings = body.get(_REQUEST_ENCODINGS_FEATURE)
+    if not isinstance(encodings, list):
+        return frozenset()
+    return frozenset(e for e in encodings if isinstance(e, str))
+
+
+def _encode_batch(batch: List[bytes]) -> bytes:
+    """Build a create_events payload from already serialized events."""
+    return _EVENTS_PREFIX + _EVENTS_SEPARATOR.join(batch) + _EVENTS_SUFFIX
+
+
+def _encode_session_group(session: "Session", batch: List[bytes]) -> bytes:
+    """Build one session's entry of a multi-session upload from already serialized events."""
+    return (
+        b'{"session_id": '
+        + json.dumps(str(session.session_id)).encode("utf-8")
+        + b', "jwt": '
+        + json.dumps(session.jwt).encode("utf-8")
+        + b', "events": ['
+        + _EVENTS_SEPARATOR.join(batch)
+        + _EVENTS_SUFFIX
+    )
 
 
 class Session:
     """
     Represents a session of events, with a start and end state.
 
+    The session is created on the server in the background. Events recorded in the meantime are
+    buffered and sent once it is authorized; use `wait_ready` to wait for that.
+
     Args:
         session_id (UUID): The session id is used to record particular runs.
         tags (List[str], optional): Tags that can be used for grouping or sorting later. Examples could be ["GPT-4"].
+        env_data_opt_out (bool, optional): If given and no host_env is, the host environment is collected
+            in the background with this opt-out setting.
 
     Attributes:
         init_timestamp (float): The timestamp for when the session started, represented as seconds since the epoch.
@@ -36,26 +131,77 @@ class Session:
         tags: Optional[List[str]] = None,
         host_env: Optional[dict] = None,
         config: Optional[ClientConfiguration] = None,
+        host_env_fingerprint: Optional[str] = None,
+        env_data_opt_out: Optional[bool] = None,
     ):
+        self._changed_fields: Set[str] = set()
+        self._lock = threading.Lock()
         self.end_timestamp = None
         self.end_state: Optional[str] = None
         self.session_id = session_id
         self.init_timestamp = get_ISO_time()
+        self._tags: Optional[Dict[str, None]] = None
         self.tags = tags
         self.video: Optional[str] = None
         self.end_state_reason: Optional[str] = None
         self.host_env = host_env
+        self.host_env_fingerprint = host_env_fingerprint
         self.config = config
         self.jwt = None
-        self.lock = threading.Lock()
-        self.queue = []
+        # When the exporter refreshes the JWT, if it expires
+        self._jwt_refresh_at: Optional[float] = None
+        # Earliest time to try again after a failed refresh
+        self._jwt_retry_at = 0.0
+        self._jwt_lock = threading.Lock()
+        self._buffer = EventBuffer(
+            capacity=config.max_buffer_size,
+            policy=config.overflow_policy,
+            block_timeout=config.overflow_block_timeout,
+            spill_path=os.path.join(config.spool_dir, f"{session_id}{SPILL_SUFFIX}"),
+            spill_max_size=config.spool_max_size,
+        )
+        self._spool = (
+            get_spool(config.spool_dir, config.spool_max_size)
+            if config.spool_enabled
+            else None
+        )
+        # Whether the server accepts this session's events in multi-session uploads
+        self._coalesce = False
+        # Codecs the server decodes in event uploads; uploads stay uncompressed until it says
+        self._request_encodings: FrozenSet[str] = frozenset()
+        # When the exporter sends the changed tags, if any are waiting
+        self._update_due: Optional[float] = None
+        # Agents waiting to be registered, sent ahead of the events that reference them
+        self._pending_agents: List[dict] = []
+        self._agents_due: Optional[float] = None
+        self._env_data_opt_out = env_data_opt_out
+        # Set once create_session has completed, successfully or not
+        self._ready = threading.Event()
+        self._started = False
+        # Whether some thread has taken on sending create_session
+        self._start_claimed = False
+
+        exporter.register(self)
+
+        # Everything set so far goes out with create_session
+        self._changed_fields.clear()
+        starter.start(self)
 
-        self.stop_flag = threading.Event()
-        self.thread = threading.Thread(target=self._run)
-        self.thread.daemon = True
-        self.thread.start()
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name in _UPDATABLE_FIELDS:
+            self._changed_fields.add(name)
 
-        self._start_session()
+    @property
+    def tags(self) -> Optional[List[str]]:
+        with self._lock:
+            return None if self._tags is None else list(self._tags)
+
+    @tags.setter
+    def tags(self, tags: Optional[List[str]]) -> None:
+        with self._lock:
+            # Insertion-ordered set
+            self._tags = None if tags is None else dict.fromkeys(tags)
 
     def set_video(self, video: str) -> None:
         """
@@ -73,21 +219,57 @@ class Session:
         self.end_state = end_state
         self.end_state_reason = end_state_reason
 
-        self.stop_flag.set()
-        self.thread.join(timeout=1)
-        self._flush_queue()
+        # Nothing can be sent without the JWT
+        self._wait_started()
+        exporter.unregister(self)
+        self._flush_queue(final=True)
 
-        with self.lock:
-            payload = {"session": self.__dict__}
+        changes = self._take_changes()
+        res = HttpClient.post(
+            f"{self.config.endpoint}/v2/update_session",
+            self._serialize_changes(changes),
+            api_key=self.config.api_key,
+            jwt=self.jwt,
+        )
+        self._check_update(res, changes)
+        logger.debug(res.body)
+        return res.body.get("token_cost", "unknown")
 
-            res = HttpClient.post(
-                f"{self.config.endpoint}/v2/update_session",
-                json.dumps(filter_unjsonable(payload)).encode("utf-8"),
-                jwt=self.jwt,
+    async def aend_session(
+        self, end_state: str = "Indeterminate", end_state_reason: Optional[str] = None
+    ) -> str:
+        """
+        Awaitable version of `end_session` that never blocks the running event loop.
+
+        Args:
+            end_state (str): The final state of the session. Suggested: "Success", "Fail", "Indeterminate"
+            end_state_reason (str, optional): The reason for ending the session.
+
+        Returns:
+            str: The token cost of the session, or "unknown".
+        """
+        self.end_timestamp = get_ISO_time()
+        self.end_state = end_state
+        self.end_state_reason = end_state_reason
+
+        await self._await_ready()
+        if not exporter.unregister(self, wait=False):
+            # An exporter thread is still uploading for us; let it finish first to keep event order
+            await asyncio.get_running_loop().run_in_executor(
+                None, exporter.wait_idle, self
             )
-            logger.debug(res.body)
-            self.queue = []
-            return res.body.get("token_cost", "unknown")
+        await self._aflush(final=True)
+
+        changes = self._take_changes()
+        res = await AsyncHttpClient.post(
+            f"{self.config.endpoint}/v2/update_session",
+            self._serialize_changes(changes),
+            api_key=self.config.api_key,
+            jwt=self.jwt,
+        )
+        self._check_update(res, changes)
+        logger.debug(res.body)
+        return res.body.get("token_cost", "unknown")
 
     def add_tags(self, tags: List[str]) -> None:
         """
@@ -102,14 +284,19 @@ class Session:
             if isinstance(tags, str):  # if it's a single string
                 tags = [tags]  # make it a list
 
-        if self.tags is None:
-            self.tags = tags
-        else:
+        with self._lock:
+            if self._tags is None:
+                self._tags = {}
+            added = False
             for tag in tags:
-                if tag not in self.tags:
-                    self.tags.append(tag)
+                if tag not in self._tags:
+                    self._tags[tag] = None
+                    added = True
+            if not added:
+                return
+            self._changed_fields.add("tags")
 
-        self._update_session()
+        self._schedule_update()
 
     def set_tags(self, tags):
         if not (isinstance(tags, list) and all(isinstance(item, str) for item in tags)):
@@ -117,7 +304,7 @@ class Session:
                 tags = [tags]  # make it a list
 
         self.tags = tags
-        self._update_session()
+        self._schedule_update()
 
     def record(self, event: Union[Event, ErrorEvent]):
         if isinstance(event, Event):
@@ -137,111 +324,731 @@ class Session:
                 self.record(event)
                 event.trigger_event = None  # removes trigger_event from serialization
 
-        self._add_event(event.__dict__)
+        # Snapshot the fields and the containers nested in them now: later changes to the event or
+        # its params, prompt or returns must not leak into what was recorded. The snapshot is
+        # encoded in the background and released once it has been
+        self._add_event(serialization.snapshot(event.__dict__))
 
-    def _add_event(self, event: dict) -> None:
-        with self.lock:
-            self.queue.append(event)
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until the session has been created on the server.
 
-            if len(self.queue) >= self.config.max_queue_size:
-                self._flush_queue()
+        Args:
+            timeout (float, optional): Maximum number of seconds to wait.
 
-    def _reauthorize_jwt(self) -> Union[str, None]:
-        with self.lock:
-            payload = {"session_id": self.session_id}
-            serialized_payload = json.dumps(filter_unjsonable(payload)).encode("utf-8")
-            res = HttpClient.post(
-                f"{self.config.endpoint}/v2/reauthorize_jwt",
-                serialized_payload,
-                self.config.api_key,
+        Returns:
+            bool: True if the session was created and authorized, False if that failed or the timeout expired first.
+        """
+        return self._ready.wait(timeout) and self._started
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Send every buffered event now, blocking until the upload completes.
+
+        Args:
+            timeout (float, optional): Maximum number of seconds to wait.
+
+        Returns:
+            bool: False if the timeout expired before the events were sent.
+        """
+        start = time.monotonic()
+        if not self._ready.wait(timeout):
+            return False
+        if timeout is not None:
+            timeout = max(0.0, timeout - (time.monotonic() - start))
+        return exporter.flush(self, timeout)
+
+    async def aflush(self) -> None:
+        """Send every buffered event now without blocking the running event loop."""
+        await self._aflush()
+
+    async def _aflush(self, final: bool = False) -> None:
+        await self._await_ready()
+        if self._jwt_refresh_due():
+            await asyncio.get_running_loop().run_in_executor(
+                None, self._refresh_jwt_if_due
             )
+        # Encoding what the encoder hasn't got to yet and reading spilled events back both block
+        batches = await asyncio.get_running_loop().run_in_executor(
+            None, self._drain_batches, final
+        )
+        if self._pending_agents:
+            await asyncio.get_running_loop().run_in_executor(
+                None, self._register_agents, final
+            )
+        for batch in batches:
+            await self._aupload_events(batch, final=final)
 
-            logger.debug(res.body)
+    async def aupdate(self) -> None:
+        """Send the session fields changed since the last update (tags, video, end state) without blocking the running event loop."""
+        await self._await_ready()
+        changes = self._take_changes()
+        if not changes:
+            return
+        res = await AsyncHttpClient.post(
+            f"{self.config.endpoint}/v2/update_session",
+            self._serialize_changes(changes),
+            api_key=self.config.api_key,
+            jwt=self.jwt,
+        )
+        self._check_update(res, changes)
 
-            if res.code != 200:
-                return None
+    def _add_event(self, event: dict) -> None:
+        # Only the enqueue happens on the caller's thread; the exporter does the flushing
+        ready = self._ready.is_set()
+        if ready and len(self._buffer) >= self.config.max_buffer_size:
+            # Make room before the overflow policy kicks in
+            exporter.request_flush(self)
 
-            jwt = res.body.get("jwt", None)
-            self.jwt = jwt
-            return jwt
+        encoded_event = EncodedEvent(event)
+        buffered = self._buffer.put(encoded_event)
+        encoder.submit(encoded_event)
 
-    def _start_session(self):
-        self.queue = []
-        with self.lock:
-            payload = {"session": self.__dict__}
-            serialized_payload = json.dumps(filter_unjsonable(payload)).encode("utf-8")
-            res = HttpClient.post(
-                f"{self.config.endpoint}/v2/create_session",
-                serialized_payload,
-                self.config.api_key,
-                self.config.parent_key,
+        if not ready:
+            if not self._ready.is_set():
+                # Scheduled by the starter once the session is authorized
+                return
+            # Authorized while the event was being buffered, perhaps after the starter looked
+            exporter.schedule(self, self._flush_deadline() or time.monotonic())
+            return
+        if buffered >= self.config.max_queue_size:
+            exporter.request_flush(self)
+        elif buffered == 1:
+            exporter.schedule(self, self._flush_deadline() or time.monotonic())
+
+    def _flush_deadline(self) -> Optional[float]:
+        """When buffered events, agents or changed tags must be sent by, or the JWT refreshed; None if nothing is waiting."""
+        if not self._ready.is_set():
+            return None
+        deadline = None
+        oldest_time = self._buffer.oldest_time
+        if oldest_time is not None:
+            deadline = oldest_time + self.config.max_wait_time / 1000
+            if self._spool is None:
+                deadline = max(deadline, HttpClient.available_at(self._events_url))
+
+        for due in (self._agents_due, self._update_due, self._jwt_refresh_at):
+            if due is not None and (deadline is None or due < deadline):
+                deadline = due
+        return deadline
+
+    def _schedule_update(self) -> None:
+        """Have the exporter send the changed tags, together with any others made within `tag_update_interval`."""
+        with self._lock:
+            if self._update_due is None:
+                self._update_due = (
+                    time.monotonic() + self.config.tag_update_interval / 1000
+                )
+            update_due = self._update_due
+        exporter.schedule(self, update_due)
+
+    @property
+    def _codec(self) -> Optional[str]:
+        """The configured codec, if the server has said it can decode it."""
+        codec = self.config.compression
+        return codec if codec in self._request_encodings else None
+
+    @property
+    def _events_url(self) -> str:
+        return f"{self.config.endpoint}/v2/create_events"
+
+    def _take_changes(self) -> dict:
+        """Collect the fields changed since the last update and mark them as sent."""
+        with self._lock:
+            changes = {
+                field: getattr(self, field)
+                for field in self._changed_fields
+                if field != "tags"
+            }
+            if "tags" in self._changed_fields:
+                changes["tags"] = None if self._tags is None else list(self._tags)
+            self._changed_fields.clear()
+            # Whatever was waiting for a background update goes out with this one
+            self._update_due = None
+            return changes
+
+    def _serialize_changes(self, changes: dict) -> bytes:
+        payload = {"session": {"session_id": self.session_id, **changes}}
+        return serialization.dumps(filter_unjsonable(payload))
+
+    def _check_update(self, res: Response, changes: dict) -> None:
+        if res.code != 200:
+            # Not applied; send these fields again with the next update
+            with self._lock:
+                self._changed_fields.update(changes)
+
+    def _snapshot(self) -> dict:
+        """Copy the public session fields under the lock so they can be serialized outside it."""
+        with self._lock:
+            snapshot = {k: v for k, v in self.__dict__.items() if not k.startswith("_")}
+            snapshot["tags"] = None if self._tags is None else list(self._tags)
+            return snapshot
+
+    def _reauthorize_jwt(self) -> Union[str, None]:
+        payload = {"session_id": self.session_id}
+        serialized_payload = serialization.dumps(filter_unjsonable(payload))
+        res = HttpClient.post(
+            f"{self.config.endpoint}/v2/reauthorize_jwt",
+            serialized_payload,
+            self.config.api_key,
+        )
+
+        logger.debug(res.body)
+
+        if res.code != 200:
+            return None
+
+        jwt = res.body.get("jwt", None)
+        if jwt is None:
+            return None
+        with self._lock:
+            self._set_jwt(jwt)
+            self._coalesce = self.config.coalesce_uploads and bool(
+                res.body.get(_COALESCED_EVENTS_FEATURE)
             )
+            self._request_encodings = _request_encodings(res.body)
+        return jwt
 
-            logger.debug(res.body)
+    def _set_jwt(self, jwt: Optional[str]) -> None:
+        """Store a new JWT and schedule its refresh. Called with the lock held."""
+        self.jwt = jwt
+        expiry = _jwt_expiry(jwt)
+        if expiry is None:
+            self._jwt_refresh_at = None
+            return
+        lifetime = max(0.0, expiry - time.time())
+        self._jwt_refresh_at = (
+            time.monotonic() + lifetime - min(_JWT_REFRESH_MARGIN, lifetime / 10)
+        )
 
-            if res.code != 200:
-                return False
+    def _refresh_jwt(self, stale_jwt: Optional[str]) -> bool:
+        """
+        Replace `stale_jwt` with a new JWT unless another thread already has.
 
-            jwt = res.body.get("jwt", None)
-            self.jwt = jwt
-            if jwt is None:
+        Returns:
+            bool: Whether a JWT other than `stale_jwt` can be used now.
+        """
+        with self._jwt_lock:
+            if self.jwt != stale_jwt:
+                return self.jwt is not None
+            if time.monotonic() < self._jwt_retry_at:
                 return False
 
+            if self._reauthorize_jwt() is not None:
+                metrics.increment("jwt.refreshed")
+                return True
+
+            metrics.increment("jwt.refresh_failed")
+            with self._lock:
+                self._jwt_retry_at = time.monotonic() + _JWT_REFRESH_RETRY
+                if self._jwt_refresh_at is not None:
+                    self._jwt_refresh_at = self._jwt_retry_at
+            return False
+
+    def _jwt_refresh_due(self) -> bool:
+        refresh_at = self._jwt_refresh_at
+        return refresh_at is not None and refresh_at <= time.monotonic()
+
+    def _refresh_jwt_if_due(self) -> None:
+        if self._jwt_refresh_due():
+            self._refresh_jwt(self.jwt)
+
+    async def _await_ready(self) -> None:
+        if not self._ready.is_set():
+            await asyncio.get_running_loop().run_in_executor(None, self._wait_started)
+
+    def _claim_start(self) -> bool:
+        """Whether the calling thread should send create_session, because no other has taken it on."""
+        with self._lock:
+            if self._start_claimed:
+                return False
+            self._start_claimed = True
             return True
 
+    def _start(self) -> None:
+        """Create the session on the server, unless another thread has already taken that on."""
+        if self._claim_start():
+            self._start_in_background()
+
+    def _wait_started(self) -> None:
+        """
+        Wait for create_session to complete, sending it on this thread if the starter hasn't got to
+        it yet, e.g. because many sessions are starting at once. Otherwise the wait is bounded by
+        the request's own timeout and retries.
+        """
+        self._start()
+        self._ready.wait()
+
+    def _start_in_background(self) -> None:
+        """
+        Create the session on the server. Runs on a starter thread, or on the thread that needs the
+        session first. Only called after `_claim_start`.
+        """
+        try:
+            self._recover_spills()
+            if self.host_env is None and self._env_data_opt_out is not None:
+                self.host_env = get_host_env(self._env_data_opt_out)
+                self.host_env_fingerprint = get_host_env_fingerprint(
+                    self._env_data_opt_out
+                )
+            self._started = self._start_session()
+        except Exception as e:
+            logger.warning("Failed to start session: %s", e)
+        finally:
+            self._ready.set()
+
+        if not self._started:
+            logger.warning("Cannot start session - server rejected session")
+            return
+        # Whatever was recorded in the meantime
+        deadline = self._flush_deadline()
+        if deadline is not None:
+            exporter.schedule(self, deadline)
+
+    def _recover_spills(self) -> None:
+        """Once per process and directory, spool or discard the events earlier sessions spilled and never sent."""
+        directory = os.path.abspath(self.config.spool_dir)
+        if directory in _recovered_spill_dirs:
+            return
+        # Two sessions racing here is harmless; each spill file can only be claimed once
+        _recovered_spill_dirs.add(directory)
+        recover_spills(
+            directory,
+            self._events_url,
+            self.config.api_key,
+            self.config.max_batch_bytes,
+            self._spool,
+        )
+
+    def _start_session(self):
+        snapshot = self._snapshot()
+        stripped_host_env = (
+            self.host_env is not None
+            and self.host_env_fingerprint is not None
+            and self.config.endpoint in _fingerprinting_endpoints
+        )
+        if stripped_host_env:
+            # The server already has the static details under this fingerprint
+            snapshot["host_env"] = strip_static_details(self.host_env)
+        payload = {"session": snapshot}
+        serialized_payload = serialization.dumps(filter_unjsonable(payload))
+        res = HttpClient.post(
+            f"{self.config.endpoint}/v2/create_session",
+            serialized_payload,
+            self.config.api_key,
+            self.config.parent_key,
+        )
+
+        logger.debug(res.body)
+
+        if res.code != 200:
+            return False
+
+        jwt = res.body.get("jwt", None)
+        with self._lock:
+            self._set_jwt(jwt)
+            self._coalesce = self.config.coalesce_uploads and bool(
+                res.body.get(_COALESCED_EVENTS_FEATURE)
+            )
+            self._request_encodings = _request_encodings(res.body)
+        if jwt is None:
+            return False
+
+        if res.body.get(_HOST_ENV_FINGERPRINT_FEATURE):
+            _fingerprinting_endpoints.add(self.config.endpoint)
+        if stripped_host_env and res.body.get(_HOST_ENV_REQUIRED):
+            # e.g. a new image, or the server forgot it; upload the full details once
+            with self._lock:
+                self._changed_fields.add("host_env")
+            self._update_session()
+
+        return True
+
     def _update_session(self) -> None:
-        with self.lock:
-            payload = {"session": self.__dict__}
+        changes = self._take_changes()
+        if not changes:
+            return
+        res = HttpClient.post(
+            f"{self.config.endpoint}/v2/update_session",
+            self._serialize_changes(changes),
+            api_key=self.config.api_key,
+            jwt=self.jwt,
+        )
+        self._check_update(res, changes)
 
-            res = HttpClient.post(
-                f"{self.config.endpoint}/v2/update_session",
-                json.dumps(filter_unjsonable(payload)).encode("utf-8"),
-                jwt=self.jwt,
+    def _flush_queue(
+        self, companions: Sequence["Session"] = (), final: bool = False
+    ) -> None:
+        """
+        Send what is waiting for this session and `companions`. The `final` flush, at the end of the
+        session, sends the events even while the endpoint's circuit is open.
+        """
+        if not self._ready.is_set():
+            # The starter creates it, then schedules whatever was recorded in the meantime
+            return
+        # Before it lapses, so the uploads below don't have to
+        self._refresh_jwt_if_due()
+        if companions:
+            self._flush_coalesced(companions)
+        else:
+            batches = self._drain_batches(final)
+            # Agents are registered before any event that references them is sent. Taking them after
+            # the drain means every agent created before a drained event is among them
+            self._register_agents(final)
+            for batch in batches:
+                self._upload_events(batch, final=final)
+
+        for session in [self, *companions]:
+            session._send_due_update()
+
+    def _send_due_update(self) -> None:
+        update_due = self._update_due
+        if update_due is not None and update_due <= time.monotonic():
+            self._update_session()
+
+    def _coalesce_key(self) -> Optional[Tuple[str, str]]:
+        """Sessions with equal keys may share one multi-session upload; None if this one can't."""
+        if not self._coalesce or self.config.endpoint in _coalesced_unsupported:
+            return None
+        return self.config.endpoint, self.config.api_key
+
+    @property
+    def _coalesced_events_url(self) -> str:
+        return f"{self.config.endpoint}/v2/create_events_batch"
+
+    def _flush_coalesced(self, companions: Sequence["Session"]) -> None:
+        """Send the events of this session and `companions` in as few uploads as `max_batch_bytes` allows."""
+        sessions = [self, *companions]
+        if self._spool is None and not HttpClient.is_available(
+            self._coalesced_events_url
+        ):
+            for session in sessions:
+                session._flush_queue()
+            return
+
+        drained = [(session, session._drain_batches()) for session in sessions]
+        for session in sessions:
+            session._register_agents()
+
+        upload = []
+        upload_size = len(_SESSIONS_PREFIX) + len(_EVENTS_SUFFIX)
+        for session, batches in drained:
+            for batch in batches:
+                group = _encode_session_group(session, batch)
+                size = len(group) + len(_EVENTS_SEPARATOR)
+                if upload and upload_size + size > self.config.max_batch_bytes:
+                    self._upload_coalesced(upload)
+                    upload = []
+                    upload_size = len(_SESSIONS_PREFIX) + len(_EVENTS_SUFFIX)
+                upload.append((session, batch, group))
+                upload_size += size
+        if upload:
+            self._upload_coalesced(upload)
+
+    def _upload_coalesced(
+        self, upload: List[Tuple["Session", List[bytes], bytes]]
+    ) -> None:
+        url = self._coalesced_events_url
+        serialized_payload = (
+            _SESSIONS_PREFIX
+            + _EVENTS_SEPARATOR.join(group for _, _, group in upload)
+            + _EVENTS_SUFFIX
+        )
+        res = HttpClient.post(
+            url,
+            serialized_payload,
+            api_key=self.config.api_key,
+            codec=self._codec,
+            compression_threshold=self.config.compression_threshold,
+        )
+
+        if res.code in (404, 405):
+            logger.debug("%s is not available - uploading events per session", url)
+            _coalesced_unsupported.add(self.config.endpoint)
+            for session, batch, _ in upload:
+                session._upload_events(batch)
+            return
+
+        if res.status == HttpStatus.INVALID_API_KEY:
+            # A session's JWT lapsed; each session refreshes its own and resends its batch
+            for session, batch, _ in upload:
+                session._upload_events(batch)
+            return
+
+        if res.status == HttpStatus.PAYLOAD_TOO_LARGE:
+            if len(upload) > 1:
+                middle = len(upload) // 2
+                self._upload_coalesced(upload[:middle])
+                self._upload_coalesced(upload[middle:])
+            else:
+                # A single session's batch; bisect its events instead
+                session, batch, _ = upload[0]
+                session._upload_events(batch)
+            return
+
+        self._handle_events_response(
+            url,
+            serialized_payload,
+            res,
+            sum(len(batch) for _, batch, _ in upload),
+            coalesced=True,
+        )
+
+    def _drain_batches(self, final: bool = False) -> List[List[bytes]]:
+        """
+        Empty the buffer into batches of serialized events, each small enough for one
+        create_events upload of at most `max_batch_bytes`. An event larger than that gets a
+        batch of its own. Unless `final`, nothing is drained while the endpoint's circuit is open.
+        """
+        if (
+            not final
+            and self._spool is None
+            and not HttpClient.is_available(self._events_url)
+        ):
+            # The endpoint keeps failing; keep the events until its circuit breaker lets requests through
+            return []
+
+        # Drain the buffer; any event the encoder hasn't got to yet is encoded outside its lock
+        queue = self._buffer.drain()
+        if len(queue) == 0:
+            return []
+
+        batches = []
+        batch: List[bytes] = []
+        batch_size = len(_EVENTS_PREFIX) + len(_EVENTS_SUFFIX)
+        for event in queue:
+            try:
+                fragment = event.encode()
+            except Exception as e:
+                # e.g. a to_json() that raises, or a payload mutated while it was encoded
+                metrics.increment("events.unencodable")
+                logger.warning("Could not record event - failed to encode it: %s", e)
+                continue
+            size = len(fragment) + len(_EVENTS_SEPARATOR)
+            if batch and batch_size + size > self.config.max_batch_bytes:
+                batches.append(batch)
+                batch = []
+                batch_size = len(_EVENTS_PREFIX) + len(_EVENTS_SUFFIX)
+            batch.append(fragment)
+            batch_size += size
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _upload_events(
+        self, batch: List[bytes], replay: bool = True, final: bool = False
+    ) -> None:
+        url = self._events_url
+        serialized_payload = _encode_batch(batch)
+        jwt = self.jwt
+        res = HttpClient.post(
+            url,
+            serialized_payload,
+            api_key=self.config.api_key,
+            jwt=jwt,
+            codec=self._codec,
+            compression_threshold=self.config.compression_threshold,
+            force=final,
+        )
+        if res.status == HttpStatus.PAYLOAD_TOO_LARGE:
+            for half in self._split_rejected_batch(batch):
+                self._upload_events(half, final=final)
+            return
+        if res.status == HttpStatus.INVALID_API_KEY and replay:
+            if self._refresh_jwt(jwt):
+                # The JWT lapsed mid-session; resend with the new one
+                self._upload_events(batch, replay=False, final=final)
+                return
+        self._handle_events_response(url, serialized_payload, res, len(batch))
+
+    async def _aupload_events(
+        self, batch: List[bytes], replay: bool = True, final: bool = False
+    ) -> None:
+        url = self._events_url
+        serialized_payload = _encode_batch(batch)
+        jwt = self.jwt
+        res = await AsyncHttpClient.post(
+            url,
+            serialized_payload,
+            api_key=self.config.api_key,
+            jwt=jwt,
+            codec=self._codec,
+            compression_threshold=self.config.compression_threshold,
+            force=final,
+        )
+        if res.status == HttpStatus.PAYLOAD_TOO_LARGE:
+            for half in self._split_rejected_batch(batch):
+                await self._aupload_events(half, final=final)
+            return
+        if res.status == HttpStatus.INVALID_API_KEY and replay:
+            refreshed = await asyncio.get_running_loop().run_in_executor(
+                None, self._refresh_jwt, jwt
+            )
+            if refreshed:
+                await self._aupload_events(batch, replay=False, final=final)
+                return
+        if self._spool is None:
+            self._handle_events_response(url, serialized_payload, res, len(batch))
+        else:
+            # A failed upload is written to disk
+            await asyncio.get_running_loop().run_in_executor(
+                None,
+                self._handle_events_response,
+                url,
+                serialized_payload,
+                res,
+                len(batch),
             )
 
-    def _flush_queue(self) -> None:
-        with self.lock:
-            queue_copy = copy.deepcopy(self.queue)  # Copy the current items
-            self.queue = []
-
-            if len(queue_copy) > 0:
-                payload = {
-                    "events": queue_copy,
-                }
-
-                serialized_payload = safe_serialize(payload).encode("utf-8")
-                HttpClient.post(
-                    f"{self.config.endpoint}/v2/create_events",
-                    serialized_payload,
-                    jwt=self.jwt,
-                )
+    def _split_rejected_batch(self, batch: List[bytes]) -> List[List[bytes]]:
+        """
+        Halve a batch the server rejected as too large so each half can be retried. A single
+        event that is still too large is dropped so it can't hold back the events around it.
+        """
+        if len(batch) > 1:
+            middle = len(batch) // 2
+            return [batch[:middle], batch[middle:]]
 
-                logger.debug("\n<AGENTOPS_DEBUG_OUTPUT>")
-                logger.debug(f"Session request to {self.config.endpoint}/events")
-                logger.debug(serialized_payload)
-                logger.debug("</AGENTOPS_DEBUG_OUTPUT>\n")
+        metrics.increment("events.oversized")
+        logger.warning(
+            "Could not record event - it is too large to upload (%d bytes)",
+            len(batch[0]),
+        )
+        return []
+
+    def _handle_events_response(
+        self,
+        url: str,
+        serialized_payload: bytes,
+        res: Response,
+        count: int,
+        coalesced: bool = False,
+    ) -> None:
+        if self._spool is None:
+            if res.status != HttpStatus.SUCCESS:
+                metrics.increment("events.lost", count)
+                logger.warning(
+                    "Could not send %d events - they are lost. Enable the spool to keep failed "
+                    "uploads and send them later.",
+                    count,
+                )
+        else:
+            if res.status == HttpStatus.SUCCESS:
+                self._spool.wake()
+            elif res.is_retryable:
+                # A multi-session upload carries the JWT of every session in its body, next to
+                # the API key it was sent with
+                self._spool.append(
+                    SpoolRecord(
+                        url=url,
+                        payload=serialized_payload,
+                        jwt=None if coalesced else self.jwt,
+                        session_id=None if coalesced else str(self.session_id),
+                        codec=self._codec,
+                        api_key=self.config.api_key,
+                    )
+                )
 
-    def _run(self) -> None:
-        while not self.stop_flag.is_set():
-            time.sleep(self.config.max_wait_time / 1000)
-            if self.queue:
-                self._flush_queue()
+        logger.debug("\n<AGENTOPS_DEBUG_OUTPUT>")
+        logger.debug(f"Session request to {self.config.endpoint}/events")
+        logger.debug(serialized_payload)
+        logger.debug("</AGENTOPS_DEBUG_OUTPUT>\n")
 
     def create_agent(self, name, agent_id):
+        """
+        Register an agent with the session. Registrations are sent in batches by the exporter,
+        ahead of any event recorded after them.
+
+        Returns:
+            str: The agent id, generated if none is given.
+        """
         if agent_id is None:
             agent_id = str(uuid4())
 
-        payload = {
-            "id": agent_id,
-            "name": name,
-        }
+        with self._lock:
+            self._pending_agents.append({"id": agent_id, "name": name})
+            if self._agents_due is None:
+                self._agents_due = time.monotonic() + self.config.max_wait_time / 1000
+            agents_due = self._agents_due
+        if self._ready.is_set():
+            exporter.schedule(self, agents_due)
+
+        return agent_id
+
+    def _register_agents(self, final: bool = False) -> None:
+        """
+        Send the agents created since the last flush. Registrations that fail transiently are
+        kept and sent again with the next flush.
+        """
+        with self._lock:
+            agents, self._pending_agents = self._pending_agents, []
+            self._agents_due = None
+        if not agents:
+            return
+
+        if self.config.endpoint not in _agent_batches_unsupported:
+            res = self._post_agents("create_agents", {"agents": agents}, final)
+            if res.code not in (404, 405):
+                self._check_agents(res, "create_agents", agents, final)
+                return
+            logger.debug(
+                "create_agents is not available - registering agents one by one"
+            )
+            _agent_batches_unsupported.add(self.config.endpoint)
+
+        for i, agent in enumerate(agents):
+            res = self._post_agents("create_agent", agent, final)
+            if not self._check_agents(res, "create_agent", agents[i:], final):
+                return
 
-        serialized_payload = safe_serialize(payload).encode("utf-8")
-        HttpClient.post(
-            f"{self.config.endpoint}/v2/create_agent", serialized_payload, jwt=self.jwt
+    def _post_agents(self, route: str, body: dict, final: bool) -> Response:
+        jwt = self.jwt
+        payload = safe_serialize_bytes(body)
+        res = HttpClient.post(
+            f"{self.config.endpoint}/v2/{route}",
+            payload,
+            api_key=self.config.api_key,
+            jwt=jwt,
+            force=final,
         )
+        if res.status == HttpStatus.INVALID_API_KEY and self._refresh_jwt(jwt):
+            # The JWT lapsed mid-session; resend with the new one
+            res = HttpClient.post(
+                f"{self.config.endpoint}/v2/{route}",
+                payload,
+                api_key=self.config.api_key,
+                jwt=self.jwt,
+                force=final,
+            )
+        return res
 
-        return agent_id
+    def _check_agents(
+        self, res: Response, route: str, agents: List[dict], final: bool
+    ) -> bool:
+        """
+        Whether to go on registering agents after `res`, the response to registering the first of
+        `agents`. If it failed transiently, all of `agents` are queued again ahead of any created
+        since, unless this is the session's final flush.
+        """
+        if res.status == HttpStatus.SUCCESS:
+            return True
+        if not res.is_retryable or final:
+            logger.warning(
+                "Could not register agents - the server answered %s", res.code
+            )
+            return True
+
+        with self._lock:
+            self._pending_agents[:0] = agents
+            # Not before the endpoint's circuit lets requests through again
+            agents_due = max(
+                time.monotonic() + self.config.max_wait_time / 1000,
+                HttpClient.available_at(f"{self.config.endpoint}/v2/{route}"),
+                self._agents_due or 0.0,
+            )
+            self._agents_due = agents_due
+        exporter.schedule(self, agents_due)
+        return False
 
     def patch(self, func):
         @functools.wraps(func)
@@ -0,0 +1,600 @@
+"""
+AgentOps write-ahead spool for undeliverable uploads.
+
+Classes:
+    SpoolRecord: A single upload waiting to be replayed.
+    Spool: Append-only, size-capped on-disk store of SpoolRecords with background replay.
+
+Functions:
+    default_spool_dir: The current user's own spool directory in the system temp directory.
+    make_private_dir: Create a directory only the current user can read, or check they own it.
+    recover_spills: Hand events spilled to disk by sessions that are gone to the spool.
+"""
+
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from .http_client import HttpClient, HttpStatus, Response
+from .log_config import logger
+from .metrics import metrics
+
+DEFAULT_SPOOL_MAX_SIZE = 64 * 1024 * 1024
+DEFAULT_SEGMENT_SIZE = 4 * 1024 * 1024
+DEFAULT_REPLAY_INTERVAL = 30.0
+DEFAULT_STALE_AFTER = 60.0
+
+# Replays in which a record failed while others got through, before it is discarded
+DEFAULT_MAX_RECORD_ATTEMPTS = 5
+
+# Failed records in a row after which the endpoint is assumed down and replay stops
+_MAX_CONSECUTIVE_FAILURES = 2
+
+SEGMENT_SUFFIX = ".seg"
+CLAIMED_SUFFIX = ".replay"
+# Events a session's EventBuffer spilled to disk, one per line
+SPILL_SUFFIX = ".spill"
+RECOVERING_SUFFIX = ".recovering"
+
+# header length, payload length, crc32 of header + payload
+_RECORD_PREFIX = struct.Struct(">III")
+
+
+def default_spool_dir() -> str:
+    """An "agentops-<uid>" folder in the system temp directory, so users don't share one."""
+    if hasattr(os, "getuid"):
+        return os.path.join(tempfile.gettempdir(), f"agentops-{os.getuid()}")
+    # The temp directory is already per user on Windows
+    return os.path.join(tempfile.gettempdir(), "agentops")
+
+
+def _owned_by_user(path: str) -> bool:
+    if not hasattr(os, "getuid"):
+        return True
+    return os.stat(path).st_uid == os.getuid()
+
+
+def make_private_dir(directory: str) -> None:
+    """
+    Create `directory` readable by the current user only. Raises PermissionError if it already
+    exists and belongs to someone else, since the recorded prompts and completions written to it
+    would then be theirs to read, and anything they put in it would be uploaded as ours.
+    """
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    if not _owned_by_user(directory):
+        raise PermissionError(f"{directory} belongs to another user")
+
+
+class SpoolRecord(NamedTuple):
+    url: str
+    payload: bytes
+    jwt: Optional[str] = None
+    session_id: Optional[str] = None
+    codec: Optional[str] = None
+    api_key: Optional[str] = None
+    # Replays in which this record failed while others were delivered
+    attempts: int = 0
+
+
+class Spool:
+    """
+    Append-only on-disk store of uploads that could not be delivered.
+
+    Records are appended to segment files in `directory`, named so that they sort oldest first.
+    A segment is sealed once it reaches `segment_size` bytes; when the spool grows past `max_size`
+    the oldest segments are evicted; events spilled to the same directory count towards
+    `max_size` too. Replay claims whole sealed segments by renaming them, reads
+    them through a memory map and deletes them once every record has been delivered, so several
+    processes can share a directory. Segments left behind by other processes are only claimed
+    after `stale_after` seconds without writes.
+
+    A record that fails is kept for a later replay without holding up the records behind it.
+    Once it has failed in `max_record_attempts` replays that delivered other records, it is
+    discarded.
+
+    Args:
+        directory (str): Where segment files are kept.
+        max_size (int, optional): Maximum total size of all segments in bytes. Defaults to 64 MiB.
+        segment_size (int, optional): Size in bytes at which a segment is sealed. Defaults to 4 MiB.
+        stale_after (float, optional): Seconds before another process' segment may be replayed.
+        max_record_attempts (int, optional): Replays a record may fail in while others get
+            through. Defaults to 5.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_size: int = DEFAULT_SPOOL_MAX_SIZE,
+        segment_size: int = DEFAULT_SEGMENT_SIZE,
+        stale_after: float = DEFAULT_STALE_AFTER,
+        max_record_attempts: int = DEFAULT_MAX_RECORD_ATTEMPTS,
+    ):
+        self.directory = directory
+        self.max_size = max_size
+        self.segment_size = min(segment_size, max_size)
+        self.stale_after = stale_after
+        self.max_record_attempts = max_record_attempts
+        self._lock = threading.Lock()
+        self._active_path: Optional[str] = None
+        self._active_size = 0
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # Unknown until the first replay, which may find segments from a previous run
+        self._pending = True
+
+    def append(self, record: SpoolRecord) -> bool:
+        """Write `record` to the active segment. Returns False if it could not be written."""
+        header = json.dumps(
+            {
+                "url": record.url,
+                "jwt": record.jwt,
+                "session_id": record.session_id,
+                "codec": record.codec,
+                "api_key": record.api_key,
+                "attempts": record.attempts,
+            }
+        ).encode("utf-8")
+        body = header + record.payload
+        data = _RECORD_PREFIX.pack(len(header), len(record.payload), zlib.crc32(body))
+        data += body
+
+        with self._lock:
+            try:
+                if (
+                    self._active_path is None
+                    or self._active_size + len(data) > self.segment_size
+                ):
+                    self._active_path = self._new_segment_path()
+                    self._active_size = 0
+
+                fd = os.open(
+                    self._active_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600
+                )
+                try:
+                    os.write(fd, data)
+                finally:
+                    os.close(fd)
+                self._active_size += len(data)
+            except OSError as e:
+                logger.warning("Could not write undelivered events to disk - %s", e)
+                return False
+
+            self._pending = True
+            self._enforce_size_cap()
+
+        metrics.increment("spool.records_written")
+        metrics.increment("spool.bytes_written", len(data))
+        return True
+
+    def replay(self, send: Callable[[SpoolRecord], Optional[bool]]) -> int:
+        """
+        Deliver spooled records oldest first. A record that fails is kept for the next replay and
+        the ones behind it are still tried; replay stops once several fail in a row, as the
+        endpoint is then most likely down.
+
+        Args:
+            send: Delivers a record. Returns True on success, False if the record should be
+                retried later and None if it should be discarded.
+
+        Returns:
+            int: The number of records delivered.
+        """
+        with self._lock:
+            # Seal the active segment so it can be claimed like any other
+            self._active_path = None
+            self._active_size = 0
+
+        replay = _Replay(send)
+        for path in self._replayable_segments():
+            claimed = self._claim(path)
+            if claimed is None:
+                continue
+
+            records = list(_read_records(claimed))
+            attempted = replay.run(records)
+            failed = replay.take_failed()
+            if replay.stopped and not replay.progressed:
+                # Nothing in it was delivered; put it back as it was
+                os.rename(claimed, path)
+                break
+
+            for record in failed:
+                self._keep(record)
+            for record in records[attempted:]:
+                self.append(record)
+            os.remove(claimed)
+            if replay.stopped:
+                break
+
+        self._pending = self.has_pending()
+        metrics.increment("spool.records_replayed", replay.delivered)
+        return replay.delivered
+
+    def _keep(self, record: SpoolRecord) -> None:
+        """Write a failed record back for the next replay, unless it has failed too often."""
+        if record.attempts >= self.max_record_attempts:
+            metrics.increment("spool.records_discarded")
+            logger.warning(
+                "Discarding spooled upload to %s - it failed %d times",
+                record.url,
+                record.attempts,
+            )
+            return
+        self.append(record)
+
+    def start_replay(
+        self,
+        send: Callable[[SpoolRecord], Optional[bool]],
+        interval: float = DEFAULT_REPLAY_INTERVAL,
+    ) -> None:
+        """Replay in a background thread now, every `interval` seconds and on `wake()`."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run_replay, args=(send, interval), name="agentops-spool"
+            )
+            self._thread.daemon = True
+            self._thread.start()
+
+    def wake(self) -> None:
+        """Signal that the endpoint looks healthy, so replay should be attempted now."""
+        if self._pending:
+            self._wake.set()
+
+    def has_pending(self) -> bool:
+        return bool(self._list_segments())
+
+    def size(self) -> int:
+        return sum(size for _, size, _ in self._list_segments()) + _spill_size(
+            self.directory
+        )
+
+    def _run_replay(self, send, interval: float) -> None:
+        while True:
+            try:
+                self.replay(send)
+            except Exception as e:
+                logger.warning("Failed to replay undelivered events: %s", e)
+            self._wake.wait(interval)
+            self._wake.clear()
+
+    def _new_segment_path(self) -> str:
+        make_private_dir(self.directory)
+        name = f"{time.time_ns():020d}-{os.getpid()}{SEGMENT_SUFFIX}"
+        return os.path.join(self.directory, name)
+
+    def _list_segments(self) -> List[Tuple[str, int, float]]:
+        """(path, size, mtime) of every segment and claimed segment of ours, oldest first."""
+        try:
+            if not _owned_by_user(self.directory):
+                return []
+            names = sorted(os.listdir(self.directory))
+        except OSError:
+            return []
+
+        segments = []
+        for name in names:
+            if not (name.endswith(SEGMENT_SUFFIX) or name.endswith(CLAIMED_SUFFIX)):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if hasattr(os, "getuid") and stat.st_uid != os.getuid():
+                # Not written by us; never replayed, nor deleted to make room
+                continue
+            segments.append((path, stat.st_size, stat.st_mtime))
+        return segments
+
+    def _replayable_segments(self) -> List[str]:
+        suffix = f"-{os.getpid()}{SEGMENT_SUFFIX}"
+        now = time.time()
+        paths = []
+        for path, _, mtime in self._list_segments():
+            if path == self._active_path:
+                continue
+            is_stale = now - mtime > self.stale_after
+            if path.endswith(CLAIMED_SUFFIX):
+                # Left behind by a replay that never finished
+                if is_stale:
+                    paths.append(path[: -len(CLAIMED_SUFFIX)])
+            elif path.endswith(suffix) or is_stale:
+                paths.append(path)
+        return paths
+
+    def _claim(self, path: str) -> Optional[str]:
+        claimed = path + CLAIMED_SUFFIX
+        if os.path.exists(claimed):
+            return claimed
+        try:
+            os.rename(path, claimed)
+            # Renaming keeps the old mtime; refresh it so the claim doesn't look abandoned
+            os.utime(claimed)
+        except OSError:
+            # Another process got there first
+            return None
+        return claimed
+
+    def _enforce_size_cap(self) -> None:
+        segments = self._list_segments()
+        total = sum(size for _, size, _ in segments) + _spill_size(self.directory)
+        for path, size, _ in segments:
+            if total <= self.max_size:
+                break
+            if path == self._active_path or path.endswith(CLAIMED_SUFFIX):
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            metrics.increment("spool.bytes_evicted", size)
+            logger.warning(
+                "Spool is full - discarded %d bytes of undelivered events", size
+            )
+
+
+class _Replay:
+    """Progress of a single `Spool.replay` pass across segments."""
+
+    def __init__(self, send: Callable[[SpoolRecord], Optional[bool]]):
+        self.send = send
+        self.delivered = 0
+        self.stopped = False
+        # Whether any record of the last segment was delivered or discarded
+        self.progressed = False
+        # Failed records another record got through after, and the ones none has yet
+        self._failed: List[SpoolRecord] = []
+        self._unproven: List[SpoolRecord] = []
+
+    def run(self, records: List[SpoolRecord]) -> int:
+        """Send `records` until replay stops. Returns how many of them were attempted."""
+        self.progressed = False
+        for i, record in enumerate(records):
+            result = self.send(record)
+            if result is False:
+                self._unproven.append(record)
+                if len(self._unproven) >= _MAX_CONSECUTIVE_FAILURES:
+                    self.stopped = True
+                    return i + 1
+                continue
+
+            self.progressed = True
+            if result is None:
+                metrics.increment("spool.records_discarded")
+            else:
+                self.delivered += 1
+            # The endpoint is up, so whatever failed before this did so on its own account
+            self._failed.extend(
+                failed._replace(attempts=failed.attempts + 1)
+                for failed in self._unproven
+            )
+            self._unproven = []
+        return len(records)
+
+    def take_failed(self) -> List[SpoolRecord]:
+        """The failed records to keep; the ones no other record got through after aren't counted."""
+        failed = self._failed + self._unproven
+        self._failed, self._unproven = [], []
+        return failed
+
+
+def _spill_size(directory: str) -> int:
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return 0
+    total = 0
+    for name in names:
+        if name.endswith(SPILL_SUFFIX):
+            try:
+                total += os.stat(os.path.join(directory, name)).st_size
+            except OSError:
+                continue
+    return total
+
+
+def _read_records(path: str) -> Iterator[SpoolRecord]:
+    """Yield the intact records of a segment, stopping at the first torn or corrupt one."""
+    with open(path, "rb") as segment:
+        size = os.fstat(segment.fileno()).st_size
+        if size == 0:
+            return
+        try:
+            data = mmap.mmap(segment.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            data = segment.read()
+
+        try:
+            offset = 0
+            while offset + _RECORD_PREFIX.size <= size:
+                header_len, payload_len, crc = _RECORD_PREFIX.unpack_from(data, offset)
+                start = offset + _RECORD_PREFIX.size
+                end = start + header_len + payload_len
+                if end > size:
+                    break
+                body = data[start:end]
+                if zlib.crc32(body) != crc:
+                    logger.debug("Skipping corrupt spool record in %s", path)
+                    break
+                header = json.loads(body[:header_len])
+                yield SpoolRecord(
+                    url=header["url"],
+                    payload=bytes(body[header_len:]),
+                    jwt=header.get("jwt"),
+                    session_id=header.get("session_id"),
+                    codec=header.get("codec"),
+                    api_key=header.get("api_key"),
+                    attempts=header.get("attempts", 0),
+                )
+                offset = end
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+
+
+# Session id -> the JWT a replay last got for it, so each expired session is reauthorized once
+_replay_jwts: Dict[str, str] = {}
+
+
+def _reauthorize(record: SpoolRecord) -> Response:
+    """Ask the endpoint the record was sent to for a new JWT for its session."""
+    endpoint = record.url.rsplit("/", 1)[0]
+    res = HttpClient.post(
+        f"{endpoint}/reauthorize_jwt",
+        json.dumps({"session_id": record.session_id}).encode("utf-8"),
+        api_key=record.api_key,
+    )
+    jwt = res.body.get("jwt")
+    if res.code == 200 and jwt is not None:
+        _replay_jwts[record.session_id] = jwt
+    return res
+
+
+def send_record(record: SpoolRecord) -> Optional[bool]:
+    """
+    Default replay sender: re-post the upload as it was first attempted. If the session's JWT has
+    expired since, e.g. because the process restarted, a new one is requested with the API key;
+    an upload that still isn't authorized is discarded.
+    """
+    jwt = record.jwt
+    if record.session_id is not None:
+        jwt = _replay_jwts.get(record.session_id, jwt)
+    res = HttpClient.post(
+        record.url,
+        record.payload,
+        api_key=record.api_key,
+        jwt=jwt,
+        codec=record.codec,
+    )
+    if (
+        res.status == HttpStatus.INVALID_API_KEY
+        and record.session_id is not None
+        and record.api_key is not None
+    ):
+        auth = _reauthorize(record)
+        jwt = _replay_jwts.get(record.session_id)
+        if auth.code != 200 or jwt is None:
+            res = auth
+        else:
+            res = HttpClient.post(
+                record.url,
+                record.payload,
+                api_key=record.api_key,
+                jwt=jwt,
+                codec=record.codec,
+            )
+
+    if res.code == 200:
+        return True
+    if res.is_retryable and res.status != HttpStatus.INVALID_API_KEY:
+        return False
+    logger.warning("Discarding undeliverable spooled upload - %s", res.body)
+    return None
+
+
+def recover_spills(
+    directory: str,
+    url: str,
+    api_key: Optional[str],
+    max_batch_bytes: int,
+    spool: Optional[Spool] = None,
+    stale_after: float = DEFAULT_STALE_AFTER,
+) -> None:
+    """
+    Deal with spill files left behind by sessions that ended without draining them, e.g. because
+    their process crashed. Files written to within `stale_after` seconds may belong to a live
+    session and are left alone, as are files and directories that belong to another user. The
+    events of the others are appended to `spool` as create_events uploads of at most
+    `max_batch_bytes` to `url`, or discarded if there is no spool.
+    """
+    try:
+        if not _owned_by_user(directory):
+            logger.warning(
+                "Not recovering spilled events from %s - it belongs to another user",
+                directory,
+            )
+            return
+        names = sorted(os.listdir(directory))
+    except OSError:
+        return
+
+    now = time.time()
+    for name in names:
+        if not name.endswith(SPILL_SUFFIX):
+            continue
+        path = os.path.join(directory, name)
+        claimed = path + RECOVERING_SUFFIX
+        try:
+            if now - os.stat(path).st_mtime <= stale_after or not _owned_by_user(path):
+                continue
+            # Claim it, so no other process recovers it too
+            os.rename(path, claimed)
+        except OSError:
+            continue
+
+        if spool is None:
+            logger.warning(
+                "Discarding events spilled to disk by a previous session: %s", path
+            )
+        else:
+            session_id = name[: -len(SPILL_SUFFIX)]
+            for payload in _spilled_uploads(claimed, max_batch_bytes):
+                spool.append(
+                    SpoolRecord(
+                        url=url, payload=payload, session_id=session_id, api_key=api_key
+                    )
+                )
+        try:
+            os.remove(claimed)
+        except OSError:
+            pass
+
+
+def _spilled_uploads(path: str, max_batch_bytes: int) -> Iterator[bytes]:
+    """Read a spill file a line at a time into create_events payloads."""
+    prefix, separator, suffix = b'{"events": [', b", ", b"]}"
+    batch: List[bytes] = []
+    size = len(prefix) + len(suffix)
+    with open(path, "rb") as spill_file:
+        for line in spill_file:
+            event = line.rstrip(b"\n")
+            try:
+                json.loads(event)
+            except ValueError:
+                # e.g. the last line, torn by the crash
+                continue
+            if batch and size + len(event) + len(separator) > max_batch_bytes:
+                yield prefix + separator.join(batch) + suffix
+                batch, size = [], len(prefix) + len(suffix)
+            batch.append(event)
+            size += len(event) + len(separator)
+    if batch:
+        yield prefix + separator.join(batch) + suffix
+
+
+_spools: Dict[str, Spool] = {}
+_spools_lock = threading.Lock()
+
+
+def get_spool(directory: str, max_size: int = DEFAULT_SPOOL_MAX_SIZE) -> Spool:
+    """
+    Get the process-wide Spool for `directory`, starting its replay thread on first use. Anything
+    left over from a previous run is replayed straight away.
+    """
+    directory = os.path.abspath(directory)
+    with _spools_lock:
+        spool = _spools.get(directory)
+        if spool is None:
+            spool = Spool(directory, max_size=max_size)
+            _spools[directory] = spool
+            spool.start_replay(send_record)
+        return spool
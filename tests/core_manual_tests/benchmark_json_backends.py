@@ -0,0 +1,75 @@
+import timeit
+from uuid import uuid4
+from agentops import LLMEvent
+from agentops.helpers import safe_serialize_bytes
+from agentops.serialization import get_json_backend, set_json_backend
+
+###
+#  Compares the JSON backends on LLMEvent payloads shaped like real chat completions.
+#  Run with: python tests/core_manual_tests/benchmark_json_backends.py
+###
+
+
+class ChatCompletionMessage:
+    def __init__(self, content):
+        self.role = "assistant"
+        self.content = content
+
+    def model_dump_json(self):
+        return '{"role": "%s", "content": "%s"}' % (self.role, self.content)
+
+
+def make_event(turns):
+    messages = [
+        {"role": "system", "content": "You are a helpful assistant. " * 20},
+    ]
+    for i in range(turns):
+        messages.append({"role": "user", "content": f"Question {i}: " + "lorem " * 80})
+        messages.append({"role": "assistant", "content": "ipsum " * 120})
+
+    event = LLMEvent(
+        thread_id=uuid4(),
+        prompt=messages,
+        prompt_tokens=1200,
+        completion=ChatCompletionMessage("dolor " * 150),
+        completion_tokens=400,
+        model="gpt-4",
+        params={"temperature": 0.5, "max_tokens": 1024, "session": None},
+        returns={
+            "id": "chatcmpl-123",
+            "choices": [
+                {
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": ChatCompletionMessage("dolor " * 150),
+                }
+            ],
+            "usage": {"prompt_tokens": 1200, "completion_tokens": 400},
+        },
+    )
+    return dict(event.__dict__)
+
+
+def main():
+    default = get_json_backend()
+    payloads = {"small": make_event(1), "large": make_event(20)}
+    print(f"{'backend':<10}{'payload':<10}{'bytes':>10}{'us/event':>12}")
+
+    for name in ("json", "orjson", "msgspec"):
+        try:
+            set_json_backend(name)
+        except ValueError:
+            print(f"{name:<10}not installed")
+            continue
+
+        for label, payload in payloads.items():
+            size = len(safe_serialize_bytes(payload))
+            runs = 2000
+            seconds = timeit.timeit(lambda: safe_serialize_bytes(payload), number=runs)
+            print(f"{name:<10}{label:<10}{size:>10}{seconds / runs * 1e6:>12.1f}")
+
+    set_json_backend(default)
+
+
+if __name__ == "__main__":
+    main()
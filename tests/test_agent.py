@@ -0,0 +1,142 @@
+import asyncio
+import requests_mock
+import pytest
+import agentops
+from agentops import ActionEvent, track_agent
+from agentops import helpers
+from agentops.helpers import clear_singletons, get_current_agent_id
+from agentops.http_client import HttpClient
+
+
+@pytest.fixture(autouse=True)
+def setup_teardown():
+    clear_singletons()
+    HttpClient.configure_retry()  # close circuits opened by earlier tests
+    yield
+    agentops.end_all_sessions()  # teardown part
+
+
+@pytest.fixture
+def mock_req():
+    with requests_mock.Mocker() as m:
+        url = "https://api.agentops.ai"
+        m.post(url + "/v2/create_events", text="ok")
+        m.post(
+            url + "/v2/create_session", json={"status": "success", "jwt": "some_jwt"}
+        )
+        m.post(url + "/v2/create_agents", json={"status": "success"})
+        m.post(url + "/v2/update_session", json={"status": "success", "token_cost": 5})
+        yield m
+
+
+class BaseAgent:
+    def inherited(self):
+        return ActionEvent("inherited").agent_id
+
+
+@track_agent(name="worker")
+class Worker(BaseAgent):
+    def __init__(self):
+        self.created_in = get_current_agent_id()
+
+    def act(self):
+        return ActionEvent("act").agent_id
+
+    async def aact(self):
+        await asyncio.sleep(0.01)
+        return get_current_agent_id()
+
+
+class TestTrackAgent:
+    def setup_method(self):
+        agentops.init(api_key="random_api_key", max_wait_time=50)
+
+    def test_methods_attribute_events(self, mock_req):
+        agent = Worker()
+
+        assert agent.created_in == agent.agent_ops_agent_id
+        assert agent.act() == agent.agent_ops_agent_id
+        assert agent.inherited() == agent.agent_ops_agent_id
+        assert ActionEvent("outside").agent_id is None
+
+    @pytest.mark.asyncio
+    async def test_concurrent_tasks_keep_their_agent(self, mock_req):
+        agents = [Worker() for _ in range(3)]
+
+        results = await asyncio.gather(*(agent.aact() for agent in agents))
+        assert results == [agent.agent_ops_agent_id for agent in agents]
+
+    def test_tracked_function(self, mock_req):
+        @track_agent(name="function_agent")
+        def act():
+            return get_current_agent_id()
+
+        assert act() == act.agent_ops_agent_id
+
+    def test_stack_scan_is_opt_in(self, mock_req, monkeypatch):
+        class Untracked:
+            agent_ops_agent_id = "scanned-agent"
+            agent_ops_agent_name = "untracked"
+
+            def act(self):
+                return get_current_agent_id()
+
+        assert Untracked().act() is None
+        monkeypatch.setattr(helpers, "agent_stack_scan_enabled", True)
+        assert Untracked().act() == "scanned-agent"
+
+    def test_stack_scan_finds_agent_in_code_seen_without_one(
+        self, mock_req, monkeypatch
+    ):
+        monkeypatch.setattr(helpers, "agent_stack_scan_enabled", True)
+
+        class Scanned:
+            def __init__(self):
+                self.agent_ops_agent_id = "scanned-agent"
+
+        def handle(agent):
+            return get_current_agent_id()
+
+        # The same code may hold an agent on a later call even if it held none before
+        assert handle(None) is None
+        assert handle(Scanned()) == "scanned-agent"
+
+    def test_stack_scan_looks_at_agent_locals_first(self, mock_req, monkeypatch):
+        monkeypatch.setattr(helpers, "agent_stack_scan_enabled", True)
+
+        class Scanned:
+            def __init__(self):
+                self.agent_ops_agent_id = "scanned-agent"
+
+        def handle(first, agent):
+            return get_current_agent_id()
+
+        def no_locals():
+            return get_current_agent_id()
+
+        assert handle(None, Scanned()) == "scanned-agent"
+        assert helpers._agent_locals[handle.__code__] == ("agent",)
+        # Another local holding the agent is still found
+        assert handle(Scanned(), None) == "scanned-agent"
+        assert helpers._agent_locals[handle.__code__] == ("first", "agent")
+
+        # Frames of code without locals can never hold an agent
+        assert no_locals() is None
+        assert helpers._agent_locals[no_locals.__code__] is None
+        # Nor can frames of the SDK's own code
+        assert helpers._agent_locals[get_current_agent_id.__code__] is None
+
+    def test_stack_scan_depth_is_capped(self, mock_req, monkeypatch):
+        monkeypatch.setattr(helpers, "agent_stack_scan_enabled", True)
+
+        def nested(depth):
+            return nested(depth - 1) if depth else get_current_agent_id()
+
+        class Scanned:
+            agent_ops_agent_id = "scanned-agent"
+
+            def act(self, depth):
+                return nested(depth)
+
+        assert Scanned().act(5) == "scanned-agent"
+        assert Scanned().act(helpers._MAX_STACK_DEPTH) is None
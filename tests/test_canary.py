@@ -5,11 +5,13 @@ import time
 import agentops
 from agentops import ActionEvent
 from agentops.helpers import clear_singletons
+from agentops.http_client import HttpClient
 
 
 @pytest.fixture(autouse=True)
 def setup_teardown():
     clear_singletons()
+    HttpClient.configure_retry()  # close circuits opened by earlier tests
     yield
     agentops.end_all_sessions()  # teardown part
 
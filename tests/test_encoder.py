@@ -0,0 +1,26 @@
+import json
+import time
+from agentops.encoder import EncodedEvent, EventEncoder
+
+
+class TestEncodedEvent:
+    def test_encodes_once_and_releases_event(self):
+        event = EncodedEvent({"id": 1, "dropped": None})
+
+        data = event.encode()
+        assert json.loads(data) == {"id": 1}
+        assert event._event is None
+        assert event.encode() is data
+
+    def test_background_encoding(self):
+        encoder = EventEncoder()
+        events = [EncodedEvent({"id": i}) for i in range(10)]
+        for event in events:
+            encoder.submit(event)
+
+        deadline = time.monotonic() + 2
+        while events[-1]._data is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        assert [event._event for event in events] == [None] * 10
+        assert json.loads(events[3].encode()) == {"id": 3}
@@ -0,0 +1,97 @@
+import json
+import threading
+import time
+from agentops.encoder import EncodedEvent
+from agentops.enums import OverflowPolicy
+from agentops.event_buffer import EventBuffer
+
+
+class TestEventBuffer:
+    def test_drop_oldest(self):
+        buffer = EventBuffer(capacity=2, policy=OverflowPolicy.DROP_OLDEST)
+        for i in range(3):
+            buffer.put({"id": i})
+
+        assert buffer.drain() == [{"id": 1}, {"id": 2}]
+        assert buffer.dropped == 1
+
+    def test_drop_newest(self):
+        buffer = EventBuffer(capacity=2, policy=OverflowPolicy.DROP_NEWEST)
+        for i in range(3):
+            buffer.put({"id": i})
+
+        assert buffer.drain() == [{"id": 0}, {"id": 1}]
+        assert buffer.dropped == 1
+
+    def test_block_times_out(self):
+        buffer = EventBuffer(
+            capacity=1, policy=OverflowPolicy.BLOCK, block_timeout=0.05
+        )
+        buffer.put({"id": 0})
+
+        start = time.monotonic()
+        buffer.put({"id": 1})
+        assert time.monotonic() - start >= 0.05
+        assert buffer.drain() == [{"id": 0}]
+        assert buffer.dropped == 1
+
+    def test_block_waits_for_drain(self):
+        buffer = EventBuffer(capacity=1, policy=OverflowPolicy.BLOCK, block_timeout=5)
+        buffer.put({"id": 0})
+
+        drained = []
+        timer = threading.Timer(0.05, lambda: drained.extend(buffer.drain()))
+        timer.start()
+        buffer.put({"id": 1})
+        timer.join()
+
+        assert drained == [{"id": 0}]
+        assert buffer.drain() == [{"id": 1}]
+        assert buffer.dropped == 0
+
+    def test_spill(self, tmp_path):
+        spill_path = str(tmp_path / "session.spill")
+        buffer = EventBuffer(
+            capacity=1, policy=OverflowPolicy.SPILL, spill_path=spill_path
+        )
+        for i in range(3):
+            assert buffer.put(EncodedEvent({"id": i})) == i + 1
+
+        assert buffer.spilled == 2
+        assert [json.loads(event.encode()) for event in buffer.drain()] == [
+            {"id": 0},
+            {"id": 1},
+            {"id": 2},
+        ]
+        assert not (tmp_path / "session.spill").exists()
+
+    def test_spill_is_private(self, tmp_path):
+        spill_path = tmp_path / "spool" / "session.spill"
+        buffer = EventBuffer(
+            capacity=1, policy=OverflowPolicy.SPILL, spill_path=str(spill_path)
+        )
+        for i in range(2):
+            buffer.put(EncodedEvent({"id": i}))
+
+        assert spill_path.stat().st_mode & 0o777 == 0o600
+        assert spill_path.parent.stat().st_mode & 0o777 == 0o700
+
+    def test_spill_is_capped(self, tmp_path):
+        spill_path = str(tmp_path / "session.spill")
+        buffer = EventBuffer(
+            capacity=1,
+            policy=OverflowPolicy.SPILL,
+            spill_path=spill_path,
+            spill_max_size=30,
+        )
+        for i in range(5):
+            buffer.put(EncodedEvent({"id": i}))
+
+        # Each spilled event takes 10 bytes
+        assert buffer.spilled == 3
+        assert buffer.dropped == 1
+        assert len(buffer.drain()) == 4
+
+        buffer.put(EncodedEvent({"id": 5}))
+        assert buffer.put(EncodedEvent({"id": 6})) == 2
+        assert buffer.spilled == 4
@@ -4,11 +4,13 @@ import pytest
 import agentops
 from agentops import ActionEvent, ErrorEvent
 from agentops.helpers import clear_singletons
+from agentops.http_client import HttpClient
 
 
 @pytest.fixture(autouse=True)
 def setup_teardown():
     clear_singletons()
+    HttpClient.configure_retry()  # close circuits opened by earlier tests
     yield
     agentops.end_all_sessions()  # teardown part
 
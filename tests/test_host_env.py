@@ -1,3 +1,5 @@
+import sys
+from pathlib import PurePosixPath
 from unittest.mock import patch
 from agentops import host_env
 
@@ -33,6 +35,32 @@ def mock_disk_usage(partition):
         raise PermissionError("Device access exception should have been caught")
 
 
+class FakeDistribution:
+    def __init__(self, version, top_level=None, files=()):
+        self.version = version
+        self.top_level = top_level
+        self.files = [PurePosixPath(file) for file in files]
+
+    def read_text(self, filename):
+        return self.top_level if filename == "top_level.txt" else None
+
+
+def fake_distributions():
+    return [
+        FakeDistribution("6.0", top_level="_yaml\nyaml\n"),
+        FakeDistribution(
+            "1.2.3",
+            files=[
+                "attr/__init__.py",
+                "attrs/__init__.py",
+                "attrs-1.2.3.dist-info/RECORD",
+            ],
+        ),
+        FakeDistribution("0.1", files=["single_module.py"]),
+        FakeDistribution("9.9", top_level="yaml"),
+    ]
+
+
 class TestHostEnv:
     @patch("psutil.disk_partitions", new=lambda: [mock_partitions()[0]])
     @patch("psutil.disk_usage", new=mock_disk_usage)
@@ -53,3 +81,98 @@ class TestHostEnv:
         assert sda1["Used"] == "0.00 GB"
         assert sda1["Free"] == "1.00 GB"
         assert sda1["Percentage"] == "100%"
+
+    def test_static_details_collected_once(self):
+        host_env._static_details.clear()
+        with patch("psutil.disk_partitions", return_value=[]) as disk_partitions, patch(
+            "psutil.cpu_percent", side_effect=[10.0, 20.0]
+        ):
+            first = host_env.get_host_env()
+            second = host_env.get_host_env()
+
+        assert disk_partitions.call_count == 1
+        assert second["Installed Packages"] is first["Installed Packages"]
+        assert first["CPU"]["CPU Usage"] == "10.0%"
+        assert second["CPU"]["CPU Usage"] == "20.0%"
+        host_env._static_details.clear()
+
+    @patch("psutil.disk_partitions", new=lambda: [mock_partitions()[0]])
+    def test_dynamic_details_read_per_call(self):
+        host_env._static_details.clear()
+        usages = [
+            sdiskusage(total=(1024**3), used=0, free=(1024**3), percent=0),
+            sdiskusage(total=(1024**3), used=(1024**3), free=0, percent=100),
+        ]
+        with patch("psutil.disk_usage", side_effect=[usages[0], *usages]):
+            first = host_env.get_host_env()
+            with patch.dict(sys.modules, {"late_import": sys}), patch.dict(
+                host_env._get_distribution_index(),
+                {"late_import": FakeDistribution("2.0")},
+            ):
+                second = host_env.get_host_env()
+
+        assert first["Disk"]["/dev/sda1"]["Percentage"] == "0%"
+        assert second["Disk"]["/dev/sda1"]["Percentage"] == "100%"
+        assert second["Disk"]["/dev/sda1"]["Total"] == "1.00 GB"
+        # Imported after the first session started, e.g. an LLM SDK
+        assert "late_import" not in first["SDK"]["System Packages"]
+        assert second["SDK"]["System Packages"]["late_import"] == "2.0"
+        host_env._static_details.clear()
+        host_env._package_versions.pop("late_import", None)
+
+    def test_preload_collects_in_background(self):
+        host_env._static_details.clear()
+        host_env._preloader = None
+        host_env.preload_host_env()
+        host_env._preloader.join(10)
+
+        assert "Installed Packages" in host_env._static_details
+        with patch("importlib.metadata.distributions") as distributions:
+            host_env.get_host_env()
+        distributions.assert_not_called()
+
+    @patch("importlib.metadata.distributions", new=fake_distributions)
+    def test_sys_packages(self):
+        loaded = ["yaml", "yaml.constructor", "_yaml", "attrs", "single_module", "os"]
+        with patch.object(host_env, "_distribution_index", None), patch.dict(
+            host_env._package_versions, clear=True
+        ), patch.dict(sys.modules, {name: sys for name in loaded}):
+            packages = host_env.get_sys_packages()
+
+        assert {name: packages[name] for name in loaded if name in packages} == {
+            "yaml": "6.0",
+            "attrs": "1.2.3",
+            "single_module": "0.1",
+        }
+
+    def test_fingerprint_covers_static_details(self):
+        host_env._static_details.clear()
+        host_env._fingerprints.clear()
+        fingerprint = host_env.get_host_env_fingerprint()
+        env = host_env.get_host_env()
+
+        assert len(fingerprint) == 64
+        assert host_env.get_host_env_fingerprint(opt_out=True) != fingerprint
+        stripped = host_env.strip_static_details(env)
+        assert set(stripped) >= {
+            "SDK",
+            "OS",
+            "CPU",
+            "RAM",
+            "Project Working Directory",
+            "Virtual Environment",
+        }
+        assert "Installed Packages" not in stripped
+        assert list(stripped["OS"]) == ["Hostname"]
+        assert list(stripped["SDK"]) == ["System Packages"]
+        assert list(stripped["CPU"]) == ["CPU Usage"]
+        for usage in stripped.get("Disk", {}).values():
+            assert list(usage) == ["Used", "Free", "Percentage"]
+
+        # Recomputed from scratch, e.g. by a replica of the same image in another container
+        host_env._static_details.clear()
+        host_env._fingerprints.clear()
+        with patch("socket.gethostname", return_value="replica-2"):
+            assert host_env.get_host_env_fingerprint() == fingerprint
+            assert host_env.get_host_env()["OS"]["Hostname"] == "replica-2"
+        host_env._static_details.clear()
@@ -0,0 +1,369 @@
+import asyncio
+import gzip
+import json
+import pytest
+import time
+import requests
+import requests_mock
+from agentops.async_http_client import (
+    AsyncHttpBackend,
+    AsyncHttpClient,
+    NotSentError,
+    StreamsBackend,
+)
+from agentops.http_client import HttpClient, HttpStatus, JSON_HEADER
+from agentops.metrics import metrics
+from agentops.retry import CircuitState, RetryPolicy, parse_retry_after
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+
+@pytest.fixture(autouse=True)
+def reset_pool():
+    HttpClient.configure_pool(pool_idle_timeout=60.0)
+    HttpClient.configure_retry(
+        RetryPolicy(base_delay=0.01, max_delay=0.05),
+        failure_threshold=5,
+        reset_timeout=30.0,
+    )
+    HttpClient._rejected_codecs.clear()
+    metrics.reset()
+    yield
+    HttpClient.close()
+    HttpClient.configure_retry(RetryPolicy())
+
+
+@pytest.fixture
+def mock_req():
+    with requests_mock.Mocker() as m:
+        url = "https://api.agentops.ai"
+        m.post(url + "/v2/create_events", json={"status": "ok"})
+        m.post(url + "/v2/create_session", json={"status": "ok"})
+        yield m
+
+
+class TestHttpClient:
+    def setup_method(self):
+        self.url = "https://api.agentops.ai"
+
+    def test_reuses_transport_per_origin(self, mock_req):
+        first = HttpClient._get_session(self.url + "/v2/create_session")
+        second = HttpClient._get_session(self.url + "/v2/create_events")
+        other = HttpClient._get_session("https://example.com/v2/create_events")
+
+        assert first is second
+        assert first is not other
+
+    def test_evicts_idle_transport(self, mock_req):
+        HttpClient.configure_pool(pool_idle_timeout=0)
+        first = HttpClient._get_session(self.url + "/v2/create_events")
+        second = HttpClient._get_session(self.url + "/v2/create_events")
+
+        assert first is not second
+
+    def test_headers_are_per_request(self, mock_req):
+        res = HttpClient.post(
+            self.url + "/v2/create_session", b"{}", api_key="some_api_key"
+        )
+        assert res.status == HttpStatus.SUCCESS
+        assert mock_req.last_request.headers["X-Agentops-Api-Key"] == "some_api_key"
+
+        HttpClient.post(self.url + "/v2/create_events", b"{}", jwt="some_jwt")
+        assert "X-Agentops-Api-Key" not in mock_req.last_request.headers
+        assert mock_req.last_request.headers["Authorization"] == "Bearer some_jwt"
+        assert "Authorization" not in JSON_HEADER
+
+    def test_compresses_large_payloads(self, mock_req):
+        payload = json.dumps({"events": ["prompt " * 500]}).encode("utf-8")
+        HttpClient.post(
+            self.url + "/v2/create_events",
+            payload,
+            codec="gzip",
+            compression_threshold=1024,
+        )
+
+        request = mock_req.last_request
+        assert request.headers["Content-Encoding"] == "gzip"
+        assert gzip.decompress(request.body) == payload
+        assert metrics.get("http.bytes_raw") == len(payload)
+        assert metrics.get("http.bytes_wire") == len(request.body)
+        assert metrics.get("http.bytes_wire") < metrics.get("http.bytes_raw")
+
+    def test_small_payloads_uncompressed(self, mock_req):
+        HttpClient.post(self.url + "/v2/create_events", b"{}", codec="gzip")
+
+        assert "Content-Encoding" not in mock_req.last_request.headers
+        assert mock_req.last_request.json() == {}
+
+    def test_falls_back_when_codec_rejected(self, mock_req):
+        mock_req.post(
+            self.url + "/v2/create_events",
+            [{"status_code": 415, "text": "unsupported"}, {"json": {"status": "ok"}}],
+        )
+        payload = json.dumps({"events": ["prompt " * 500]}).encode("utf-8")
+
+        res = HttpClient.post(self.url + "/v2/create_events", payload, codec="gzip")
+        assert res.status == HttpStatus.SUCCESS
+        assert "Content-Encoding" not in mock_req.last_request.headers
+        assert mock_req.last_request.body == payload
+
+        # The origin is remembered so later uploads skip the codec entirely
+        HttpClient.post(self.url + "/v2/create_events", payload, codec="gzip")
+        assert mock_req.call_count == 3
+        assert "Content-Encoding" not in mock_req.last_request.headers
+
+    def test_bad_request_keeps_codec(self, mock_req):
+        mock_req.post(
+            self.url + "/v2/create_events",
+            status_code=400,
+            json={"error": "event_type is required"},
+        )
+        payload = json.dumps({"events": ["prompt " * 500]}).encode("utf-8")
+
+        res = HttpClient.post(self.url + "/v2/create_events", payload, codec="gzip")
+        assert res.status == HttpStatus.INVALID_REQUEST
+        # A validation error is about the events, not the encoding: not resent, codec kept
+        assert mock_req.call_count == 1
+        assert not HttpClient._rejected_codecs
+
+        mock_req.post(
+            self.url + "/v2/create_events",
+            [
+                {"status_code": 400, "json": {"error": "unsupported Content-Encoding"}},
+                {"json": {"status": "ok"}},
+            ],
+        )
+        res = HttpClient.post(self.url + "/v2/create_events", payload, codec="gzip")
+        assert res.status == HttpStatus.SUCCESS
+        assert mock_req.last_request.body == payload
+
+
+class TestRetry:
+    def setup_method(self):
+        self.url = "https://api.agentops.ai/v2/create_events"
+
+    def test_retries_requests_that_were_not_processed(self, mock_req):
+        refused = requests.exceptions.ConnectionError(
+            MaxRetryError(None, self.url, NewConnectionError(None, "refused"))
+        )
+        mock_req.post(
+            self.url,
+            [
+                {"exc": refused},
+                {"status_code": 503, "headers": {"Retry-After": "0"}},
+                {"json": {"status": "ok"}},
+            ],
+        )
+
+        res = HttpClient.post(self.url, b"{}")
+        assert res.status == HttpStatus.SUCCESS
+        assert mock_req.call_count == 3
+        assert metrics.get("http.retries") == 2
+
+    @pytest.mark.parametrize(
+        "response",
+        [
+            {"exc": requests.exceptions.ReadTimeout},
+            {"status_code": 500},
+            {"status_code": 503},
+        ],
+    )
+    def test_does_not_resend_requests_that_may_have_been_processed(
+        self, mock_req, response
+    ):
+        mock_req.post(self.url, [response, {"json": {"status": "ok"}}])
+
+        res = HttpClient.post(self.url, b"{}")
+        assert res.is_retryable
+        assert mock_req.call_count == 1
+
+    def test_does_not_retry_client_errors(self, mock_req):
+        mock_req.post(self.url, status_code=400, json={"error": "bad"})
+
+        assert HttpClient.post(self.url, b"{}").status == HttpStatus.INVALID_REQUEST
+        assert mock_req.call_count == 1
+
+    def test_honours_retry_after(self, mock_req):
+        mock_req.post(
+            self.url,
+            [
+                {"status_code": 429, "headers": {"Retry-After": "0.2"}},
+                {"json": {"status": "ok"}},
+            ],
+        )
+
+        start = time.monotonic()
+        assert HttpClient.post(self.url, b"{}").status == HttpStatus.SUCCESS
+        assert time.monotonic() - start >= 0.2
+
+    def test_long_retry_after_opens_circuit(self, mock_req):
+        mock_req.post(self.url, status_code=503, headers={"Retry-After": "120"})
+
+        assert HttpClient.post(self.url, b"{}").status == HttpStatus.FAILED
+        assert mock_req.call_count == 1
+        assert not HttpClient.is_available(self.url)
+        assert HttpClient.is_available("https://api.agentops.ai/v2/create_session")
+
+    def test_circuit_opens_and_recovers(self, mock_req):
+        HttpClient.configure_retry(
+            RetryPolicy(max_attempts=2, base_delay=0.01, max_delay=0.05),
+            failure_threshold=3,
+            reset_timeout=0.1,
+        )
+        mock_req.post(self.url, status_code=503, headers={"Retry-After": "0"})
+
+        # A request counts once, however many attempts it took
+        for _ in range(2):
+            assert HttpClient.post(self.url, b"{}").status == HttpStatus.FAILED
+        assert HttpClient._breaker(self.url).state == CircuitState.CLOSED
+
+        res = HttpClient.post(self.url, b"{}")
+        assert res.status == HttpStatus.FAILED
+        assert mock_req.call_count == 6
+        assert HttpClient._breaker(self.url).state == CircuitState.OPEN
+        assert metrics.get("circuit.opened") == 1
+
+        # Refused without touching the network while open
+        res = HttpClient.post(self.url, b"{}")
+        assert res.is_retryable
+        assert mock_req.call_count == 6
+
+        # Unless forced, which makes a single attempt
+        assert HttpClient.post(self.url, b"{}", force=True).code == 503
+        assert mock_req.call_count == 7
+
+        time.sleep(0.1)
+        mock_req.post(self.url, json={"status": "ok"})
+        assert HttpClient.post(self.url, b"{}").status == HttpStatus.SUCCESS
+        assert HttpClient._breaker(self.url).state == CircuitState.CLOSED
+        assert metrics.get("circuit.half_opened") == 1
+        assert metrics.get("circuit.closed") == 1
+
+    def test_decorrelated_jitter_is_bounded(self):
+        policy = RetryPolicy(max_attempts=10, base_delay=0.1, max_delay=1.0)
+        delay = 0.0
+        for attempt in range(1, 10):
+            next_delay = policy.next_delay(attempt, delay)
+            assert 0.1 <= next_delay <= min(1.0, max(0.1, delay * 3))
+            delay = next_delay
+        assert policy.next_delay(10, delay) is None
+
+    def test_parse_retry_after(self):
+        assert parse_retry_after("3") == 3.0
+        assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+        assert parse_retry_after("soon") is None
+        assert parse_retry_after(None) is None
+
+    @pytest.mark.asyncio
+    async def test_async_retries(self):
+        class FlakyBackend(AsyncHttpBackend):
+            def __init__(self):
+                self.calls = 0
+
+            async def post(self, url, data, headers, timeout):
+                self.calls += 1
+                if self.calls == 1:
+                    return 503, b"", {"retry-after": "0"}
+                return 200, b'{"status": "ok"}', {}
+
+        backend = FlakyBackend()
+        previous = AsyncHttpClient.backend
+        AsyncHttpClient.set_backend(backend)
+        try:
+            res = await AsyncHttpClient.post(self.url, b"{}")
+        finally:
+            AsyncHttpClient.set_backend(previous)
+
+        assert res.status == HttpStatus.SUCCESS
+        assert backend.calls == 2
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize(
+        "error, calls", [(NotSentError("refused"), 2), (asyncio.TimeoutError(), 1)]
+    )
+    async def test_async_retries_only_unsent_requests(self, error, calls):
+        class FailingBackend(AsyncHttpBackend):
+            def __init__(self):
+                self.calls = 0
+
+            async def post(self, url, data, headers, timeout):
+                self.calls += 1
+                if self.calls == 1:
+                    raise error
+                return 200, b'{"status": "ok"}', {}
+
+        backend = FailingBackend()
+        previous = AsyncHttpClient.backend
+        AsyncHttpClient.set_backend(backend)
+        try:
+            await AsyncHttpClient.post(self.url, b"{}")
+        finally:
+            AsyncHttpClient.set_backend(previous)
+
+        assert backend.calls == calls
+
+
+class TestStreamsBackend:
+    @pytest.mark.asyncio
+    async def test_post(self):
+        received = {}
+
+        async def handle(reader, writer):
+            head = await reader.readuntil(b"\r\n\r\n")
+            lines = head.decode("latin-1").split("\r\n")
+            headers = dict(line.split(": ", 1) for line in lines[1:] if line)
+            received["request_line"] = lines[0]
+            received["headers"] = headers
+            received["body"] = await reader.readexactly(int(headers["Content-Length"]))
+
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+                b'7\r\n{"jwt":\r\n7\r\n "abc"}\r\n0\r\n\r\n'
+            )
+            await writer.drain()
+            writer.close()
+
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            code, body, headers = await StreamsBackend().post(
+                f"http://127.0.0.1:{port}/v2/create_session",
+                b'{"session": {}}',
+                {"Content-Type": "application/json"},
+                timeout=5,
+            )
+
+        assert code == 200
+        assert headers["transfer-encoding"] == "chunked"
+        assert json.loads(body) == {"jwt": "abc"}
+        assert received["request_line"] == "POST /v2/create_session HTTP/1.1"
+        assert received["headers"]["Content-Type"] == "application/json"
+        assert received["body"] == b'{"session": {}}'
+
+    @pytest.mark.asyncio
+    async def test_post_through_proxy(self, monkeypatch):
+        received = {}
+
+        async def proxy(reader, writer):
+            head = await reader.readuntil(b"\r\n\r\n")
+            received["request_line"] = head.decode("latin-1").split("\r\n")[0]
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+            await writer.drain()
+            writer.close()
+
+        server = await asyncio.start_server(proxy, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        monkeypatch.setenv("HTTP_PROXY", f"http://127.0.0.1:{port}")
+        monkeypatch.delenv("NO_PROXY", raising=False)
+        monkeypatch.delenv("no_proxy", raising=False)
+        async with server:
+            code, body, _ = await StreamsBackend().post(
+                "http://api.agentops.test/v2/create_events", b"{}", {}, timeout=5
+            )
+
+        assert code == 200
+        assert body == b"ok"
+        # Sent to the proxy, addressed to the real host
+        assert (
+            received["request_line"]
+            == "POST http://api.agentops.test/v2/create_events HTTP/1.1"
+        )
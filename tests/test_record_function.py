@@ -5,6 +5,7 @@ import agentops
 from agentops import record_function
 from datetime import datetime
 from agentops.helpers import clear_singletons
+from agentops.http_client import HttpClient
 import contextlib
 
 jwts = ["some_jwt", "some_jwt2", "some_jwt3"]
@@ -13,6 +14,7 @@ jwts = ["some_jwt", "some_jwt2", "some_jwt3"]
 @pytest.fixture(autouse=True)
 def setup_teardown():
     clear_singletons()
+    HttpClient.configure_retry()  # close circuits opened by earlier tests
     yield
     agentops.end_all_sessions()  # teardown part
 
@@ -0,0 +1,129 @@
+import json
+import pytest
+from uuid import uuid4
+from agentops import serialization
+from agentops.helpers import filter_unjsonable, safe_serialize
+from agentops.serialization import (
+    JsonBackend,
+    StdlibBackend,
+    get_json_backend,
+    set_json_backend,
+)
+
+
+class Completion:
+    probes = 0
+
+    def __getattribute__(self, name):
+        if name == "to_dict":
+            Completion.probes += 1
+        return object.__getattribute__(self, name)
+
+    def to_dict(self):
+        return {"content": "hi"}
+
+
+class Opaque:
+    pass
+
+
+@pytest.fixture(autouse=True)
+def restore_backend():
+    backend = get_json_backend()
+    yield
+    set_json_backend(backend)
+
+
+def available_backends():
+    names = []
+    for name in ("json", "orjson", "msgspec"):
+        try:
+            set_json_backend(name)
+        except ValueError:
+            continue
+        names.append(name)
+    return names
+
+
+class TestSerialization:
+    def test_backends_agree(self):
+        session_id = uuid4()
+        event = {
+            "session_id": session_id,
+            "prompt": [{"role": "user", "content": "Hello"}],
+            "completion": Completion(),
+            "params": {1: "int key"},
+            "returns": Opaque(),
+            "dropped": None,
+        }
+
+        expected = {
+            "session_id": str(session_id),
+            "prompt": [{"role": "user", "content": "Hello"}],
+            "completion": {"content": "hi"},
+            "params": {"1": "int key"},
+            "returns": "<<non-serializable: Opaque>>",
+        }
+        for name in available_backends():
+            set_json_backend(name)
+            assert json.loads(safe_serialize(event)) == expected, name
+
+    def test_conversion_strategy_cached_per_type(self):
+        serialization._strategies.pop(Completion, None)
+
+        safe_serialize([Completion() for _ in range(10)])
+        first_probes = Completion.probes
+        safe_serialize([Completion() for _ in range(10)])
+
+        # Only the chosen conversion is looked up per object; the probing ran once
+        assert Completion.probes - first_probes == 10
+        assert Completion in serialization._strategies
+
+    def test_large_integers_fall_back(self):
+        for name in available_backends():
+            set_json_backend(name)
+            assert json.loads(safe_serialize({"n": 2**70})) == {"n": 2**70}
+
+    def test_custom_backend(self):
+        class Recording(JsonBackend):
+            name = "recording"
+
+            def __init__(self):
+                self.objects = []
+
+            def dumps(self, obj):
+                self.objects.append(obj)
+                return StdlibBackend().dumps(obj)
+
+        backend = Recording()
+        set_json_backend(backend)
+        safe_serialize({"a": 1})
+        assert backend.objects == [{"a": 1}]
+
+    def test_unknown_backend(self):
+        with pytest.raises(ValueError):
+            set_json_backend("not-a-json-library")
+
+    def test_sanitize(self):
+        session_id = uuid4()
+        payload = {
+            "session": {
+                "session_id": session_id,
+                "tags": ["a", 1, None, session_id, Opaque()],
+                "host_env": {"packages": {"requests": "2.31.0"}, "cpu": (1, 2.5)},
+                "pair": (1, Opaque()),
+                "config": Opaque(),
+                "nested": [[{"deep": [session_id]}]],
+            }
+        }
+
+        assert filter_unjsonable(payload) == {
+            "session": {
+                "session_id": str(session_id),
+                "tags": ["a", 1, None, str(session_id), ""],
+                "host_env": {"packages": {"requests": "2.31.0"}, "cpu": (1, 2.5)},
+                "pair": "",
+                "config": "",
+                "nested": [[{"deep": [str(session_id)]}]],
+            }
+        }
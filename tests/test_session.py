@@ -1,15 +1,28 @@
+import base64
 import pytest
 import requests_mock
+import threading
 import time
+import json
+from unittest.mock import ANY
 import agentops
 from agentops import ActionEvent, Client
+from agentops.async_http_client import AsyncHttpBackend, AsyncHttpClient
 from agentops.exceptions import NoSessionException, MultiSessionException
 from agentops.helpers import clear_singletons
+from agentops.http_client import HttpClient
+from agentops import session as session_module
+
+
+def make_jwt(expires_in):
+    claims = json.dumps({"exp": time.time() + expires_in}).encode()
+    return "header." + base64.urlsafe_b64encode(claims).decode().rstrip("=") + ".sig"
 
 
 @pytest.fixture(autouse=True)
 def setup_teardown():
     clear_singletons()
+    HttpClient.configure_retry()  # close circuits opened by earlier tests
     yield
     agentops.end_all_sessions()  # teardown part
 
@@ -39,7 +52,8 @@ class TestSingleSessions:
         )
 
     def test_session(self, mock_req):
-        agentops.start_session(config=self.config)
+        session = agentops.start_session(config=self.config)
+        assert session.wait_ready(1)
 
         agentops.record(ActionEvent(self.event_type))
         agentops.record(ActionEvent(self.event_type))
@@ -63,10 +77,200 @@ class TestSingleSessions:
         assert mock_req.last_request.headers["Authorization"] == f"Bearer some_jwt"
         request_json = mock_req.last_request.json()
         assert request_json["session"]["end_state"] == end_state
-        assert request_json["session"]["tags"] == None
+        assert "tags" not in request_json["session"]
 
         agentops.end_all_sessions()
 
+    def test_record_does_not_wait_for_upload(self, mock_req):
+        upload_started = threading.Event()
+        release_upload = threading.Event()
+
+        def slow_create_events(request, context):
+            upload_started.set()
+            release_upload.wait(5)
+            return "ok"
+
+        mock_req.post(
+            "https://api.agentops.ai/v2/create_events", text=slow_create_events
+        )
+        session = agentops.start_session(config=self.config)
+        session.record(ActionEvent(self.event_type))
+
+        # The background flush is now stuck in the upload
+        assert upload_started.wait(1)
+
+        start = time.monotonic()
+        session.record(ActionEvent(self.event_type))
+        assert time.monotonic() - start < 0.5
+
+        release_upload.set()
+        session.end_session("Success")
+
+    def test_full_queue_flushes_immediately(self, mock_req):
+        config = agentops.ClientConfiguration(
+            api_key=self.api_key, max_wait_time=60000, max_queue_size=2
+        )
+        session = agentops.start_session(config=config)
+        assert session.wait_ready(1)
+
+        session.record(ActionEvent(self.event_type))
+        time.sleep(0.1)
+        assert len(mock_req.request_history) == 1
+
+        session.record(ActionEvent(self.event_type))
+        time.sleep(0.1)
+        assert len(mock_req.request_history) == 2
+        assert len(mock_req.last_request.json()["events"]) == 2
+
+        session.end_session("Success")
+
+    def test_explicit_flush(self, mock_req):
+        config = agentops.ClientConfiguration(api_key=self.api_key, max_wait_time=60000)
+        session = agentops.start_session(config=config)
+        session.record(ActionEvent(self.event_type))
+
+        assert session.flush(timeout=1)
+        assert len(mock_req.request_history) == 2
+        assert (
+            mock_req.last_request.json()["events"][0]["event_type"] == self.event_type
+        )
+
+        session.end_session("Success")
+
+    def test_record_snapshots_event(self, mock_req):
+        config = agentops.ClientConfiguration(api_key=self.api_key, max_wait_time=60000)
+        session = agentops.start_session(config=config)
+        event = ActionEvent(self.event_type, action_type="original")
+        session.record(event)
+        event.action_type = "changed_after_record"
+
+        assert session.flush(timeout=1)
+        assert mock_req.last_request.json()["events"][0]["action_type"] == "original"
+
+        session.end_session("Success")
+
+    def test_record_snapshots_nested_fields(self, mock_req):
+        config = agentops.ClientConfiguration(api_key=self.api_key, max_wait_time=60000)
+        session = agentops.start_session(config=config)
+        params = {"options": {"temperature": 0}, "tools": ["search"]}
+        session.record(ActionEvent(self.event_type, params=params))
+        params["options"]["temperature"] = 1
+        params["options"]["added_after_record"] = True
+        params["tools"].append("added_after_record")
+
+        assert session.flush(timeout=1)
+        assert mock_req.last_request.json()["events"][0]["params"] == {
+            "options": {"temperature": 0},
+            "tools": ["search"],
+        }
+
+        session.end_session("Success")
+
+    def test_flush_splits_by_size(self, mock_req):
+        config = agentops.ClientConfiguration(
+            api_key=self.api_key,
+            max_wait_time=60000,
+            max_batch_bytes=1000,
+            compression=None,
+        )
+        session = agentops.start_session(config=config)
+        for _ in range(4):
+            session.record(ActionEvent(self.event_type, params={"data": "x" * 300}))
+
+        assert session.flush(timeout=1)
+        uploads = [r for r in mock_req.request_history if r.path == "/v2/create_events"]
+        assert len(uploads) > 1
+        assert all(len(r.body) <= 1000 for r in uploads)
+        assert sum(len(r.json()["events"]) for r in uploads) == 4
+
+        session.end_session("Success")
+
+    def test_payload_too_large_isolates_event(self, mock_req):
+        def create_events(request, context):
+            if len(request.body) > 2000:
+                context.status_code = 413
+                return {"error": "too large"}
+            return {"status": "ok"}
+
+        mock_req.post("https://api.agentops.ai/v2/create_events", json=create_events)
+        config = agentops.ClientConfiguration(
+            api_key=self.api_key, max_wait_time=60000, compression=None
+        )
+        session = agentops.start_session(config=config)
+        session.record(ActionEvent("small_1"))
+        session.record(ActionEvent("huge", params={"data": "x" * 5000}))
+        session.record(ActionEvent("small_2"))
+        session.record(ActionEvent("small_3"))
+
+        assert session.flush(timeout=1)
+        delivered = [
+            event["event_type"]
+            for r in mock_req.request_history
+            if r.path == "/v2/create_events" and len(r.body) <= 2000
+            for event in r.json()["events"]
+        ]
+        assert delivered == ["small_1", "small_2", "small_3"]
+
+        session.end_session("Success")
+
+    def test_events_stay_buffered_while_circuit_open(self, mock_req):
+        session = agentops.start_session(config=self.config)
+        HttpClient._breaker("https://api.agentops.ai/v2/create_events").hold(0.3)
+        session.record(ActionEvent(self.event_type))
+
+        time.sleep(0.15)
+        assert len(mock_req.request_history) == 1
+        assert len(session._buffer) == 1
+
+        time.sleep(0.4)
+        assert mock_req.last_request.path == "/v2/create_events"
+        assert len(session._buffer) == 0
+
+        session.end_session("Success")
+
+    def test_end_session_sends_events_while_circuit_open(self, mock_req):
+        mock_req.post(
+            "https://api.agentops.ai/v2/create_events",
+            [{"status_code": 500}, {"json": {"status": "ok"}}],
+        )
+        session = agentops.start_session(config=self.config)
+        assert session.wait_ready(1)
+        session.record(ActionEvent(self.event_type))
+        assert session.flush(timeout=1)
+        # One failed upload doesn't open the circuit for every session
+        assert HttpClient.is_available("https://api.agentops.ai/v2/create_events")
+
+        HttpClient._breaker("https://api.agentops.ai/v2/create_events").hold(30)
+        session.record(ActionEvent(self.event_type))
+        session.record(ActionEvent(self.event_type))
+        session.end_session("Success")
+
+        assert len(session._buffer) == 0
+        uploads = [
+            r.json() for r in mock_req.request_history if r.path == "/v2/create_events"
+        ]
+        assert len(uploads) == 2
+        assert len(uploads[-1]["events"]) == 2
+
+    def test_unencodable_event_does_not_lose_batch(self, mock_req):
+        class Broken:
+            def to_json(self):
+                raise KeyError("missing")
+
+        session = agentops.start_session(config=self.config)
+        session.record(ActionEvent(self.event_type))
+        session.record(ActionEvent(self.event_type, params={"broken": Broken()}))
+        session.record(ActionEvent(self.event_type))
+        session.end_session("Success")
+
+        events = [
+            event
+            for r in mock_req.request_history
+            if r.path == "/v2/create_events"
+            for event in r.json()["events"]
+        ]
+        assert len(events) == 2
+
     def test_add_tags(self, mock_req):
         # Arrange
         tags = ["GPT-4"]
@@ -79,7 +283,8 @@ class TestSingleSessions:
         agentops.end_session(end_state)
         time.sleep(0.15)
 
-        # Assert 3 requests, 1 for session init, 1 for event, 1 for end session
+        # Assert 2 requests: session init, end session carrying the pending tags
+        assert len(mock_req.request_history) == 2
         assert mock_req.last_request.headers["X-Agentops-Api-Key"] == self.api_key
         request_json = mock_req.last_request.json()
         assert request_json["session"]["end_state"] == end_state
@@ -103,18 +308,21 @@ class TestSingleSessions:
         # Assert 3 requests, 1 for session init, 1 for event, 1 for end session
         assert len(mock_req.request_history) == 3
         assert mock_req.last_request.headers["X-Agentops-Api-Key"] == self.api_key
+        request_json = mock_req.request_history[0].json()
+        assert request_json["session"]["tags"] == tags
         request_json = mock_req.last_request.json()
         assert request_json["session"]["end_state"] == end_state
-        assert request_json["session"]["tags"] == tags
+        assert "tags" not in request_json["session"]
 
         agentops.end_all_sessions()
 
     def test_inherit_session_id(self, mock_req):
         # Arrange
         inherited_id = "4f72e834-ff26-4802-ba2d-62e7613446f1"
-        agentops.start_session(
+        session = agentops.start_session(
             tags=["test"], config=self.config, inherited_session_id=inherited_id
         )
+        assert session.wait_ready(1)
 
         # Act
         # session_id correct
@@ -131,6 +339,7 @@ class TestSingleSessions:
     def test_add_tags_with_string(self, mock_req):
         agentops.start_session(config=self.config)
         agentops.add_tags("wrong-type-tags")
+        agentops.end_session("Success")
 
         request_json = mock_req.last_request.json()
         assert request_json["session"]["tags"] == ["wrong-type-tags"]
@@ -138,6 +347,7 @@ class TestSingleSessions:
     def test_session_add_tags_with_string(self, mock_req):
         session = agentops.start_session(config=self.config)
         session.add_tags("wrong-type-tags")
+        agentops.end_session("Success")
 
         request_json = mock_req.last_request.json()
         assert request_json["session"]["tags"] == ["wrong-type-tags"]
@@ -145,6 +355,7 @@ class TestSingleSessions:
     def test_set_tags_with_string(self, mock_req):
         agentops.start_session(config=self.config)
         agentops.set_tags("wrong-type-tags")
+        agentops.end_session("Success")
 
         request_json = mock_req.last_request.json()
         assert request_json["session"]["tags"] == ["wrong-type-tags"]
@@ -152,24 +363,380 @@ class TestSingleSessions:
     def test_session_set_tags_with_string(self, mock_req):
         session = agentops.start_session(config=self.config)
         session.set_tags("wrong-type-tags")
+        agentops.end_session("Success")
 
         request_json = mock_req.last_request.json()
         assert request_json["session"]["tags"] == ["wrong-type-tags"]
 
     def test_add_tags_before_session(self, mock_req):
         agentops.add_tags(["pre-session-tag"])
-        agentops.start_session(config=self.config)
+        session = agentops.start_session(config=self.config)
+        assert session.wait_ready(1)
 
         request_json = mock_req.last_request.json()
         assert request_json["session"]["tags"] == ["pre-session-tag"]
 
     def test_set_tags_before_session(self, mock_req):
         agentops.set_tags(["pre-session-tag"])
-        agentops.start_session(config=self.config)
+        session = agentops.start_session(config=self.config)
+        assert session.wait_ready(1)
 
         request_json = mock_req.last_request.json()
         assert request_json["session"]["tags"] == ["pre-session-tag"]
 
+    def test_updates_send_only_changed_fields(self, mock_req):
+        config = agentops.ClientConfiguration(
+            api_key=self.api_key, max_wait_time=60000, tag_update_interval=0
+        )
+        session = agentops.start_session(config=config)
+        assert session.wait_ready(1)
+        assert "host_env" in mock_req.last_request.json()["session"]
+
+        mock_req.post(
+            "https://api.agentops.ai/v2/update_session",
+            [{"status_code": 400}, {"json": {"status": "success"}}],
+        )
+        session.add_tags(["first"])
+        assert session.flush(timeout=1)
+        session.set_video("https://example.com/video.mp4")
+        session.add_tags(["second"])
+        assert session.flush(timeout=1)
+
+        # The video and the failed first update are sent with the next one
+        assert mock_req.last_request.json()["session"] == {
+            "session_id": str(session.session_id),
+            "tags": ["first", "second"],
+            "video": "https://example.com/video.mp4",
+        }
+
+        request_count = len(mock_req.request_history)
+        session.add_tags(["second"])
+        assert session.flush(timeout=1)
+        assert len(mock_req.request_history) == request_count
+
+    def test_tag_updates_are_debounced(self, mock_req):
+        config = agentops.ClientConfiguration(
+            api_key=self.api_key, max_wait_time=60000, tag_update_interval=100
+        )
+        session = agentops.start_session(config=config)
+        assert session.wait_ready(1)
+        for i in range(20):
+            session.add_tags([f"tag-{i}", "shared"])
+        session.set_tags(["replaced"])
+        session.add_tags(["tag-20"])
+        assert len(mock_req.request_history) == 1
+
+        time.sleep(0.3)
+        assert len(mock_req.request_history) == 2
+        assert mock_req.last_request.json()["session"]["tags"] == [
+            "replaced",
+            "tag-20",
+        ]
+
+        session.end_session("Success")
+        assert "tags" not in mock_req.last_request.json()["session"]
+
+    def test_host_env_sent_once_per_fingerprint(self, mock_req):
+        create_session_url = "https://api.agentops.ai/v2/create_session"
+        mock_req.post(
+            create_session_url,
+            [
+                {"json": {"jwt": "some_jwt", "host_env_fingerprints": True}},
+                {"json": {"jwt": "some_jwt"}},
+                {"json": {"jwt": "some_jwt", "host_env_required": True}},
+            ],
+        )
+
+        # The server's support is only known after the first session
+        session_1 = agentops.start_session(config=self.config)
+        assert session_1.wait_ready(1)
+        first = mock_req.last_request.json()["session"]
+        assert "Installed Packages" in first["host_env"]
+        fingerprint = first["host_env_fingerprint"]
+
+        session_2 = agentops.start_session(config=self.config)
+        assert session_2.wait_ready(1)
+        second = mock_req.last_request.json()["session"]
+        assert second["host_env_fingerprint"] == fingerprint
+        assert "Installed Packages" not in second["host_env"]
+        assert list(second["host_env"]["OS"]) == ["Hostname"]
+        assert "RAM" in second["host_env"]
+        assert list(second["host_env"]["SDK"]) == ["System Packages"]
+        assert list(second["host_env"]["CPU"]) == ["CPU Usage"]
+
+        session_3 = agentops.start_session(config=self.config)
+        assert session_3.wait_ready(1)
+        update = mock_req.last_request
+        assert update.path == "/v2/update_session"
+        host_env = update.json()["session"]["host_env"]
+        # Loaded packages and usage figures are read per session
+        assert host_env == {
+            **first["host_env"],
+            "SDK": {**first["host_env"]["SDK"], "System Packages": ANY},
+            "CPU": host_env["CPU"],
+            "RAM": host_env["RAM"],
+            "Disk": host_env["Disk"],
+        }
+
+        for session in (session_1, session_2, session_3):
+            session.end_session("Success")
+        session_module._fingerprinting_endpoints.clear()
+
+    def test_start_session_does_not_wait_for_server(self, mock_req):
+        create_started = threading.Event()
+        release_create = threading.Event()
+
+        def slow_create_session(request, context):
+            create_started.set()
+            release_create.wait(5)
+            return {"status": "success", "jwt": "some_jwt"}
+
+        mock_req.post(
+            "https://api.agentops.ai/v2/create_session", json=slow_create_session
+        )
+        start = time.monotonic()
+        session = agentops.start_session(config=self.config)
+        session.record(ActionEvent(self.event_type))
+        assert time.monotonic() - start < 0.5
+
+        assert create_started.wait(1)
+        assert not session.wait_ready(0.05)
+        time.sleep(0.1)
+        # The event waits for the JWT
+        assert [r.path for r in mock_req.request_history] == ["/v2/create_session"]
+
+        release_create.set()
+        assert session.wait_ready(1)
+        time.sleep(0.15)
+        assert mock_req.last_request.path == "/v2/create_events"
+        assert mock_req.last_request.headers["Authorization"] == "Bearer some_jwt"
+
+        session.end_session("Success")
+
+    def test_event_recorded_while_session_starts_is_sent(self, mock_req):
+        release_create = threading.Event()
+
+        def slow_create_session(request, context):
+            release_create.wait(5)
+            return {"status": "success", "jwt": "some_jwt"}
+
+        mock_req.post(
+            "https://api.agentops.ai/v2/create_session", json=slow_create_session
+        )
+        session = agentops.start_session(config=self.config)
+        buffer_put = session._buffer.put
+
+        def put_after_start(event):
+            # The exporter finishes the start and finds nothing buffered yet
+            release_create.set()
+            assert session._ready.wait(1)
+            time.sleep(0.05)
+            return buffer_put(event)
+
+        session._buffer.put = put_after_start
+        session.record(ActionEvent(self.event_type))
+        time.sleep(0.2)
+        assert mock_req.last_request.path == "/v2/create_events"
+
+        session.end_session("Success")
+
+    def test_session_starts_while_exporter_is_busy(self, mock_req, monkeypatch):
+        # The exporter workers are all busy elsewhere and never get to this session
+        monkeypatch.setattr(session_module.exporter, "schedule", lambda *args: None)
+        session = agentops.start_session(config=self.config)
+        assert session.wait_ready(1)
+
+        session.end_session("Success")
+
+    def test_end_session_starts_session_itself(self, mock_req, monkeypatch):
+        # The starter workers are all busy elsewhere and never get to this session
+        monkeypatch.setattr(session_module.starter, "start", lambda *args: None)
+        session = agentops.start_session(config=self.config)
+        assert not session.wait_ready(0.1)
+
+        assert session.end_session("Success") == 5
+        assert session.wait_ready(0)
+
+    def test_uploads_uncompressed_unless_server_decodes_codec(self, mock_req):
+        def gzip_unaware(request, context):
+            if "Content-Encoding" in request.headers:
+                context.status_code = 422
+                return {"detail": [{"type": "json_invalid"}]}
+            return {"status": "ok"}
+
+        mock_req.post("https://api.agentops.ai/v2/create_events", json=gzip_unaware)
+        session = agentops.start_session(config=self.config)
+        session.record(ActionEvent(self.event_type, params={"prompt": "x" * 2048}))
+        assert session.flush(1)
+
+        assert "Content-Encoding" not in mock_req.last_request.headers
+        assert mock_req.last_request.json()["events"][0]["params"]["prompt"]
+        session.end_session("Success")
+
+    def test_uploads_compressed_when_server_decodes_codec(self, mock_req):
+        mock_req.post(
+            "https://api.agentops.ai/v2/create_session",
+            json={
+                "status": "success",
+                "jwt": "some_jwt",
+                "request_encodings": ["gzip"],
+            },
+        )
+        session = agentops.start_session(config=self.config)
+        session.record(ActionEvent(self.event_type, params={"prompt": "x" * 2048}))
+        assert session.flush(1)
+
+        assert mock_req.last_request.headers["Content-Encoding"] == "gzip"
+        session.end_session("Success")
+
+    def test_rejected_session_is_not_ready(self, mock_req):
+        mock_req.post("https://api.agentops.ai/v2/create_session", status_code=401)
+        session = agentops.start_session(config=self.config)
+        assert session.wait_ready(1) is False
+
+    def test_unauthorized_batch_replayed_with_new_jwt(self, mock_req):
+        url = "https://api.agentops.ai"
+        mock_req.post(
+            url + "/v2/create_events",
+            [{"status_code": 401}, {"json": {"status": "ok"}}],
+        )
+        mock_req.post(url + "/v2/reauthorize_jwt", json={"jwt": "new_jwt"})
+        config = agentops.ClientConfiguration(api_key=self.api_key, max_wait_time=60000)
+        session = agentops.start_session(config=config)
+        session.record(ActionEvent(self.event_type))
+
+        assert session.flush(timeout=1)
+        requests = [
+            (r.path, r.headers.get("Authorization")) for r in mock_req.request_history
+        ]
+        assert requests[1:] == [
+            ("/v2/create_events", "Bearer some_jwt"),
+            ("/v2/reauthorize_jwt", None),
+            ("/v2/create_events", "Bearer new_jwt"),
+        ]
+        assert (
+            mock_req.last_request.json()["events"][0]["event_type"] == self.event_type
+        )
+
+        session.end_session("Success")
+
+    def test_jwt_refreshed_before_it_expires(self, mock_req):
+        url = "https://api.agentops.ai"
+        mock_req.post(url + "/v2/create_session", json={"jwt": make_jwt(0.5)})
+        mock_req.post(url + "/v2/reauthorize_jwt", json={"jwt": make_jwt(3600)})
+        session = agentops.start_session(config=self.config)
+        assert session.wait_ready(1)
+        expiring_jwt = session.jwt
+
+        time.sleep(0.7)
+        assert mock_req.last_request.path == "/v2/reauthorize_jwt"
+        assert session.jwt != expiring_jwt
+
+        # The next refresh is due in about an hour
+        request_count = len(mock_req.request_history)
+        time.sleep(0.2)
+        assert len(mock_req.request_history) == request_count
+
+        session.end_session("Success")
+
+    def test_agents_registered_in_one_batch_before_events(self, mock_req):
+        mock_req.post("https://api.agentops.ai/v2/create_agents", json={"status": "ok"})
+        config = agentops.ClientConfiguration(api_key=self.api_key, max_wait_time=60000)
+        session = agentops.start_session(config=config)
+        agent_ids = [session.create_agent(f"agent-{i}", None) for i in range(5)]
+        session.record(ActionEvent(self.event_type, agent_id=agent_ids[0]))
+
+        assert session.flush(timeout=1)
+        paths = [r.path for r in mock_req.request_history]
+        assert paths == ["/v2/create_session", "/v2/create_agents", "/v2/create_events"]
+        assert [
+            agent["id"] for agent in mock_req.request_history[1].json()["agents"]
+        ] == agent_ids
+
+        session.end_session("Success")
+
+    def test_agent_created_during_flush_registered_before_its_event(self, mock_req):
+        mock_req.post("https://api.agentops.ai/v2/create_agents", json={"status": "ok"})
+        config = agentops.ClientConfiguration(api_key=self.api_key, max_wait_time=60000)
+        session = agentops.start_session(config=config)
+        assert session.wait_ready(1)
+        drain = session._buffer.drain
+
+        def create_agent_then_drain():
+            # Created and used while the flush is under way
+            agent_id = session.create_agent("late", None)
+            session.record(ActionEvent(self.event_type, agent_id=agent_id))
+            session._buffer.drain = drain
+            return drain()
+
+        session._buffer.drain = create_agent_then_drain
+        assert session.flush(timeout=1)
+
+        paths = [r.path for r in mock_req.request_history]
+        assert paths == ["/v2/create_session", "/v2/create_agents", "/v2/create_events"]
+        session.end_session("Success")
+
+    def test_agent_registration_replayed_with_new_jwt(self, mock_req):
+        mock_req.post(
+            "https://api.agentops.ai/v2/create_agents",
+            [{"status_code": 401}, {"json": {"status": "ok"}}],
+        )
+        mock_req.post(
+            "https://api.agentops.ai/v2/reauthorize_jwt",
+            json={"status": "success", "jwt": "new_jwt"},
+        )
+        session = agentops.start_session(config=self.config)
+        session.create_agent("agent", "agent-1")
+        assert session.flush(timeout=1)
+
+        registrations = [
+            r for r in mock_req.request_history if r.path == "/v2/create_agents"
+        ]
+        assert len(registrations) == 2
+        assert registrations[-1].headers["Authorization"] == "Bearer new_jwt"
+        session.end_session("Success")
+
+    def test_failed_agent_registration_is_sent_again(self, mock_req):
+        mock_req.post(
+            "https://api.agentops.ai/v2/create_agents",
+            [{"status_code": 500}, {"json": {"status": "ok"}}],
+        )
+        session = agentops.start_session(config=self.config)
+        session.create_agent("first", "agent-1")
+        assert session.flush(timeout=1)
+        session.create_agent("second", "agent-2")
+        assert session.flush(timeout=1)
+
+        registrations = [
+            r.json()["agents"]
+            for r in mock_req.request_history
+            if r.path == "/v2/create_agents"
+        ]
+        assert [[agent["id"] for agent in agents] for agents in registrations] == [
+            ["agent-1"],
+            ["agent-1", "agent-2"],
+        ]
+        session.end_session("Success")
+
+    def test_agents_registered_one_by_one_without_batch_endpoint(self, mock_req):
+        mock_req.post("https://api.agentops.ai/v2/create_agents", status_code=404)
+        mock_req.post("https://api.agentops.ai/v2/create_agent", json={"status": "ok"})
+        session = agentops.start_session(config=self.config)
+        session.create_agent("first", "agent-1")
+        session.create_agent("second", "agent-2")
+        session.end_session("Success")
+
+        paths = [r.path for r in mock_req.request_history]
+        assert paths == [
+            "/v2/create_session",
+            "/v2/create_agents",
+            "/v2/create_agent",
+            "/v2/create_agent",
+            "/v2/update_session",
+        ]
+        assert mock_req.request_history[3].json() == {"id": "agent-2", "name": "second"}
+        session_module._agent_batches_unsupported.clear()
+
     def test_no_config_doesnt_start_session(self, mock_req):
         session = agentops.start_session()
         assert session is None
@@ -202,6 +769,7 @@ class TestMultiSessions:
     def test_two_sessions(self, mock_req):
         session_1 = agentops.start_session(config=self.config)
         session_2 = agentops.start_session(config=self.config)
+        assert session_1.wait_ready(1) and session_2.wait_ready(1)
 
         assert len(agentops.Client().current_session_ids) == 2
         assert agentops.Client().current_session_ids == [
@@ -233,7 +801,7 @@ class TestMultiSessions:
         assert mock_req.last_request.headers["Authorization"] == f"Bearer some_jwt"
         request_json = mock_req.last_request.json()
         assert request_json["session"]["end_state"] == end_state
-        assert request_json["session"]["tags"] is None
+        assert "tags" not in request_json["session"]
 
         session_2.end_session(end_state)
         # We should have 6 requests (2 additional end sessions)
@@ -241,7 +809,84 @@ class TestMultiSessions:
         assert mock_req.last_request.headers["Authorization"] == f"Bearer some_jwt"
         request_json = mock_req.last_request.json()
         assert request_json["session"]["end_state"] == end_state
-        assert request_json["session"]["tags"] is None
+        assert "tags" not in request_json["session"]
+
+    def test_sessions_share_exporter_threads(self, mock_req):
+        agentops.start_session(config=self.config)
+        thread_count = threading.active_count()
+
+        sessions = [agentops.start_session(config=self.config) for _ in range(20)]
+        # Only the starter's bounded pool may have grown, however many sessions start
+        assert threading.active_count() <= thread_count + session_module.starter.workers
+
+        for session in sessions:
+            session.record(ActionEvent(self.event_type))
+        time.sleep(0.15)
+
+        # Every session still flushed its own events
+        event_requests = [
+            r for r in mock_req.request_history if r.path == "/v2/create_events"
+        ]
+        assert len(event_requests) == 20
+
+        agentops.end_all_sessions()
+
+    def test_coalesced_uploads(self, mock_req):
+        url = "https://api.agentops.ai"
+        mock_req.post(
+            url + "/v2/create_session",
+            json={"status": "success", "jwt": "some_jwt", "multi_session_events": True},
+        )
+        mock_req.post(url + "/v2/create_events_batch", json={"status": "ok"})
+        config = agentops.ClientConfiguration(
+            api_key=self.api_key,
+            max_wait_time=100,
+            coalesce_uploads=True,
+            compression=None,
+        )
+        sessions = [agentops.start_session(config=config) for _ in range(5)]
+        for session in sessions:
+            session.record(ActionEvent(self.event_type))
+        time.sleep(0.3)
+
+        paths = [r.path for r in mock_req.request_history]
+        assert paths.count("/v2/create_events_batch") == 1
+        assert "/v2/create_events" not in paths
+
+        groups = mock_req.last_request.json()["sessions"]
+        assert sorted(group["session_id"] for group in groups) == sorted(
+            str(session.session_id) for session in sessions
+        )
+        assert all(group["jwt"] == "some_jwt" for group in groups)
+        assert all(len(group["events"]) == 1 for group in groups)
+
+        agentops.end_all_sessions()
+
+    def test_coalescing_falls_back_per_session(self, mock_req):
+        url = "https://api.agentops.ai"
+        mock_req.post(
+            url + "/v2/create_session",
+            json={"status": "success", "jwt": "some_jwt", "multi_session_events": True},
+        )
+        mock_req.post(url + "/v2/create_events_batch", status_code=404)
+        config = agentops.ClientConfiguration(
+            api_key=self.api_key, max_wait_time=100, coalesce_uploads=True
+        )
+        sessions = [agentops.start_session(config=config) for _ in range(3)]
+        for session in sessions:
+            session.record(ActionEvent(self.event_type))
+        time.sleep(0.3)
+
+        for session in sessions:
+            session.record(ActionEvent(self.event_type))
+        time.sleep(0.3)
+
+        paths = [r.path for r in mock_req.request_history]
+        assert paths.count("/v2/create_events_batch") == 1
+        assert paths.count("/v2/create_events") == 6
+
+        agentops.end_all_sessions()
+        session_module._coalesced_unsupported.clear()
 
     def test_add_tags(self, mock_req):
         # Arrange
@@ -250,6 +895,7 @@ class TestMultiSessions:
 
         session_1 = agentops.start_session(tags=session_1_tags, config=self.config)
         session_2 = agentops.start_session(tags=session_2_tags, config=self.config)
+        assert session_1.wait_ready(1) and session_2.wait_ready(1)
 
         session_1.add_tags(["session-1-added", "session-1-added-2"])
         session_2.add_tags(["session-2-added"])
@@ -260,17 +906,13 @@ class TestMultiSessions:
         session_2.end_session(end_state)
         time.sleep(0.15)
 
-        # Assert 3 requests, 1 for session init, 1 for event, 1 for end session
-        req1 = mock_req.request_history[-1].json()
-        req2 = mock_req.request_history[-2].json()
-
-        session_1_req = (
-            req1 if req1["session"]["session_id"] == session_1.session_id else req2
-        )
-        session_2_req = (
-            req2 if req2["session"]["session_id"] == session_2.session_id else req1
-        )
+        # Assert 4 requests: 2 session inits, 2 end sessions carrying the pending tags
+        assert len(mock_req.request_history) == 4
+        session_1_req = mock_req.request_history[2].json()
+        session_2_req = mock_req.request_history[3].json()
 
+        assert session_1_req["session"]["session_id"] == str(session_1.session_id)
+        assert session_2_req["session"]["session_id"] == str(session_2.session_id)
         assert session_1_req["session"]["end_state"] == end_state
         assert session_2_req["session"]["end_state"] == end_state
 
@@ -284,3 +926,108 @@ class TestMultiSessions:
             "session-2",
             "session-2-added",
         ]
+
+
+class RecordingBackend(AsyncHttpBackend):
+    def __init__(self):
+        self.requests = []
+
+    async def post(self, url, data, headers, timeout):
+        self.requests.append((url, json.loads(data), headers))
+        if url.endswith("/v2/update_session"):
+            return 200, b'{"status": "success", "token_cost": 5}', {}
+        return 200, b"ok", {}
+
+
+class TestAsyncSession:
+    def setup_method(self):
+        self.api_key = "random_api_key"
+        self.event_type = "test_event_type"
+        self.config = agentops.ClientConfiguration(
+            api_key=self.api_key, max_wait_time=60000
+        )
+        self.backend = RecordingBackend()
+        self.original_backend = AsyncHttpClient.backend
+        AsyncHttpClient.set_backend(self.backend)
+
+    def teardown_method(self):
+        AsyncHttpClient.set_backend(self.original_backend)
+
+    @pytest.mark.asyncio
+    async def test_aflush_and_aend_session(self, mock_req):
+        session = agentops.start_session(config=self.config)
+        session.record(ActionEvent(self.event_type))
+
+        await session.aflush()
+        url, body, headers = self.backend.requests[-1]
+        assert url.endswith("/v2/create_events")
+        assert body["events"][0]["event_type"] == self.event_type
+        assert headers["Authorization"] == "Bearer some_jwt"
+
+        session.add_tags(["async-tag"])
+        session.set_video("https://example.com/video.mp4")
+        await session.aupdate()
+        url, body, _ = self.backend.requests[-1]
+        assert url.endswith("/v2/update_session")
+        assert body["session"]["tags"] == ["async-tag"]
+        assert body["session"]["video"] == "https://example.com/video.mp4"
+
+        assert await session.aend_session("Success") == 5
+        url, body, _ = self.backend.requests[-1]
+        assert body["session"]["end_state"] == "Success"
+
+        # Only session creation went through the blocking client
+        assert len(mock_req.request_history) == 1
+
+    @pytest.mark.asyncio
+    async def test_aflush_drains_and_compresses_off_the_loop(
+        self, mock_req, monkeypatch
+    ):
+        mock_req.post(
+            "https://api.agentops.ai/v2/create_session",
+            json={
+                "status": "success",
+                "jwt": "some_jwt",
+                "request_encodings": ["gzip"],
+            },
+        )
+        session = agentops.start_session(config=self.config)
+        assert session.wait_ready(1)
+        session.record(ActionEvent(self.event_type, params={"prompt": "x" * 2048}))
+
+        threads = {}
+        drain_batches = session._drain_batches
+        compress = HttpClient._compress
+
+        def record_drain(final):
+            threads["drain"] = threading.current_thread()
+            return drain_batches(final)
+
+        def record_compress(url, payload, codec, threshold):
+            threads["compress"] = threading.current_thread()
+            # Sent as-is, so the recording backend can read it
+            return payload, None
+
+        monkeypatch.setattr(session, "_drain_batches", record_drain)
+        monkeypatch.setattr(HttpClient, "_compress", record_compress)
+        await session.aflush()
+
+        assert threads["drain"] is not threading.current_thread()
+        assert threads["compress"] is not threading.current_thread()
+        url, body, _ = self.backend.requests[-1]
+        assert body["events"][0]["params"]["prompt"]
+
+    @pytest.mark.asyncio
+    async def test_aflush_refreshes_due_jwt(self, mock_req):
+        mock_req.post(
+            "https://api.agentops.ai/v2/reauthorize_jwt", json={"jwt": "new_jwt"}
+        )
+        session = agentops.start_session(config=self.config)
+        assert session.wait_ready(1)
+        session.record(ActionEvent(self.event_type))
+        session._jwt_refresh_at = time.monotonic()
+
+        await session.aflush()
+        assert mock_req.last_request.path == "/v2/reauthorize_jwt"
+        _, _, headers = self.backend.requests[-1]
+        assert headers["Authorization"] == "Bearer new_jwt"
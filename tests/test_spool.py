@@ -0,0 +1,330 @@
+import json
+import os
+import time
+import pytest
+import requests_mock
+import agentops
+from agentops import ActionEvent
+from agentops.helpers import clear_singletons
+from agentops.http_client import HttpClient
+from agentops.retry import RetryPolicy
+from agentops import spool as spool_module
+from agentops.spool import (
+    SEGMENT_SUFFIX,
+    Spool,
+    SpoolRecord,
+    default_spool_dir,
+    recover_spills,
+    send_record,
+)
+
+# Files can only be given to another user by root
+as_root = pytest.mark.skipif(
+    getattr(os, "getuid", lambda: -1)() != 0, reason="requires root"
+)
+OTHER_UID = 65534
+
+
+@pytest.fixture(autouse=True)
+def setup_teardown():
+    clear_singletons()
+    # Failed uploads go straight to the spool instead of being retried in place
+    HttpClient.configure_retry(RetryPolicy(max_attempts=1))
+    yield
+    agentops.end_all_sessions()  # teardown part
+    HttpClient.configure_retry(RetryPolicy())
+
+
+def make_record(i: int, size: int = 10) -> SpoolRecord:
+    return SpoolRecord(
+        url="https://api.agentops.ai/v2/create_events",
+        payload=str(i).encode("utf-8") * size,
+        jwt="some_jwt",
+    )
+
+
+class TestSpool:
+    def test_replay_in_order(self, tmp_path):
+        spool = Spool(str(tmp_path))
+        for i in range(3):
+            assert spool.append(make_record(i))
+
+        sent = []
+        assert spool.replay(lambda record: sent.append(record) or True) == 3
+        assert [record.payload for record in sent] == [
+            make_record(i).payload for i in range(3)
+        ]
+        assert sent[0].jwt == "some_jwt"
+        assert not spool.has_pending()
+
+    def test_failed_replay_keeps_records(self, tmp_path):
+        spool = Spool(str(tmp_path))
+        for i in range(3):
+            spool.append(make_record(i))
+
+        attempts = []
+
+        def flaky(record):
+            attempts.append(record)
+            return len(attempts) == 1
+
+        assert spool.replay(flaky) == 1
+        assert spool.has_pending()
+
+        sent = []
+        assert spool.replay(lambda record: sent.append(record) or True) == 2
+        assert [record.payload for record in sent] == [
+            make_record(i).payload for i in (1, 2)
+        ]
+
+    def test_ignores_torn_write(self, tmp_path):
+        spool = Spool(str(tmp_path))
+        spool.append(make_record(0))
+        spool.append(make_record(1))
+        with open(spool._active_path, "ab") as segment:
+            segment.write(b"\x00\x00\x00\x10partial")
+
+        sent = []
+        assert spool.replay(lambda record: sent.append(record) or True) == 2
+
+    def test_evicts_oldest_segments(self, tmp_path):
+        spool = Spool(str(tmp_path), max_size=2000, segment_size=500)
+        for i in range(20):
+            spool.append(make_record(i % 10, size=100))
+
+        assert spool.size() <= 2000
+        sent = []
+        spool.replay(lambda record: sent.append(record) or True)
+        assert 0 < len(sent) < 20
+        assert sent[-1].payload == make_record(9, size=100).payload
+
+    def test_replays_previous_process_segments(self, tmp_path):
+        Spool(str(tmp_path)).append(make_record(0))
+        os.rename(
+            next(tmp_path.glob("*" + SEGMENT_SUFFIX)),
+            tmp_path / ("0" * 20 + "-999999" + SEGMENT_SUFFIX),
+        )
+
+        # Another live process' segment is left alone until it goes stale
+        assert Spool(str(tmp_path)).replay(lambda record: True) == 0
+        assert Spool(str(tmp_path), stale_after=0).replay(lambda record: True) == 1
+
+    def test_failing_record_does_not_block_others(self, tmp_path):
+        spool = Spool(str(tmp_path), max_record_attempts=2)
+        poison = make_record(0).payload
+
+        def send(record):
+            return record.payload != poison
+
+        for i in range(3):
+            spool.append(make_record(i))
+        assert spool.replay(send) == 2
+        assert spool.has_pending()
+
+        # Failing on its own doesn't count against it; the endpoint may be down
+        assert spool.replay(send) == 0
+        assert spool.has_pending()
+
+        spool.append(make_record(3))
+        assert spool.replay(send) == 1
+        assert not spool.has_pending()
+
+    def test_expired_jwt_is_refreshed_on_replay(self, tmp_path):
+        url = "https://api.agentops.ai/v2"
+        spool = Spool(str(tmp_path))
+        spool.append(
+            SpoolRecord(
+                url=url + "/create_events",
+                payload=b"expired",
+                jwt="expired_jwt",
+                session_id="some_session",
+                api_key="some_api_key",
+            )
+        )
+        spool.append(
+            SpoolRecord(
+                url=url + "/create_events",
+                payload=b"valid",
+                jwt="valid_jwt",
+                session_id="other_session",
+                api_key="some_api_key",
+            )
+        )
+
+        def create_events(request, context):
+            if request.headers["Authorization"] == "Bearer expired_jwt":
+                context.status_code = 401
+            return {"status": "ok"}
+
+        spool_module._replay_jwts.clear()
+        with requests_mock.Mocker() as m:
+            m.post(url + "/create_events", json=create_events)
+            m.post(url + "/reauthorize_jwt", json={"jwt": "new_jwt"})
+
+            assert spool.replay(send_record) == 2
+            reauthorize = [
+                r for r in m.request_history if r.path == "/v2/reauthorize_jwt"
+            ]
+
+        assert not spool.has_pending()
+        assert reauthorize[0].json() == {"session_id": "some_session"}
+        assert reauthorize[0].headers["X-Agentops-Api-Key"] == "some_api_key"
+        assert m.last_request.headers["Authorization"] == "Bearer valid_jwt"
+
+    def test_unauthorized_record_is_discarded(self, tmp_path):
+        spool = Spool(str(tmp_path))
+        spool.append(make_record(0))
+        spool.append(make_record(1))
+
+        with requests_mock.Mocker() as m:
+            m.post(make_record(0).url, status_code=401)
+            # Without a session id and API key there is no way to authorize it again
+            assert spool.replay(send_record) == 0
+
+        assert not spool.has_pending()
+
+    def test_recovers_orphaned_spills(self, tmp_path):
+        orphan = tmp_path / "some_session.spill"
+        orphan.write_bytes(b'{"id": 0}\n{"id": 1}\n{"id": 2}\n{"id"')
+        live = tmp_path / "live_session.spill"
+        live.write_bytes(b'{"id": 3}\n')
+        old = time.time() - 120
+        os.utime(orphan, (old, old))
+
+        spool = Spool(str(tmp_path))
+        assert spool.size() == orphan.stat().st_size + live.stat().st_size
+        recover_spills(
+            str(tmp_path),
+            "https://api.agentops.ai/v2/create_events",
+            "some_api_key",
+            max_batch_bytes=40,
+            spool=spool,
+        )
+
+        sent = []
+        assert spool.replay(lambda record: sent.append(record) or True) == 2
+        assert [json.loads(record.payload) for record in sent] == [
+            {"events": [{"id": 0}, {"id": 1}]},
+            {"events": [{"id": 2}]},
+        ]
+        assert sent[0].session_id == "some_session"
+        assert sent[0].api_key == "some_api_key"
+        assert not orphan.exists()
+        # Recently written to, so possibly still in use
+        assert live.exists()
+
+    @as_root
+    def test_spills_of_other_users_are_left_alone(self, tmp_path):
+        planted = tmp_path / "some_session.spill"
+        planted.write_bytes(b'{"id": 0}\n')
+        os.chown(planted, OTHER_UID, OTHER_UID)
+        old = time.time() - 120
+        os.utime(planted, (old, old))
+
+        spool = Spool(str(tmp_path))
+        recover_spills(
+            str(tmp_path),
+            "https://api.agentops.ai/v2/create_events",
+            "some_api_key",
+            1024,
+            spool=spool,
+        )
+        assert spool.replay(lambda record: True) == 0
+        assert planted.exists()
+
+    @as_root
+    def test_directory_of_another_user_is_not_used(self, tmp_path):
+        os.chown(tmp_path, OTHER_UID, OTHER_UID)
+        record = SpoolRecord(
+            url="https://api.agentops.ai/v2/create_events", payload=b"{}"
+        )
+        assert not Spool(str(tmp_path)).append(record)
+        assert list(tmp_path.iterdir()) == []
+
+    def test_default_directory_is_per_user(self):
+        if hasattr(os, "getuid"):
+            assert default_spool_dir().endswith(f"agentops-{os.getuid()}")
+
+    def test_orphaned_spills_discarded_without_spool(self, tmp_path):
+        orphan = tmp_path / "some_session.spill"
+        orphan.write_bytes(b'{"id": 0}\n')
+        recover_spills(
+            str(tmp_path),
+            "https://api.agentops.ai/v2/create_events",
+            None,
+            1024,
+            stale_after=-1,
+        )
+        assert list(tmp_path.iterdir()) == []
+
+
+class TestSessionSpool:
+    def setup_method(self):
+        self.api_key = "random_api_key"
+        self.url = "https://api.agentops.ai"
+
+    def test_failed_upload_is_replayed(self, tmp_path):
+        config = agentops.ClientConfiguration(
+            api_key=self.api_key,
+            max_wait_time=50,
+            spool_enabled=True,
+            spool_dir=str(tmp_path),
+        )
+        with requests_mock.Mocker() as m:
+            m.post(self.url + "/v2/create_session", json={"jwt": "some_jwt"})
+            m.post(self.url + "/v2/create_events", status_code=503)
+            m.post(self.url + "/v2/update_session", json={"token_cost": 5})
+
+            session = agentops.start_session(config=config)
+            session.record(ActionEvent("test_event_type"))
+            time.sleep(0.15)
+            assert session._spool.has_pending()
+
+            m.post(self.url + "/v2/create_events", json={"status": "ok"})
+            session.record(ActionEvent("test_event_type"))
+            deadline = time.monotonic() + 2
+            while session._spool.has_pending() and time.monotonic() < deadline:
+                time.sleep(0.05)
+            session.end_session("Success")
+
+            uploads = [
+                r.json() for r in m.request_history if r.path == "/v2/create_events"
+            ]
+
+        assert len(uploads) == 3
+        assert uploads[0] == uploads[2]
+        assert not session._spool.has_pending()
+
+    def test_coalesced_upload_replayed_with_api_key(self, tmp_path):
+        config = agentops.ClientConfiguration(
+            api_key=self.api_key,
+            max_wait_time=50,
+            spool_enabled=True,
+            spool_dir=str(tmp_path),
+            coalesce_uploads=True,
+        )
+        with requests_mock.Mocker() as m:
+            m.post(
+                self.url + "/v2/create_session",
+                json={"jwt": "some_jwt", "multi_session_events": True},
+            )
+            m.post(self.url + "/v2/create_events_batch", status_code=503)
+            m.post(self.url + "/v2/update_session", json={"token_cost": 5})
+
+            sessions = [agentops.start_session(config=config) for _ in range(2)]
+            for session in sessions:
+                assert session.wait_ready(1)
+            for session in sessions:
+                session.record(ActionEvent("test_event_type"))
+            time.sleep(0.2)
+            assert m.last_request.path == "/v2/create_events_batch"
+
+            m.post(self.url + "/v2/create_events_batch", json={"status": "ok"})
+            assert sessions[0]._spool.replay(send_record) == 1
+            replayed = m.last_request
+            for session in sessions:
+                session.end_session("Success")
+
+        assert replayed.path == "/v2/create_events_batch"
+        assert replayed.headers["X-Agentops-Api-Key"] == self.api_key
+        assert len(replayed.json()["sessions"]) == 2